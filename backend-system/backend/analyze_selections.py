@@ -0,0 +1,248 @@
+# analyze_selections.py — A/B preference rates with bootstrap confidence intervals
+#
+# Usage (from backend/):
+#   python analyze_selections.py --url http://localhost:4000                  # 直接拉 /api/export/selections
+#   python analyze_selections.py --input user_selections.ndjson --out report.json
+#   python analyze_selections.py --input export.csv --by image persona tech_comfort --resamples 20000
+#
+# 输入就是 GET /api/export/selections?include_users=true 的 NDJSON / CSV（不直接连库，也不 import main）：
+# - 读进来后全部转成列式 NumPy 数组：每个维度一列整数编码（np.unique(return_inverse)），A 选择是一列 0/1；
+# - 每组的 A 比例 = bincount(code, weights=is_a) / bincount(code)；
+# - bootstrap 默认按参与者重采样（同一个人的多次选择不独立）：先建 (用户 × 组) 的 A 次数 / 总次数矩阵，
+#   每轮重采样是一行「每人被抽中几次」的权重，所有维度共用，按块做矩阵乘法再取分位数，没有逐轮的 Python 循环；
+# - --unit row 时按选择重采样，等价于每组独立的二项分布抽样，同样整块生成。
+
+import argparse
+import csv
+import io
+import json
+import re
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+IMAGE_RE = re.compile(r"Persona_([^_]+)_Activity_([^_.]+)")
+
+# 列名与 storage_common.USER_EXPORT_COLUMNS 一致
+DEMOGRAPHIC_DIMENSIONS = ["age_range", "gender", "education_level", "occupation", "smart_assistant_exp", "tech_comfort"]
+DEFAULT_DIMENSIONS = ["overall", "image", "persona", "activity", *DEMOGRAPHIC_DIMENSIONS]
+
+# 一次矩阵乘法处理的重采样轮数（控制内存：轮数 × 用户数）
+RESAMPLE_CHUNK = 1000
+
+
+# -----------------------------------------
+# Loading
+# -----------------------------------------
+def iter_rows(text_stream: Iterable[str], fmt: str) -> Iterator[Dict[str, Any]]:
+    if fmt == "csv":
+        yield from csv.DictReader(text_stream)
+        return
+    for line in text_stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def open_export(args) -> Iterator[Dict[str, Any]]:
+    if args.url:
+        url = f"{args.url.rstrip('/')}/api/export/selections?format=ndjson&include_users=true&chunk_size=5000"
+        with urllib.request.urlopen(url) as resp:
+            yield from iter_rows(io.TextIOWrapper(resp, encoding="utf-8"), "ndjson")
+        return
+    path = Path(args.input)
+    fmt = "csv" if path.suffix.lower() == ".csv" else "ndjson"
+    with path.open("r", encoding="utf-8", newline="") as f:
+        yield from iter_rows(f, fmt)
+
+
+def label(v: Any) -> str:
+    return "unknown" if v in (None, "") else str(v)
+
+
+class Columns:
+    """选择记录的列式表示：users / is_a 以及每个维度的 (codes, labels)。"""
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        raw: Dict[str, List[str]] = {d: [] for d in ["image", "persona", "activity", *DEMOGRAPHIC_DIMENSIONS]}
+        user_ids: List[int] = []
+        is_a: List[bool] = []
+        self.skipped = 0
+        for r in rows:
+            sel = r.get("selection")
+            if sel not in ("A", "B"):
+                self.skipped += 1
+                continue
+            user_ids.append(int(r["user_id"]))
+            is_a.append(sel == "A")
+            image_id = str(r["image_id"])
+            m = IMAGE_RE.search(image_id)
+            raw["image"].append(image_id)
+            raw["persona"].append(m.group(1) if m else "unknown")
+            raw["activity"].append(m.group(2) if m else "unknown")
+            for d in DEMOGRAPHIC_DIMENSIONS:
+                raw[d].append(label(r.get(d)))
+
+        self.n = len(is_a)
+        self.is_a = np.asarray(is_a, dtype=np.float64)
+        self.user_labels, self.users = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+        self.dims: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            "overall": (np.zeros(self.n, dtype=np.int64), np.array(["all"]))
+        }
+        for d, values in raw.items():
+            labels, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+            self.dims[d] = (codes.astype(np.int64), labels)
+
+
+# -----------------------------------------
+# Rates + bootstrap
+# -----------------------------------------
+def resample_weights(n_users: int, r: int, rng: np.random.Generator) -> np.ndarray:
+    """(r, n_users)：每轮有放回抽 n_users 个参与者后，每人被抽中的次数。"""
+    idx = rng.integers(0, n_users, size=(r, n_users)) + (np.arange(r)[:, None] * n_users)
+    return np.bincount(idx.ravel(), minlength=r * n_users).reshape(r, n_users).astype(np.float64)
+
+
+def bootstrap_by_user(
+    cols: Columns, dims: List[str], resamples: int, rng: np.random.Generator
+) -> Dict[str, np.ndarray]:
+    """返回 {维度: (resamples, n_groups) 的 A 比例}；按参与者整体重采样。
+
+    所有维度的 (用户 × 组) 矩阵横向拼在一起，同一组权重一次矩阵乘法算完，各维度的 CI 也因此来自同一批重采样。
+    """
+    n_users = len(cols.user_labels)
+    a_parts, n_parts, widths = [], [], []
+    for dim in dims:
+        codes, labels = cols.dims[dim]
+        g = len(labels)
+        flat = cols.users * g + codes
+        a_parts.append(np.bincount(flat, weights=cols.is_a, minlength=n_users * g).reshape(n_users, g))
+        n_parts.append(np.bincount(flat, minlength=n_users * g).reshape(n_users, g))
+        widths.append(g)
+    a_ug = np.hstack(a_parts)
+    n_ug = np.hstack(n_parts).astype(np.float64)
+
+    out = np.empty((resamples, a_ug.shape[1]), dtype=np.float64)
+    for s in range(0, resamples, RESAMPLE_CHUNK):
+        r = min(RESAMPLE_CHUNK, resamples - s)
+        w = resample_weights(n_users, r, rng)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[s : s + r] = (w @ a_ug) / (w @ n_ug)
+    bounds = np.cumsum([0, *widths])
+    return {dim: out[:, bounds[i] : bounds[i + 1]] for i, dim in enumerate(dims)}
+
+
+def bootstrap_by_row(
+    a_counts: np.ndarray, n_counts: np.ndarray, resamples: int, rng: np.random.Generator
+) -> np.ndarray:
+    """按选择重采样：组内有放回抽样等价于 Binomial(n, p)。"""
+    p = np.divide(a_counts, n_counts, out=np.zeros_like(a_counts), where=n_counts > 0)
+    draws = rng.binomial(n_counts.astype(np.int64), p, size=(resamples, len(p)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return draws / n_counts
+
+
+def analyze_dimension(
+    cols: Columns, dim: str, args, rng: np.random.Generator, boot: Optional[np.ndarray] = None
+) -> List[Dict[str, Any]]:
+    codes, labels = cols.dims[dim]
+    g = len(labels)
+    n_counts = np.bincount(codes, minlength=g).astype(np.float64)
+    a_counts = np.bincount(codes, weights=cols.is_a, minlength=g)
+    users_per_group = np.bincount(np.unique(cols.users * g + codes) % g, minlength=g)
+    rate = a_counts / n_counts
+
+    if boot is None:
+        boot = bootstrap_by_row(a_counts, n_counts, args.resamples, rng)
+    alpha = (1.0 - args.confidence) / 2.0
+    lo, hi = np.nanquantile(boot, [alpha, 1.0 - alpha], axis=0)
+
+    out = []
+    for i in np.argsort(-n_counts, kind="stable"):
+        if n_counts[i] < args.min_n:
+            continue
+        out.append(
+            {
+                "group": str(labels[i]),
+                "n": int(n_counts[i]),
+                "users": int(users_per_group[i]),
+                "rate_a": round(float(rate[i]), 4),
+                "ci_low": round(float(lo[i]), 4),
+                "ci_high": round(float(hi[i]), 4),
+                # CI 不包含 0.5：这一组对 A 或 B 有明确偏好
+                "preference": "A" if lo[i] > 0.5 else ("B" if hi[i] < 0.5 else None),
+            }
+        )
+    return out
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="A/B preference rates with vectorized bootstrap CIs.")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--input", help="Export file from /api/export/selections?include_users=true (.ndjson or .csv)")
+    src.add_argument("--url", help="Backend base URL; streams the export directly")
+    parser.add_argument("--by", nargs="+", default=DEFAULT_DIMENSIONS,
+                        help=f"Dimensions to report (default: {' '.join(DEFAULT_DIMENSIONS)})")
+    parser.add_argument("--resamples", type=int, default=10000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--unit", choices=["user", "row"], default="user",
+                        help="Bootstrap unit: resample participants (default) or individual selections")
+    parser.add_argument("--min_n", type=int, default=1, help="Hide groups with fewer selections")
+    parser.add_argument("--top", type=int, default=10, help="Groups printed per dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Write the full report as JSON")
+    args = parser.parse_args()
+
+    unknown = [d for d in args.by if d not in DEFAULT_DIMENSIONS]
+    if unknown:
+        raise SystemExit(f"❌ Unknown dimension(s): {', '.join(unknown)}")
+
+    t0 = time.perf_counter()
+    cols = Columns(open_export(args))
+    t_load = time.perf_counter() - t0
+    if cols.n == 0:
+        raise SystemExit("❌ No A/B selections in the export")
+    print(f"📥 {cols.n} selection(s) from {len(cols.user_labels)} participant(s) in {t_load:.2f}s"
+          + (f" ({cols.skipped} row(s) without A/B skipped)" if cols.skipped else ""))
+
+    rng = np.random.default_rng(args.seed)
+    report: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "selections": cols.n,
+        "participants": int(len(cols.user_labels)),
+        "resamples": args.resamples,
+        "confidence": args.confidence,
+        "unit": args.unit,
+        "dimensions": {},
+    }
+    t1 = time.perf_counter()
+    boots = bootstrap_by_user(cols, args.by, args.resamples, rng) if args.unit == "user" else {}
+    for dim in args.by:
+        rows = analyze_dimension(cols, dim, args, rng, boots.get(dim))
+        report["dimensions"][dim] = rows
+        print(f"\n== {dim} ({len(rows)} group(s)) ==")
+        print(f"   {'group':<32} {'n':>6} {'users':>6}  {'P(A)':>6}  {int(args.confidence * 100)}% CI")
+        for r in rows[: args.top]:
+            flag = f"  → prefers {r['preference']}" if r["preference"] else ""
+            print(f"   {r['group'][:32]:<32} {r['n']:>6} {r['users']:>6}  {r['rate_a']:>6.3f}  "
+                  f"[{r['ci_low']:.3f}, {r['ci_high']:.3f}]{flag}")
+        if len(rows) > args.top:
+            print(f"   … {len(rows) - args.top} more")
+    report["seconds"] = {"load": round(t_load, 3), "analysis": round(time.perf_counter() - t1, 3)}
+    print(f"\n⏱  load {t_load:.2f}s, analysis {report['seconds']['analysis']:.2f}s "
+          f"({args.resamples} resamples × {len(args.by)} dimension(s))")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"🗂 Report written: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# bench_list_endpoints.py — Compare the Pydantic list path with the json_agg fast path
+#
+# Usage (from backend/):
+#   python bench_list_endpoints.py --iterations 50
+#   python bench_list_endpoints.py --seed_users 5000 --seed_selections 40
+#
+# --seed_* 会在一个事务里插入假数据，跑完后整体 ROLLBACK，不会污染真实数据。
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Callable, List
+
+import asyncpg
+from fastapi.encoders import jsonable_encoder
+
+from main import (
+    SelectionOut,
+    USER_SELECTIONS_JSON_SQL,
+    USERS_JSON_SQL,
+    UserOut,
+    db_connect_kwargs,
+)
+
+
+# -----------------------------------------
+# 旧路径：Record -> Pydantic -> jsonable_encoder -> json.dumps
+# （与 FastAPI 处理 response_model=List[...] 时做的事情一致）
+# -----------------------------------------
+async def legacy_users(conn: asyncpg.Connection) -> bytes:
+    rows = await conn.fetch(
+        """
+        SELECT id, age_range, gender, education_level, occupation,
+               smart_assistant_exp, tech_comfort
+        FROM users
+        ORDER BY id ASC
+        """
+    )
+    items = [UserOut(**dict(r)) for r in rows]
+    return json.dumps(jsonable_encoder(items)).encode("utf-8")
+
+
+async def legacy_selections(conn: asyncpg.Connection, user_id: int) -> bytes:
+    rows = await conn.fetch(
+        """
+        SELECT user_id, image_id, selection
+        FROM user_selections
+        WHERE user_id = $1
+        ORDER BY image_id ASC
+        """,
+        user_id,
+    )
+    items = [SelectionOut(**dict(r)) for r in rows]
+    return json.dumps(jsonable_encoder(items)).encode("utf-8")
+
+
+# -----------------------------------------
+# 新路径：Postgres json_agg，直接拿文本
+# -----------------------------------------
+async def fast_users(conn: asyncpg.Connection) -> bytes:
+    return (await conn.fetchval(USERS_JSON_SQL)).encode("utf-8")
+
+
+async def fast_selections(conn: asyncpg.Connection, user_id: int) -> bytes:
+    return (await conn.fetchval(USER_SELECTIONS_JSON_SQL, user_id)).encode("utf-8")
+
+
+# -----------------------------------------
+# Helpers
+# -----------------------------------------
+async def seed(conn: asyncpg.Connection, n_users: int, n_selections: int) -> int:
+    user_ids = await conn.fetch(
+        """
+        INSERT INTO users (age_range, gender, education_level, occupation,
+                           smart_assistant_exp, tech_comfort)
+        SELECT '25-34', 'other', 'bachelor', 'bench', 'weekly', (g % 7) + 1
+        FROM generate_series(1, $1) g
+        RETURNING id
+        """,
+        n_users,
+    )
+    if not user_ids:
+        return 0
+    first_id = user_ids[0]["id"]
+    await conn.execute(
+        """
+        INSERT INTO user_selections (user_id, image_id, selection)
+        SELECT $1, 'Persona_0_Activity_' || g,
+               CASE WHEN g % 2 = 0 THEN 'A' ELSE 'B' END
+        FROM generate_series(1, $2) g
+        """,
+        first_id,
+        n_selections,
+    )
+    return first_id
+
+
+async def timeit(fn: Callable, iterations: int) -> List[float]:
+    await fn()  # warm-up（prepared statement 缓存等）
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples
+
+
+def report(label: str, samples: List[float], size: int) -> None:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"  {label:<8} median={statistics.median(samples):8.3f} ms  "
+        f"p95={p95:8.3f} ms  bytes={size}"
+    )
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+async def run(args) -> None:
+    conn = await asyncpg.connect(**db_connect_kwargs())
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        user_id = args.user_id
+        if args.seed_users:
+            seeded = await seed(conn, args.seed_users, args.seed_selections)
+            user_id = user_id or seeded
+        if user_id is None:
+            user_id = await conn.fetchval("SELECT MIN(user_id) FROM user_selections") or 0
+
+        cases = [
+            ("GET /api/users", lambda: legacy_users(conn), lambda: fast_users(conn)),
+            (
+                f"GET /api/users/{user_id}/selections",
+                lambda: legacy_selections(conn, user_id),
+                lambda: fast_selections(conn, user_id),
+            ),
+        ]
+        for name, legacy, fast in cases:
+            # 两条路径的输出必须是同一个 JSON
+            if json.loads(await legacy()) != json.loads(await fast()):
+                raise SystemExit(f"❌ Payload mismatch for {name}")
+            print(f"📊 {name}")
+            report("legacy", await timeit(legacy, args.iterations), len(await legacy()))
+            report("json_agg", await timeit(fast, args.iterations), len(await fast()))
+    finally:
+        await tr.rollback()
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark list endpoints: Pydantic path vs json_agg path.")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--user_id", type=int, default=None, help="User for the selections benchmark")
+    parser.add_argument("--seed_users", type=int, default=0, help="Insert N fake users (rolled back)")
+    parser.add_argument("--seed_selections", type=int, default=0, help="Selections for the first seeded user")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+# import_results.py — Bulk import of the viewer's offline result files (*_Reflection.json)
+#
+# Usage (from backend/):
+#   python import_results.py results/                       # 目录 / 文件 / glob 都可以
+#   python import_results.py results/*.json --dry_run       # 全流程跑一遍，最后 ROLLBACK
+#   python import_results.py results/ --overwrite --report import_report.json
+#
+# 连不上后端时 viewer 用 downloadJson 保存结果：
+#   {userId, generatedAt, pre, phaseI: [{persona, activity, imageName, choice}], phaseII, post}
+# imageName 是带扩展名的文件名，入库前转成 Persona_X_Activity_Y（与在线写入的 image_id 一致），
+# 不是刺激名字的行不导入，列在报告的 bad_rows 里。
+# 这里不走 create_user / upsert_selection 逐行 HTTP，而是：
+# - 逐个文件流式读取；内容完全相同的文件只算一次，同一 (user, image) 以 generatedAt 最新的为准，
+#   不同文件之间给出不同答案的记一条 in-batch disagreement；
+# - 用 COPY 灌进临时 staging 表，在同一个事务里 merge 进 users / user_selections，
+#   并同步更新 image_selection_counts（与 write_selection 的增量口径一致）；
+# - 库里已有且答案不同的行是 conflict：默认保留库里的值，--overwrite 时以文件为准；都写进报告。
+#
+# userId 必须是后端的 users.id（数字）；非数字的文件整体拒绝并列在报告里。
+# 后端在跑时也可以导入，只是它的读缓存要等 CACHE_TTL_SECONDS 过期才看得到新数据。
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import asyncpg
+
+from main import db_connect_kwargs, ensure_schema, ensure_selection_counts
+from storage_common import USER_EXPORT_COLUMNS, image_key
+
+# viewer 的 pre 问卷可能用 camelCase
+USER_FIELD_ALIASES = {
+    "age_range": ("age_range", "ageRange"),
+    "gender": ("gender",),
+    "education_level": ("education_level", "educationLevel"),
+    "occupation": ("occupation",),
+    "smart_assistant_exp": ("smart_assistant_exp", "smartAssistantExp"),
+    "tech_comfort": ("tech_comfort", "techComfort"),
+}
+
+STAGING_DDL = """
+    CREATE TEMP TABLE import_users (
+        id                  BIGINT PRIMARY KEY,
+        age_range           TEXT,
+        gender              TEXT,
+        education_level     TEXT,
+        occupation          TEXT,
+        smart_assistant_exp TEXT,
+        tech_comfort        INT
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE import_selections (
+        user_id   BIGINT NOT NULL,
+        image_id  TEXT   NOT NULL,
+        selection TEXT   NOT NULL,
+        source    TEXT   NOT NULL,
+        PRIMARY KEY (user_id, image_id)
+    ) ON COMMIT DROP;
+"""
+
+# 先锁住库里所有会被这次导入碰到的行，import_conflicts 在 merge 期间不会过期
+LOCK_EXISTING_SQL = """
+    SELECT 1
+    FROM user_selections s
+    JOIN import_selections i USING (user_id, image_id)
+    FOR UPDATE OF s
+"""
+
+# 库里答案不同的行；--overwrite 和计数修正都基于这张表
+CONFLICTS_SQL = """
+    CREATE TEMP TABLE import_conflicts ON COMMIT DROP AS
+    SELECT s.user_id, s.image_id, s.selection AS db_selection,
+           i.selection AS file_selection, i.source
+    FROM import_selections i
+    JOIN user_selections s USING (user_id, image_id)
+    WHERE s.selection <> i.selection
+    ORDER BY s.user_id, s.image_id
+"""
+
+MERGE_USERS_SQL = f"""
+    WITH ins AS (
+        INSERT INTO users (id, {", ".join(USER_EXPORT_COLUMNS)})
+        OVERRIDING SYSTEM VALUE
+        SELECT id, {", ".join(USER_EXPORT_COLUMNS)} FROM import_users
+        ON CONFLICT (id) DO UPDATE SET
+            {", ".join(f"{c} = COALESCE(users.{c}, EXCLUDED.{c})" for c in USER_EXPORT_COLUMNS)}
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT COUNT(*) FILTER (WHERE inserted) FROM ins
+"""
+
+# 显式写入 id 之后把序列推到最大值，之后 create_user 不会撞号
+SYNC_USER_SEQUENCE_SQL = """
+    SELECT setval(pg_get_serial_sequence('users', 'id'), GREATEST((SELECT MAX(id) FROM users), 1))
+"""
+
+INSERT_SELECTIONS_SQL = """
+    WITH ins AS (
+        INSERT INTO user_selections (user_id, image_id, selection)
+        SELECT user_id, image_id, selection FROM import_selections
+        ON CONFLICT (user_id, image_id) DO NOTHING
+        RETURNING image_id, selection
+    ), bump AS (
+        INSERT INTO image_selection_counts (image_id, count_a, count_b)
+        SELECT image_id,
+               COUNT(*) FILTER (WHERE selection = 'A'),
+               COUNT(*) FILTER (WHERE selection = 'B')
+        FROM ins
+        GROUP BY image_id
+        ON CONFLICT (image_id)
+        DO UPDATE SET count_a = image_selection_counts.count_a + EXCLUDED.count_a,
+                      count_b = image_selection_counts.count_b + EXCLUDED.count_b,
+                      updated_at = NOW()
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM ins
+"""
+
+OVERWRITE_CONFLICTS_SQL = """
+    WITH upd AS (
+        UPDATE user_selections s
+        SET selection = c.file_selection,
+            updated_at = NOW()
+        FROM import_conflicts c
+        WHERE s.user_id = c.user_id AND s.image_id = c.image_id
+        RETURNING s.user_id
+    ), bump AS (
+        INSERT INTO image_selection_counts (image_id, count_a, count_b)
+        SELECT image_id,
+               COUNT(*) FILTER (WHERE file_selection = 'A') - COUNT(*) FILTER (WHERE db_selection = 'A'),
+               COUNT(*) FILTER (WHERE file_selection = 'B') - COUNT(*) FILTER (WHERE db_selection = 'B')
+        FROM import_conflicts
+        GROUP BY image_id
+        ON CONFLICT (image_id)
+        DO UPDATE SET count_a = image_selection_counts.count_a + EXCLUDED.count_a,
+                      count_b = image_selection_counts.count_b + EXCLUDED.count_b,
+                      updated_at = NOW()
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM upd
+"""
+
+
+# -----------------------------------------
+# Reading result files
+# -----------------------------------------
+def iter_result_files(inputs: List[str]) -> Iterator[Path]:
+    seen = set()
+    for arg in inputs:
+        p = Path(arg)
+        if p.is_dir():
+            candidates = sorted(p.rglob("*.json"))
+        else:
+            candidates = [Path(x) for x in sorted(glob.glob(arg))] or [p]
+        for f in candidates:
+            key = f.resolve()
+            if key not in seen:
+                seen.add(key)
+                yield f
+
+
+def parse_user_id(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if value > 0 else None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip()) or None
+    return None
+
+
+def user_fields(pre: Any) -> Dict[str, Any]:
+    out = {c: None for c in USER_EXPORT_COLUMNS}
+    if not isinstance(pre, dict):
+        return out
+    for col, aliases in USER_FIELD_ALIASES.items():
+        for a in aliases:
+            if pre.get(a) not in (None, ""):
+                out[col] = pre[a]
+                break
+    if out["tech_comfort"] is not None:
+        try:
+            out["tech_comfort"] = int(out["tech_comfort"])
+        except (TypeError, ValueError):
+            out["tech_comfort"] = None
+    for col in USER_EXPORT_COLUMNS:
+        if col != "tech_comfort" and out[col] is not None:
+            out[col] = str(out[col])
+    return out
+
+
+class ResultBatch:
+    """把多个结果文件合并成去重后的 users / selections，并记录被拒绝的内容。"""
+
+    def __init__(self):
+        self.users: Dict[int, Dict[str, Any]] = {}
+        # (user_id, image_id) -> (selection, generatedAt, source)
+        self.selections: Dict[Tuple[int, str], Tuple[str, str, str]] = {}
+        self.file_hashes: Dict[str, str] = {}
+        self.stats = {"files": 0, "duplicate_files": 0, "rejected_files": 0, "rejected_rows": 0}
+        self.rejected: List[Dict[str, str]] = []
+        self.bad_rows: List[Dict[str, Any]] = []
+        self.disagreements: List[Dict[str, Any]] = []
+
+    def reject(self, source: str, reason: str) -> None:
+        self.stats["rejected_files"] += 1
+        self.rejected.append({"file": source, "reason": reason})
+
+    def add_file(self, path: Path) -> None:
+        self.stats["files"] += 1
+        raw = path.read_bytes()
+        digest = hashlib.sha1(raw).hexdigest()
+        if digest in self.file_hashes:
+            self.stats["duplicate_files"] += 1
+            return
+        self.file_hashes[digest] = str(path)
+        try:
+            data = json.loads(raw)
+        except ValueError as e:
+            self.reject(str(path), f"invalid JSON: {e}")
+            return
+        if not isinstance(data, dict) or not isinstance(data.get("phaseI"), list):
+            self.reject(str(path), "not a viewer result file (missing phaseI)")
+            return
+        user_id = parse_user_id(data.get("userId"))
+        if user_id is None:
+            self.reject(str(path), f"userId {data.get('userId')!r} is not a backend user id")
+            return
+
+        fields = user_fields(data.get("pre"))
+        prev = self.users.get(user_id)
+        if prev is None:
+            self.users[user_id] = fields
+        else:
+            for col, v in fields.items():
+                if prev[col] is None:
+                    prev[col] = v
+
+        generated_at = str(data.get("generatedAt") or "")
+        for rec in data["phaseI"]:
+            name = rec.get("imageName") if isinstance(rec, dict) else None
+            choice = rec.get("choice") if isinstance(rec, dict) else None
+            image_id = image_key(name) if isinstance(name, str) else None
+            if not image_id or choice not in ("A", "B"):
+                self.stats["rejected_rows"] += 1
+                reason = "not a stimulus name" if not image_id else f"choice {choice!r} is not A/B"
+                self.bad_rows.append({"file": str(path), "imageName": name, "reason": reason})
+                continue
+            k = (user_id, image_id)
+            old = self.selections.get(k)
+            if old is not None and old[0] != choice:
+                self.disagreements.append(
+                    {
+                        "user_id": user_id,
+                        "image_id": image_id,
+                        "selections": {old[2]: old[0], str(path): choice},
+                    }
+                )
+            # ISO 时间戳可以直接按字符串比较；同一时间以后读到的文件为准
+            if old is None or generated_at >= old[1]:
+                self.selections[k] = (choice, generated_at, str(path))
+
+
+# -----------------------------------------
+# Load + merge
+# -----------------------------------------
+async def load(conn: asyncpg.Connection, batch: ResultBatch, overwrite: bool, dry_run: bool) -> Dict[str, Any]:
+    timings: Dict[str, float] = {}
+    result: Dict[str, Any] = {}
+
+    t0 = time.perf_counter()
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        await conn.execute(STAGING_DDL)
+        await conn.copy_records_to_table(
+            "import_users",
+            records=[(uid, *(f[c] for c in USER_EXPORT_COLUMNS)) for uid, f in batch.users.items()],
+            columns=["id", *USER_EXPORT_COLUMNS],
+        )
+        await conn.copy_records_to_table(
+            "import_selections",
+            records=[(uid, img, sel, src) for (uid, img), (sel, _, src) in batch.selections.items()],
+            columns=["user_id", "image_id", "selection", "source"],
+        )
+        timings["copy_s"] = time.perf_counter() - t0
+
+        t1 = time.perf_counter()
+        await conn.execute(LOCK_EXISTING_SQL)
+        await conn.execute(CONFLICTS_SQL)
+        result["users_inserted"] = await conn.fetchval(MERGE_USERS_SQL)
+        await conn.fetchval(SYNC_USER_SEQUENCE_SQL)
+        result["selections_inserted"] = await conn.fetchval(INSERT_SELECTIONS_SQL)
+        result["selections_overwritten"] = await conn.fetchval(OVERWRITE_CONFLICTS_SQL) if overwrite else 0
+        conflicts = await conn.fetch(
+            "SELECT user_id, image_id, db_selection, file_selection, source FROM import_conflicts"
+        )
+        result["conflicts"] = [dict(r) for r in conflicts]
+        timings["merge_s"] = time.perf_counter() - t1
+    except BaseException:
+        await tr.rollback()
+        raise
+    if dry_run:
+        await tr.rollback()
+    else:
+        await tr.commit()
+    result["timings"] = {k: round(v, 3) for k, v in timings.items()}
+    return result
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+async def run(args) -> None:
+    t0 = time.perf_counter()
+    batch = ResultBatch()
+    for f in iter_result_files(args.inputs):
+        batch.add_file(f)
+    read_s = time.perf_counter() - t0
+    s = batch.stats
+    print(
+        f"📂 Read {s['files']} file(s) in {read_s:.2f}s: {s['duplicate_files']} duplicate, "
+        f"{s['rejected_files']} rejected, {s['rejected_rows']} bad row(s) skipped"
+    )
+    print(f"   {len(batch.users)} user(s), {len(batch.selections)} selection(s), "
+          f"{len(batch.disagreements)} in-batch disagreement(s)")
+    if not batch.users:
+        raise SystemExit("❌ Nothing to import")
+
+    conn = await asyncpg.connect(**db_connect_kwargs())
+    try:
+        await ensure_schema(conn)
+        await ensure_selection_counts(conn)
+        result = await load(conn, batch, args.overwrite, args.dry_run)
+    finally:
+        await conn.close()
+
+    conflicts = result["conflicts"]
+    print(
+        f"{'🧪 Dry run (rolled back)' if args.dry_run else '✅ Committed'}: "
+        f"{result['users_inserted']} new user(s), {result['selections_inserted']} new selection(s), "
+        f"{len(conflicts)} conflict(s) "
+        f"({'overwritten' if args.overwrite else 'kept database value'}); "
+        f"copy {result['timings']['copy_s']:.2f}s, merge {result['timings']['merge_s']:.2f}s"
+    )
+    for c in conflicts[:10]:
+        print(f"⚠️  user {c['user_id']} / {c['image_id']}: db={c['db_selection']} file={c['file_selection']} ({c['source']})")
+    if len(conflicts) > 10:
+        print(f"   … {len(conflicts) - 10} more (see --report)")
+    for r in batch.rejected:
+        print(f"❌ {r['file']}: {r['reason']}")
+
+    if args.report:
+        report = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "dry_run": args.dry_run,
+            "overwrite": args.overwrite,
+            "read_s": round(read_s, 3),
+            **batch.stats,
+            "users": len(batch.users),
+            "selections": len(batch.selections),
+            **result,
+            "rejected": batch.rejected,
+            "bad_rows": batch.bad_rows,
+            "disagreements": batch.disagreements,
+        }
+        Path(args.report).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"🗂 Report written: {args.report}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import offline viewer result files via COPY.")
+    parser.add_argument("inputs", nargs="+", help="Result files, directories or glob patterns")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="On conflict, replace the database selection with the file's")
+    parser.add_argument("--dry_run", action="store_true", help="Run the whole import, then roll back")
+    parser.add_argument("--report", default=None, help="Write a JSON report (conflicts, rejects, timings)")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# loadtest.py — Drive a realistic request mix against the backend and record latency
+#
+# Usage (server already running against a local Postgres):
+#   python loadtest.py --concurrency 40 --duration 60
+#   python loadtest.py --mix create=1,list=6,upsert=12 --out results/pool10.json
+#   python loadtest.py --compare results/pool5.json results/pool10.json
+#
+# 每个 worker 是一个模拟参与者：先 create_user，然后按 --mix 权重随机发
+# create / list（list_user_selections）/ upsert（upsert_selection）请求。
+# 结果（吞吐、p50/p95/p99、错误率）打印出来并存成 JSON，方便调连接池或改 SQL 前后对比。
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+OPS = ("create", "list", "upsert")
+IMAGE_IDS = [f"Persona_{p}_Activity_{a}" for p in (4, 17, 26, 40, 63, 97) for a in range(100, 200)]
+
+
+# -----------------------------------------
+# Helpers
+# -----------------------------------------
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPS:
+            raise SystemExit(f"❌ Unknown op in --mix: {name} (valid: {', '.join(OPS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_ms: List[float], q: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    idx = min(len(sorted_ms) - 1, max(0, int(round(q * (len(sorted_ms) - 1)))))
+    return sorted_ms[idx]
+
+
+def summarize(samples: List[float], errors: int, elapsed: float) -> Dict:
+    ms = sorted(samples)
+    total = len(ms) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": (errors / total) if total else 0.0,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(ms, 0.50),
+        "p95_ms": percentile(ms, 0.95),
+        "p99_ms": percentile(ms, 0.99),
+        "max_ms": ms[-1] if ms else 0.0,
+    }
+
+
+def random_user() -> Dict:
+    return {
+        "age_range": random.choice(["18-24", "25-34", "35-44", "45-54", "55+"]),
+        "gender": random.choice(["female", "male", "other"]),
+        "education_level": random.choice(["high_school", "bachelor", "master", "phd"]),
+        "occupation": "loadtest",
+        "smart_assistant_exp": random.choice(["never", "monthly", "weekly", "daily"]),
+        "tech_comfort": random.randint(1, 7),
+    }
+
+
+# -----------------------------------------
+# Worker
+# -----------------------------------------
+async def worker(client: httpx.AsyncClient, mix: Dict[str, float], deadline: float,
+                 samples: Dict[str, List[float]], errors: Dict[str, int]) -> None:
+    ops = list(mix)
+    weights = [mix[o] for o in ops]
+    user_id = None
+
+    async def timed(op: str, method: str, url: str, **kw):
+        t0 = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kw)
+            ok = resp.status_code < 400
+        except httpx.HTTPError:
+            resp, ok = None, False
+        dt = (time.perf_counter() - t0) * 1000.0
+        if ok:
+            samples[op].append(dt)
+        else:
+            errors[op] += 1
+        return resp if ok else None
+
+    while time.perf_counter() < deadline:
+        op = "create" if user_id is None else random.choices(ops, weights)[0]
+        if op == "create":
+            resp = await timed("create", "POST", "/api/users", json=random_user())
+            if resp is not None:
+                user_id = resp.json()["id"]
+        elif op == "list":
+            await timed("list", "GET", f"/api/users/{user_id}/selections")
+        else:
+            await timed("upsert", "PUT", "/api/selections", json={
+                "user_id": user_id,
+                "image_id": random.choice(IMAGE_IDS),
+                "selection": random.choice("AB"),
+            })
+
+
+# -----------------------------------------
+# Run / compare
+# -----------------------------------------
+async def run(args) -> Dict:
+    mix = parse_mix(args.mix)
+    samples = {op: [] for op in OPS}
+    errors = {op: 0 for op in OPS}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        health = await client.get("/api/health")
+        health.raise_for_status()
+
+        print(f"🚀 {args.concurrency} workers × {args.duration}s against {args.base_url} (mix {mix})")
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(worker(client, mix, deadline, samples, errors) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    all_samples = [x for op in OPS for x in samples[op]]
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "duration_s": elapsed,
+        "mix": mix,
+        "label": args.label,
+        "overall": summarize(all_samples, sum(errors.values()), elapsed),
+        "ops": {op: summarize(samples[op], errors[op], elapsed) for op in OPS},
+    }
+
+
+def print_result(res: Dict) -> None:
+    rows = [("overall", res["overall"])] + list(res["ops"].items())
+    print(f"{'op':<8} {'reqs':>8} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'err%':>6}")
+    for name, r in rows:
+        print(
+            f"{name:<8} {r['requests']:>8} {r['throughput_rps']:>9.1f} "
+            f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {100 * r['error_rate']:>6.2f}"
+        )
+
+
+def compare(path_a: Path, path_b: Path) -> None:
+    a = json.loads(path_a.read_text(encoding="utf-8"))
+    b = json.loads(path_b.read_text(encoding="utf-8"))
+    print(f"📊 {path_a.name} → {path_b.name}")
+    print(f"{'op':<8} {'metric':<15} {'before':>10} {'after':>10} {'change':>9}")
+    for name in ("overall",) + OPS:
+        ra = a["overall"] if name == "overall" else a["ops"].get(name)
+        rb = b["overall"] if name == "overall" else b["ops"].get(name)
+        if not ra or not rb:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate"):
+            va, vb = ra[metric], rb[metric]
+            change = f"{100 * (vb - va) / va:+.1f}%" if va else "n/a"
+            print(f"{name:<8} {metric:<15} {va:>10.3f} {vb:>10.3f} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HCI study backend.")
+    parser.add_argument("--base_url", default="http://localhost:4000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--mix", default="create=1,list=5,upsert=10", help="Op weights, e.g. create=1,list=5,upsert=10")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--label", default="", help="Free-form note stored with the results (e.g. 'pool max_size=10')")
+    parser.add_argument("--out", default=None, help="Result JSON path (default loadtest_results/<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(Path(args.compare[0]), Path(args.compare[1]))
+        return
+
+    res = asyncio.run(run(args))
+    print_result(res)
+
+    out = Path(args.out or f"loadtest_results/{datetime.now():%Y%m%d_%H%M%S}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(res, indent=2), encoding="utf-8")
+    print(f"🗂 Results written: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,37 @@
+import asyncio
+import contextlib
+import csv
+import hashlib
+import heapq
+import io
+import json
 import os
-from typing import List, Optional
+import random
+import re
+import time
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
 
 import asyncpg
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from storage_common import (
+    RESYNC_EVENT,
+    SELECTION_EXPORT_COLUMNS,
+    USER_EXPORT_COLUMNS,
+    build_export_sql,
+    count_deltas,
+    selection_event,
+    user_event,
+)
+
 # ================= 环境变量 & DB 配置 =================
 
 load_dotenv()
@@ -27,6 +52,38 @@ else:
 
 API_PORT = int(os.getenv("API_PORT", "4000"))
 
+# 读缓存：TTL 秒数 / 最多条目数（CACHE_TTL_SECONDS=0 关闭缓存）
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "4096"))
+
+# 选择写入的 write-behind 模式（默认关闭，同步写库）
+SELECTION_WRITE_BEHIND = os.getenv("SELECTION_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "20"))
+WRITE_BEHIND_JOURNAL = os.getenv("WRITE_BEHIND_JOURNAL", "selection_journal.ndjson")
+
+# 启动时的查询计划检查：fail（默认，发现全表扫描就拒绝启动）/ warn / off
+SCHEMA_PLAN_CHECK = os.getenv("SCHEMA_PLAN_CHECK", "fail").lower()
+
+# 存储后端：postgres（默认）/ sqlite（单机实验用的嵌入式库，WAL 模式，不需要数据库服务）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "hci_study.sqlite3")
+
+# 刺激材料（PhaseData 里的 JPG + _Description.txt），默认直接指向前端的 assets 目录
+STIMULI_DIR = Path(
+    os.getenv(
+        "STIMULI_DIR",
+        str(Path(__file__).resolve().parents[2] / "frontend-viewer" / "src" / "assets" / "PhaseData"),
+    )
+)
+
+# 实时事件流（GET /api/events）：Postgres NOTIFY 频道名、每个订阅者最多积压的事件数、断线重连时可补发的事件数
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "hci_events")
+EVENTS_CLIENT_BUFFER = int(os.getenv("EVENTS_CLIENT_BUFFER", "256"))
+EVENTS_REPLAY = int(os.getenv("EVENTS_REPLAY", "512"))
+
+# 每个参与者分配的刺激数量（0 = 不做服务端分配，前端照旧加载全部 PhaseData）
+ALLOCATION_SIZE = int(os.getenv("ALLOCATION_SIZE", "0"))
+
 app = FastAPI(title="HCI Study Backend")
 
 # 前端（Vite）默认端口 5173
@@ -43,6 +100,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Content-Range", "Accept-Ranges", "Content-Encoding"],
 )
 
 # ================= Pydantic 模型 =================
@@ -72,124 +130,814 @@ class SelectionOut(BaseModel):
     selection: str
 
 
+class ImageCountsOut(BaseModel):
+    image_id: str
+    count_a: int
+    count_b: int
+    total: int
+
+
+class AllocationOut(BaseModel):
+    user_id: int
+    image_ids: List[str]  # 按展示顺序
+
+
+# ================= Metrics =================
+# 进程内的 Prometheus 风格指标，GET /metrics 以文本格式导出：
+# - http_request_duration_seconds{method,route,status}：整个请求耗时（直方图）
+# - http_handler_duration_seconds{route}：扣除数据库查询后的 Python 处理耗时
+# - db_query_duration_seconds / db_pool_acquire_seconds：查询耗时与等连接耗时
+# - http_requests_in_flight：当前处理中的请求数
+# route 用路由模板（/api/users/{user_id}），避免每个 user_id 一个标签。
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 当前请求累计的数据库耗时（秒），由 MeteredConnection 累加
+request_db_time: ContextVar[Optional[List[float]]] = ContextVar("request_db_time", default=None)
+
+
+def add_request_db_time(dt: float) -> None:
+    acc = request_db_time.get()
+    if acc is not None:
+        acc[0] += dt
+
+
+def record_db_query(dt: float) -> None:
+    metrics.db_query.observe(dt)
+    add_request_db_time(dt)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [bucket counts..., sum, count]
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                s[i] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, s in sorted(self.series.items()):
+            base = ",".join(f'{k}="{v}"' for k, v in zip(self.label_names, labels))
+            sep = "," if base else ""
+            for b, c in zip(self.buckets, s):
+                out.append(f'{self.name}_bucket{{{base}{sep}le="{b}"}} {c}')
+            out.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {s[-1]}')
+            suffix = f"{{{base}}}" if base else ""
+            out.append(f"{self.name}_sum{suffix} {s[-2]:.6f}")
+            out.append(f"{self.name}_count{suffix} {s[-1]}")
+        return out
+
+
+class Metrics:
+    def __init__(self):
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Total request latency.", ("method", "route", "status")
+        )
+        self.handler_duration = Histogram(
+            "http_handler_duration_seconds", "Request latency excluding database query time.", ("route",)
+        )
+        self.db_query = Histogram("db_query_duration_seconds", "Database query latency.")
+        self.pool_acquire = Histogram("db_pool_acquire_seconds", "Time spent waiting for a pool connection.")
+        self.in_flight = 0
+
+    def render(self, pool=None) -> str:
+        lines = []
+        for h in (self.request_duration, self.handler_duration, self.db_query, self.pool_acquire):
+            lines.extend(h.render())
+        lines += [
+            "# HELP http_requests_in_flight Requests currently being processed.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+        ]
+        if pool is not None:
+            lines += [
+                "# HELP db_pool_size Open connections in the pool.",
+                "# TYPE db_pool_size gauge",
+                f"db_pool_size {pool.get_size()}",
+                "# HELP db_pool_idle Idle connections in the pool.",
+                "# TYPE db_pool_idle gauge",
+                f"db_pool_idle {pool.get_idle_size()}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件（不用 BaseHTTPMiddleware，避免多一层 task 和对流式响应的干扰）。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        db_time = [0.0]
+        token = request_db_time.set(db_time)
+        metrics.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            metrics.in_flight -= 1
+            request_db_time.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            metrics.request_duration.observe(elapsed, scope["method"], route_path, str(status["code"]))
+            metrics.handler_duration.observe(max(0.0, elapsed - db_time[0]), route_path)
+
+
+app.add_middleware(MetricsMiddleware)
+
+
 # ================= PostgreSQL 连接池 =================
 
-@app.on_event("startup")
-async def startup():
+def db_connect_kwargs() -> dict:
+    """
+    asyncpg 连接参数（create_pool / connect 通用）。
+    backend 目录下的脚本（benchmark 等）也复用这里，保证连的是同一个库。
+    """
     if USE_DSN:
         # 用 DATABASE_URL 这种完整 DSN 连接
-        app.state.pool = await asyncpg.create_pool(
-            dsn=DATABASE_URL,
-            min_size=1,
-            max_size=5,
-        )
-        print(f"Connected to PostgreSQL via DSN: {DATABASE_URL}")
-    else:
-        # 用拆开的参数连接
-        app.state.pool = await asyncpg.create_pool(
-            host=PGHOST,
-            port=PGPORT,
-            user=PGUSER,
-            password=PGPASSWORD,
-            database=PGDATABASE,
+        return {"dsn": DATABASE_URL}
+    # 用拆开的参数连接
+    return {
+        "host": PGHOST,
+        "port": PGPORT,
+        "user": PGUSER,
+        "password": PGPASSWORD,
+        "database": PGDATABASE,
+    }
+
+
+class MeteredConnection:
+    """给查询计时的连接代理；其余属性（transaction / cursor 等）原样转发。"""
+
+    def __init__(self, conn: asyncpg.Connection):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def _timed(self, method, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            record_db_query(time.perf_counter() - t0)
+
+    async def fetch(self, *args, **kwargs):
+        return await self._timed(self._conn.fetch, *args, **kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        return await self._timed(self._conn.fetchrow, *args, **kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        return await self._timed(self._conn.fetchval, *args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        return await self._timed(self._conn.execute, *args, **kwargs)
+
+    async def executemany(self, *args, **kwargs):
+        return await self._timed(self._conn.executemany, *args, **kwargs)
+
+
+class MeteredPool:
+    """包一层 asyncpg Pool：记录等连接的时间，并把连接包成 MeteredConnection。"""
+
+    def __init__(self, pool: asyncpg.pool.Pool):
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        t0 = time.perf_counter()
+        conn = await self._pool.acquire()
+        dt = time.perf_counter() - t0
+        metrics.pool_acquire.observe(dt)
+        add_request_db_time(dt)
+        try:
+            yield MeteredConnection(conn)
+        finally:
+            await self._pool.release(conn)
+
+
+# ================= Storage =================
+# handler 只通过 storage 对象读写数据，不直接碰连接池：
+# - PostgresStorage（默认）：asyncpg 连接池 + 下面各节的 SQL；
+# - SQLiteStorage（STORAGE_BACKEND=sqlite，见 sqlite_storage.py）：标准库 sqlite3，WAL 模式，
+#   单个写连接跑在专用线程上，适合一台笔记本上的离线实验。
+# 两者对外的 JSON 完全一致（字段、顺序、类型），/api/* 契约不随后端变化。
+# import_results.py / bench_list_endpoints.py 用到 COPY / json_agg，仍然只支持 Postgres。
+
+class PostgresStorage:
+    name = "postgres"
+
+    def __init__(self, pool: MeteredPool):
+        self.pool = pool
+        self._listen_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def open(cls) -> "PostgresStorage":
+        raw_pool = await asyncpg.create_pool(
+            **db_connect_kwargs(),
             min_size=1,
             max_size=5,
         )
-        print(f"Connected to PostgreSQL as {PGUSER}@{PGHOST}:{PGPORT}/{PGDATABASE}")
+        if USE_DSN:
+            print(f"Connected to PostgreSQL via DSN: {DATABASE_URL}")
+        else:
+            print(f"Connected to PostgreSQL as {PGUSER}@{PGHOST}:{PGPORT}/{PGDATABASE}")
+        return cls(MeteredPool(raw_pool))
+
+    async def close(self) -> None:
+        if self._listen_task:
+            self._listen_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._listen_task
+        await self.pool.close()
+        print("PostgreSQL pool closed")
+
+    async def migrate(self) -> int:
+        async with self.pool.acquire() as conn:
+            version = await ensure_schema(conn)
+            await ensure_selection_counts(conn)
+        return version
+
+    async def check_query_plans(self) -> List[str]:
+        async with self.pool.acquire() as conn:
+            return await check_query_plans(conn)
+
+    async def ping(self, timeout: float) -> None:
+        async with self.pool.acquire() as conn:
+            await conn.fetchval("SELECT 1", timeout=timeout)
+
+    def health_info(self) -> dict:
+        return {"pool_size": self.pool.get_size(), "pool_idle": self.pool.get_idle_size()}
+
+    # ---------- users ----------
+    async def list_users_json(self) -> str:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(USERS_JSON_SQL)
+
+    async def get_user_json(self, user_id: int) -> Optional[str]:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(USER_JSON_SQL, user_id)
+
+    async def create_user(self, payload: UserIn):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    CREATE_USER_SQL,
+                    payload.age_range,
+                    payload.gender,
+                    payload.education_level,
+                    payload.occupation,
+                    payload.smart_assistant_exp,
+                    payload.tech_comfort,
+                )
+                await conn.execute(NOTIFY_SQL, EVENTS_CHANNEL, user_event(row["id"]))
+            return row
+
+    async def update_user(self, user_id: int, payload: UserIn):
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow(
+                UPDATE_USER_SQL,
+                payload.age_range,
+                payload.gender,
+                payload.education_level,
+                payload.occupation,
+                payload.smart_assistant_exp,
+                payload.tech_comfort,
+                user_id,
+            )
+
+    # ---------- selections ----------
+    async def list_user_selections_json(self, user_id: int) -> str:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(USER_SELECTIONS_JSON_SQL, user_id)
+
+    async def write_selection(self, user_id: int, image_id: str, selection: str):
+        async with self.pool.acquire() as conn:
+            return await write_selection(conn, user_id, image_id, selection)
+
+    async def write_selections(self, items: Dict[Tuple[int, str], str]) -> List[Tuple[Tuple[int, str], str]]:
+        """一个事务写一批；违反约束的行被跳过并返回 [(key, 原因)]，其余错误整批回滚后抛出。"""
+        rejected = []
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for (user_id, image_id), selection in items.items():
+                    try:
+                        # write_selection 的内层事务是 savepoint，坏行不会拖垮整批
+                        await write_selection(conn, user_id, image_id, selection)
+                    except asyncpg.IntegrityConstraintViolationError as e:
+                        rejected.append(((user_id, image_id), str(e)))
+        return rejected
+
+    async def selection_counts_json(self) -> str:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(SELECTION_COUNTS_JSON_SQL)
+
+    # ---------- allocations ----------
+    async def allocation_counts(self) -> Dict[str, int]:
+        async with self.pool.acquire() as conn:
+            return {r["image_id"]: r["n"] for r in await conn.fetch(ALLOCATION_COUNTS_SQL)}
+
+    async def get_allocation(self, user_id: int) -> List[str]:
+        async with self.pool.acquire() as conn:
+            return [r["image_id"] for r in await conn.fetch(USER_ALLOCATION_SQL, user_id)]
+
+    async def save_allocation(self, user_id: int, image_ids: List[str]) -> Optional[List[str]]:
+        """写入分配；用户已有分配时不覆盖，返回库里实际的分配。用户不存在返回 None。"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # 行锁把同一用户的并发分配串行化（多个实例时也成立）
+                if await conn.fetchval(LOCK_USER_SQL, user_id) is None:
+                    return None
+                existing = [r["image_id"] for r in await conn.fetch(USER_ALLOCATION_SQL, user_id)]
+                if existing:
+                    return existing
+                await conn.execute(INSERT_ALLOCATION_SQL, user_id, image_ids)
+                return list(image_ids)
+
+    # ---------- events ----------
+    async def listen(self, callback: Callable[[str], None]) -> None:
+        """用一条独立连接（不占连接池）LISTEN EVENTS_CHANNEL，每条 NOTIFY 的 payload 交给 callback。"""
+        self._listen_task = asyncio.create_task(self._listen_loop(callback))
+
+    async def _listen_loop(self, callback: Callable[[str], None]) -> None:
+        delay = 1.0
+        first = True
+        while True:
+            conn = None
+            lost = asyncio.Event()
+            try:
+                conn = await asyncpg.connect(**db_connect_kwargs())
+                conn.add_termination_listener(lambda _conn: lost.set())
+                await conn.add_listener(EVENTS_CHANNEL, lambda _conn, _pid, _channel, payload: callback(payload))
+                print(f"Listening for events on channel {EVENTS_CHANNEL!r}")
+                if not first:
+                    # 断线期间的 NOTIFY 已经丢了，让订阅者重新拉一次 REST 接口
+                    callback(RESYNC_EVENT)
+                first = False
+                delay = 1.0
+                await lost.wait()
+                print("⚠️ Event listener connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Event listener failed, retrying in {delay:.0f}s: {e}")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def export_rows(
+        self,
+        include_users: bool,
+        after_user_id: Optional[int],
+        after_image_id: Optional[str],
+        chunk_size: int,
+    ) -> AsyncIterator[Any]:
+        sql, args = build_export_sql(include_users, after_user_id, after_image_id, lambda i: f"${i}")
+        async with self.pool.acquire() as conn:
+            # 服务端游标只能在事务里用
+            async with conn.transaction(readonly=True):
+                async for r in conn.cursor(sql, *args, prefetch=chunk_size):
+                    yield r
+
+
+async def open_storage():
+    if STORAGE_BACKEND == "sqlite":
+        from sqlite_storage import SQLiteStorage
+
+        return await SQLiteStorage.open(SQLITE_PATH, record_db_query)
+    if STORAGE_BACKEND != "postgres":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND={STORAGE_BACKEND!r} (expected postgres or sqlite)")
+    return await PostgresStorage.open()
+
+
+@app.on_event("startup")
+async def startup():
+    storage = await open_storage()
+    app.state.storage = storage
+
+    version = await storage.migrate()
+    print(f"Database schema at version {version} ({storage.name})")
+    if SCHEMA_PLAN_CHECK != "off":
+        problems = await storage.check_query_plans()
+        for p in problems:
+            print(f"⚠️ Query plan check: {p}")
+        if problems and SCHEMA_PLAN_CHECK == "fail":
+            raise RuntimeError(
+                f"{len(problems)} handler quer(ies) would sequential-scan; "
+                "add the missing index as a migration (or set SCHEMA_PLAN_CHECK=warn)"
+            )
+
+    app.state.events = EventHub(EVENTS_CLIENT_BUFFER, EVENTS_REPLAY)
+    await storage.listen(app.state.events.publish)
+
+    app.state.allocator = None
+    if ALLOCATION_SIZE > 0:
+        if not STIMULI_DIR.is_dir():
+            raise RuntimeError(f"ALLOCATION_SIZE is set but the stimuli directory does not exist: {STIMULI_DIR}")
+        allocator = StimulusAllocator(ALLOCATION_SIZE)
+        await allocator.rebuild(storage)
+        app.state.allocator = allocator
+        print(f"Stimulus allocation enabled ({ALLOCATION_SIZE} per participant, {len(allocator.active)} stimuli)")
+
+    app.state.selection_buffer = None
+    if SELECTION_WRITE_BEHIND:
+        buf = SelectionWriteBuffer(storage, WRITE_BEHIND_JOURNAL, WRITE_BEHIND_FLUSH_MS)
+        await buf.start()
+        app.state.selection_buffer = buf
+        print(f"Selection write-behind enabled (flush every {WRITE_BEHIND_FLUSH_MS} ms, journal {WRITE_BEHIND_JOURNAL})")
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    pool = app.state.pool
-    await pool.close()
-    print("PostgreSQL pool closed")
+    if app.state.selection_buffer:
+        await app.state.selection_buffer.stop()
+    await app.state.storage.close()
+
+
+async def get_storage():
+    return app.state.storage
+
+
+# ================= Schema & migrations =================
+# 表结构由代码管理：启动时按版本号依次执行 SCHEMA_MIGRATIONS 里还没跑过的条目，
+# 已执行的版本记在 schema_migrations 里；多个实例同时启动时用 advisory lock 串行化。
+# 每条迁移都写成可以在「手工建过表」的老库上安全执行（IF NOT EXISTS）。
+# 新表 / 新索引只能追加新版本，不要修改已经发布的条目。
+
+SCHEMA_LOCK_ID = 7_340_041
+
+SCHEMA_MIGRATIONS: List[Tuple[int, str, str]] = [
+    (
+        1,
+        "users and user_selections",
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id                  SERIAL PRIMARY KEY,
+            age_range           TEXT,
+            gender              TEXT,
+            education_level     TEXT,
+            occupation          TEXT,
+            smart_assistant_exp TEXT,
+            tech_comfort        INT,
+            created_at          TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at          TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+        CREATE TABLE IF NOT EXISTS user_selections (
+            user_id    INT  NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            image_id   TEXT NOT NULL,
+            selection  TEXT NOT NULL CHECK (selection IN ('A', 'B')),
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (user_id, image_id)
+        );
+        ALTER TABLE user_selections ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+        -- write_selection 的 ON CONFLICT (user_id, image_id) 依赖这个唯一索引；
+        -- 手工建的老表可能没有，已有 PK / UNIQUE 时不再重复建
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1
+                FROM pg_index i
+                WHERE i.indrelid = 'user_selections'::regclass
+                  AND i.indisunique
+                  AND string_to_array(i.indkey::text, ' ')::int2[] = (
+                      SELECT array_agg(a.attnum ORDER BY c.ord)
+                      FROM unnest(ARRAY['user_id', 'image_id']) WITH ORDINALITY AS c (name, ord)
+                      JOIN pg_attribute a
+                        ON a.attrelid = 'user_selections'::regclass AND a.attname = c.name
+                  )
+            ) THEN
+                CREATE UNIQUE INDEX user_selections_user_image_key ON user_selections (user_id, image_id);
+            END IF;
+        END
+        $$;
+        """,
+    ),
+    (
+        2,
+        "image_selection_counts",
+        """
+        CREATE TABLE IF NOT EXISTS image_selection_counts (
+            image_id   TEXT PRIMARY KEY,
+            count_a    BIGINT NOT NULL DEFAULT 0,
+            count_b    BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        """,
+    ),
+    (
+        3,
+        "user_selections image_id index",
+        # 计数表回填 / 按图片查选择用
+        "CREATE INDEX IF NOT EXISTS user_selections_image_id_idx ON user_selections (image_id);",
+    ),
+    (
+        4,
+        "stimulus_allocations",
+        """
+        CREATE TABLE IF NOT EXISTS stimulus_allocations (
+            user_id    INT  NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            position   INT  NOT NULL,
+            image_id   TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (user_id, position),
+            UNIQUE (user_id, image_id)
+        );
+        """,
+    ),
+]
+
+
+async def ensure_schema(conn: asyncpg.Connection) -> int:
+    """执行所有未应用的迁移，返回当前 schema 版本。"""
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_ID)
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version    INT PRIMARY KEY,
+                name       TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+        applied = {r["version"] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+        for version, name, sql in SCHEMA_MIGRATIONS:
+            if version in applied:
+                continue
+            await conn.execute(sql)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name
+            )
+            applied.add(version)
+            print(f"Applied schema migration {version}: {name}")
+    latest = max(v for v, _, _ in SCHEMA_MIGRATIONS)
+    if max(applied) > latest:
+        print(f"⚠️ Database schema version {max(applied)} is newer than this code ({latest})")
+    return max(applied)
+
+
+# 需要走索引的 handler 查询：(名字, SQL, 示例参数)。
+# list_users / export 这种本来就要读全表的查询不在这里。
+def plan_check_queries() -> List[Tuple[str, str, tuple]]:
+    return [
+        ("get_user", USER_JSON_SQL, (0,)),
+        ("update_user", UPDATE_USER_SQL, (None, None, None, None, None, None, 0)),
+        ("list_user_selections", USER_SELECTIONS_JSON_SQL, (0,)),
+        ("write_selection.insert", INSERT_SELECTION_SQL, (0, "", "A")),
+        ("write_selection.lock", LOCK_SELECTION_SQL, (0, "")),
+        ("write_selection.update", UPDATE_SELECTION_SQL, (0, "", "A")),
+        ("bump_selection_counts", BUMP_SELECTION_COUNTS_SQL, ("", 0, 0)),
+        ("get_allocation", USER_ALLOCATION_SQL, (0,)),
+        ("save_allocation.lock", LOCK_USER_SQL, (0,)),
+    ]
 
 
-async def get_pool() -> asyncpg.pool.Pool:
-    return app.state.pool
+def seq_scans(plan: dict) -> List[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+async def check_query_plans(conn: asyncpg.Connection) -> List[str]:
+    """
+    对每条 handler 查询跑 EXPLAIN（不执行），返回会全表扫描的查询。
+    在 enable_seqscan = off 下规划：有可用索引时规划器一定会选它，
+    所以空库 / 小表上也能查出「缺索引」，结论不依赖当前数据量。
+    """
+    problems = []
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_seqscan = off")
+        for name, sql, args in plan_check_queries():
+            plan = json.loads(await conn.fetchval("EXPLAIN (FORMAT JSON) " + sql, *args))
+            for rel in seq_scans(plan[0]["Plan"]):
+                problems.append(f"{name} sequential-scans {rel}")
+    return problems
+
+
+# ================= JSON 快速通道 =================
+# 列表接口让 Postgres 直接用 json_agg 拼好整个数组，Python 这边拿到的就是一段
+# JSON 文本，原样写回响应即可：不再为每一行构造 Record -> Pydantic -> dict -> JSON。
+# 字段名与 UserOut / SelectionOut 完全一致，response_model 仍保留用于 OpenAPI 文档。
+
+USERS_JSON_SQL = """
+    SELECT COALESCE(json_agg(u ORDER BY u.id), '[]'::json)::text
+    FROM (
+        SELECT id, age_range, gender, education_level, occupation,
+               smart_assistant_exp, tech_comfort
+        FROM users
+    ) u
+"""
+
+USER_SELECTIONS_JSON_SQL = """
+    SELECT COALESCE(json_agg(s ORDER BY s.image_id), '[]'::json)::text
+    FROM (
+        SELECT user_id, image_id, selection
+        FROM user_selections
+        WHERE user_id = $1
+    ) s
+"""
+
+
+def json_response(body: str, status_code: int = 200) -> Response:
+    return Response(
+        content=body,
+        status_code=status_code,
+        media_type="application/json",
+    )
+
+
+# ================= 读缓存 & ETag =================
+# get_user / list_user_selections 的响应体按 key 缓存在进程内（TTL + LRU），
+# 写接口（create_user / update_user / upsert_selection）负责失效对应 key。
+# 每个响应带强 ETag（响应体 sha1），客户端带 If-None-Match 命中缓存时直接 304，
+# 完全不占用连接池。多 worker 部署时各进程缓存独立，TTL 兜底跨进程的陈旧窗口。
+
+class TTLCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Tuple[float, str, str]]" = OrderedDict()
+        # 失效计数：读库期间发生了失效，就不把（可能已过期的）结果写回缓存
+        self._gen: Dict[Hashable, int] = {}
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, str]]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, body, etag = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return body, etag
+
+    def generation(self, key: Hashable) -> int:
+        return self._gen.get(key, 0)
+
+    def put(self, key: Hashable, body: str, etag: str, generation: int) -> None:
+        if self.ttl <= 0 or self.generation(key) != generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, body, etag)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+            self._gen[key] = self._gen.get(key, 0) + 1
+
+
+read_cache = TTLCache(CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
+
+
+def make_etag(body: str) -> str:
+    return '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [t.strip() for t in if_none_match.split(",")]
+
+
+def cached_json_response(body: str, etag: str, if_none_match: Optional[str]) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    resp = json_response(body)
+    resp.headers.update(headers)
+    return resp
+
+
+USER_JSON_SQL = """
+    SELECT row_to_json(u)::text
+    FROM (
+        SELECT id, age_range, gender, education_level, occupation,
+               smart_assistant_exp, tech_comfort
+        FROM users
+        WHERE id = $1
+    ) u
+"""
 
 
 # ================= 健康检查 =================
 
 @app.get("/api/health")
 async def health_check():
-    return {"ok": True}
+    storage = await get_storage()
+    t0 = time.perf_counter()
+    try:
+        await storage.ping(timeout=2.0)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"ok": False, "error": str(e)})
+    return {
+        "ok": True,
+        "storage": storage.name,
+        "db_ms": round((time.perf_counter() - t0) * 1000.0, 3),
+        **storage.health_info(),
+        "in_flight": metrics.in_flight,
+        "event_subscribers": len(app.state.events.subscribers),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(
+        metrics.render(getattr(getattr(app.state, "storage", None), "pool", None)),
+        media_type="text/plain; version=0.0.4",
+    )
 
 
 # ================= Users APIs =================
 
 @app.get("/api/users", response_model=List[UserOut])
 async def list_users():
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT id, age_range, gender, education_level, occupation,
-                   smart_assistant_exp, tech_comfort
-            FROM users
-            ORDER BY id ASC
-            """
-        )
-    return [
-        UserOut(
-            id=r["id"],
-            age_range=r["age_range"],
-            gender=r["gender"],
-            education_level=r["education_level"],
-            occupation=r["occupation"],
-            smart_assistant_exp=r["smart_assistant_exp"],
-            tech_comfort=r["tech_comfort"],
-        )
-        for r in rows
-    ]
+    storage = await get_storage()
+    body = await storage.list_users_json()
+    return json_response(body)
 
 
 @app.get("/api/users/{user_id}", response_model=UserOut)
-async def get_user(user_id: int):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT id, age_range, gender, education_level, occupation,
-                   smart_assistant_exp, tech_comfort
-            FROM users
-            WHERE id = $1
-            """,
-            user_id,
-        )
-    if not row:
+async def get_user(user_id: int, if_none_match: Optional[str] = Header(None)):
+    key = ("user", user_id)
+    hit = read_cache.get(key)
+    if hit:
+        return cached_json_response(*hit, if_none_match)
+
+    gen = read_cache.generation(key)
+    storage = await get_storage()
+    body = await storage.get_user_json(user_id)
+    if body is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return UserOut(
-        id=row["id"],
-        age_range=row["age_range"],
-        gender=row["gender"],
-        education_level=row["education_level"],
-        occupation=row["occupation"],
-        smart_assistant_exp=row["smart_assistant_exp"],
-        tech_comfort=row["tech_comfort"],
-    )
+    etag = make_etag(body)
+    read_cache.put(key, body, etag, gen)
+    return cached_json_response(body, etag, if_none_match)
+
+
+CREATE_USER_SQL = """
+    INSERT INTO users
+      (age_range, gender, education_level, occupation,
+       smart_assistant_exp, tech_comfort)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    RETURNING id, age_range, gender, education_level, occupation,
+              smart_assistant_exp, tech_comfort
+"""
 
 
 @app.post("/api/users", response_model=UserOut, status_code=201)
 async def create_user(payload: UserIn):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO users
-              (age_range, gender, education_level, occupation,
-               smart_assistant_exp, tech_comfort)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            RETURNING id, age_range, gender, education_level, occupation,
-                      smart_assistant_exp, tech_comfort
-            """,
-            payload.age_range,
-            payload.gender,
-            payload.education_level,
-            payload.occupation,
-            payload.smart_assistant_exp,
-            payload.tech_comfort,
-        )
+    storage = await get_storage()
+    row = await storage.create_user(payload)
+    read_cache.invalidate(("user", row["id"]), ("selections", row["id"]))
+    if app.state.allocator:
+        # 注册时就分配；失败不影响注册，前端可以再 POST /api/users/{id}/allocation
+        try:
+            await app.state.allocator.allocate(storage, row["id"])
+        except Exception as e:
+            print(f"⚠️ Stimulus allocation for user {row['id']} failed: {e}")
     return UserOut(
         id=row["id"],
         age_range=row["age_range"],
@@ -201,32 +949,26 @@ async def create_user(payload: UserIn):
     )
 
 
+UPDATE_USER_SQL = """
+    UPDATE users
+    SET age_range = $1,
+        gender = $2,
+        education_level = $3,
+        occupation = $4,
+        smart_assistant_exp = $5,
+        tech_comfort = $6,
+        updated_at = NOW()
+    WHERE id = $7
+    RETURNING id, age_range, gender, education_level, occupation,
+              smart_assistant_exp, tech_comfort
+"""
+
+
 @app.put("/api/users/{user_id}", response_model=UserOut)
 async def update_user(user_id: int, payload: UserIn):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            UPDATE users
-            SET age_range = $1,
-                gender = $2,
-                education_level = $3,
-                occupation = $4,
-                smart_assistant_exp = $5,
-                tech_comfort = $6,
-                updated_at = NOW()
-            WHERE id = $7
-            RETURNING id, age_range, gender, education_level, occupation,
-                      smart_assistant_exp, tech_comfort
-            """,
-            payload.age_range,
-            payload.gender,
-            payload.education_level,
-            payload.occupation,
-            payload.smart_assistant_exp,
-            payload.tech_comfort,
-            user_id,
-        )
+    storage = await get_storage()
+    row = await storage.update_user(user_id, payload)
+    read_cache.invalidate(("user", user_id))
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
     return UserOut(
@@ -243,26 +985,66 @@ async def update_user(user_id: int, payload: UserIn):
 # ================= Selections APIs =================
 
 @app.get("/api/users/{user_id}/selections", response_model=List[SelectionOut])
-async def list_user_selections(user_id: int):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT user_id, image_id, selection
-            FROM user_selections
-            WHERE user_id = $1
-            ORDER BY image_id ASC
-            """,
-            user_id,
-        )
-    return [
-        SelectionOut(
-            user_id=r["user_id"],
-            image_id=r["image_id"],
-            selection=r["selection"],
-        )
-        for r in rows
-    ]
+async def list_user_selections(user_id: int, if_none_match: Optional[str] = Header(None)):
+    key = ("selections", user_id)
+    hit = read_cache.get(key)
+    if hit:
+        return cached_json_response(*hit, if_none_match)
+
+    buf = app.state.selection_buffer
+    if buf and buf.has_user(user_id):
+        # read-your-writes：这个用户还有没落库的选择，先刷掉再读
+        await buf.flush()
+
+    gen = read_cache.generation(key)
+    storage = await get_storage()
+    body = await storage.list_user_selections_json(user_id)
+    etag = make_etag(body)
+    read_cache.put(key, body, etag, gen)
+    return cached_json_response(body, etag, if_none_match)
+
+
+INSERT_SELECTION_SQL = """
+    INSERT INTO user_selections (user_id, image_id, selection)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (user_id, image_id) DO NOTHING
+    RETURNING user_id, image_id, selection
+"""
+
+LOCK_SELECTION_SQL = """
+    SELECT selection FROM user_selections
+    WHERE user_id = $1 AND image_id = $2
+    FOR UPDATE
+"""
+
+UPDATE_SELECTION_SQL = """
+    UPDATE user_selections
+    SET selection = $3,
+        updated_at = NOW()
+    WHERE user_id = $1 AND image_id = $2
+    RETURNING user_id, image_id, selection
+"""
+
+
+async def write_selection(conn: asyncpg.Connection, user_id: int, image_id: str, selection: str):
+    """
+    Upsert 一条选择，并在同一事务里维护 image_selection_counts。
+    先 INSERT ... DO NOTHING：插入成功说明是新投票；否则锁住已有行再 UPDATE，
+    拿到旧值后对旧选项 -1、新选项 +1（并发改票也不会重复计数）。
+    """
+    async with conn.transaction():
+        row = await conn.fetchrow(INSERT_SELECTION_SQL, user_id, image_id, selection)
+        old = None
+        if row is None:
+            old = await conn.fetchval(LOCK_SELECTION_SQL, user_id, image_id)
+            row = await conn.fetchrow(UPDATE_SELECTION_SQL, user_id, image_id, selection)
+        if old != selection:
+            await bump_selection_counts(conn, image_id, old, selection)
+            # 事务提交时才投递；savepoint 回滚的坏行不会发出事件
+            await conn.execute(
+                NOTIFY_SQL, EVENTS_CHANNEL, notify_payload(selection_event(user_id, image_id, selection, old))
+            )
+    return row
 
 
 @app.put("/api/selections", response_model=SelectionOut)
@@ -270,23 +1052,839 @@ async def upsert_selection(payload: SelectionIn):
     if payload.selection not in ("A", "B"):
         raise HTTPException(status_code=400, detail="selection must be 'A' or 'B'")
 
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO user_selections (user_id, image_id, selection)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (user_id, image_id)
-            DO UPDATE SET selection = EXCLUDED.selection,
-                          updated_at = NOW()
-            RETURNING user_id, image_id, selection
-            """,
-            payload.user_id,
-            payload.image_id,
-            payload.selection,
+    buf = app.state.selection_buffer
+    if buf:
+        # 返回 200 之后就不能再告诉客户端写失败了：外键（用户存在）在入缓冲前检查
+        if not await buf.check_user(payload.user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+        buf.submit(payload.user_id, payload.image_id, payload.selection)
+        read_cache.invalidate(("selections", payload.user_id))
+        return SelectionOut(
+            user_id=payload.user_id,
+            image_id=payload.image_id,
+            selection=payload.selection,
         )
+
+    storage = await get_storage()
+    row = await storage.write_selection(payload.user_id, payload.image_id, payload.selection)
+    read_cache.invalidate(("selections", payload.user_id))
     return SelectionOut(
         user_id=row["user_id"],
         image_id=row["image_id"],
         selection=row["selection"],
     )
+
+
+# ================= Selection write-behind =================
+# SELECTION_WRITE_BEHIND=1 时，upsert_selection 只把选择放进内存缓冲并追加到本地
+# journal 就返回；后台每 WRITE_BEHIND_FLUSH_MS 毫秒把缓冲批量写库。
+# - 同一 (user_id, image_id) 只保留最后一次选择，来回切换 A/B 的中间值直接丢弃；
+# - journal 每行一条 JSON，写入后立即 flush；进程崩溃后启动时重放，批次写库成功后压缩
+#   （重写 + fsync 在线程里做，不阻塞事件循环）；
+# - 入缓冲前检查用户存在（已知用户缓存在内存里，没有删用户的接口），仍被数据库拒绝的行
+#   记在 recent_rejections，GET /api/selections/write-behind 可以查；
+# - 读同一用户的 selections 前会先强制刷写，保证 read-your-writes。
+
+class SelectionWriteBuffer:
+    def __init__(self, storage, journal_path: str, flush_ms: int):
+        self.storage = storage
+        self.journal_path = journal_path
+        self.flush_interval = flush_ms / 1000.0
+        self.pending: Dict[Tuple[int, str], str] = {}
+        self.inflight: Dict[Tuple[int, str], str] = {}
+        self.stats = {"submitted": 0, "coalesced": 0, "flushed": 0, "rejected": 0}
+        self.recent_rejections: deque = deque(maxlen=100)
+        self.known_users: Set[int] = set()
+        self._lock = asyncio.Lock()
+        self._journal = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- journal ----------
+    def _replay_journal(self) -> None:
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # 崩溃时写了半行
+                self.pending[(rec["user_id"], rec["image_id"])] = rec["selection"]
+        print(f"Replayed {len(self.pending)} buffered selection(s) from {self.journal_path}")
+
+    def _append_journal(self, user_id: int, image_id: str, selection: str) -> None:
+        self._journal.write(
+            json.dumps({"user_id": user_id, "image_id": image_id, "selection": selection}) + "\n"
+        )
+        self._journal.flush()
+
+    def _write_journal_snapshot(self, tmp: str, items: Dict[Tuple[int, str], str]) -> None:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for (user_id, image_id), selection in items.items():
+                f.write(json.dumps({"user_id": user_id, "image_id": image_id, "selection": selection}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _compact_journal(self) -> None:
+        """批次落库后，把 journal 重写为当前仍未落库的条目（原子替换）。"""
+        tmp = self.journal_path + ".tmp"
+        snapshot = dict(self.pending)
+        await asyncio.to_thread(self._write_journal_snapshot, tmp, snapshot)
+        # 下面没有 await：写快照期间 submit 追加到旧文件的条目，替换后补写进新文件
+        self._journal.close()
+        os.replace(tmp, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        for (user_id, image_id), selection in self.pending.items():
+            if snapshot.get((user_id, image_id)) != selection:
+                self._append_journal(user_id, image_id, selection)
+
+    # ---------- lifecycle ----------
+    async def start(self) -> None:
+        self._replay_journal()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        await self.flush()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self._journal.close()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self.pending:
+                continue
+            try:
+                await self.flush()
+            except Exception as e:
+                # 数据库暂时不可用：条目仍在 pending + journal 里，下一轮重试
+                print(f"⚠️ Selection flush failed, will retry: {e}")
+
+    # ---------- API ----------
+    def submit(self, user_id: int, image_id: str, selection: str) -> None:
+        key = (user_id, image_id)
+        if key in self.pending:
+            self.stats["coalesced"] += 1
+        self.pending[key] = selection
+        self.stats["submitted"] += 1
+        self._append_journal(user_id, image_id, selection)
+
+    async def check_user(self, user_id: int) -> bool:
+        if user_id in self.known_users:
+            return True
+        if await self.storage.get_user_json(user_id) is None:
+            return False
+        self.known_users.add(user_id)
+        return True
+
+    def has_user(self, user_id: int) -> bool:
+        return any(k[0] == user_id for k in self.pending) or any(
+            k[0] == user_id for k in self.inflight
+        )
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self.pending:
+                return
+            self.inflight, self.pending = self.pending, {}
+            try:
+                rejected = await self.storage.write_selections(self.inflight)
+            except Exception:
+                # 整批放回去；期间新提交的值更新，不能被旧值覆盖
+                for key, selection in self.inflight.items():
+                    self.pending.setdefault(key, selection)
+                raise
+            finally:
+                flushed = self.inflight
+                self.inflight = {}
+            for (user_id, image_id), reason in rejected:
+                self.stats["rejected"] += 1
+                self.known_users.discard(user_id)
+                self.recent_rejections.append({
+                    "user_id": user_id,
+                    "image_id": image_id,
+                    "selection": flushed[(user_id, image_id)],
+                    "reason": reason,
+                    "at": datetime.now().isoformat(timespec="seconds"),
+                })
+                print(f"⚠️ Dropping buffered selection {user_id}/{image_id}: {reason}")
+            self.stats["flushed"] += len(flushed)
+            await self._compact_journal()
+            for user_id in {k[0] for k in flushed}:
+                read_cache.invalidate(("selections", user_id))
+
+
+@app.get("/api/selections/write-behind")
+async def write_behind_stats():
+    buf: Optional[SelectionWriteBuffer] = app.state.selection_buffer
+    if not buf:
+        raise HTTPException(status_code=404, detail="Selection write-behind is disabled")
+    return {
+        "pending": len(buf.pending),
+        "inflight": len(buf.inflight),
+        **buf.stats,
+        "recent_rejections": list(buf.recent_rejections),
+    }
+
+
+# ================= Aggregates APIs =================
+# 每个 image_id 的 A/B 计数由 write_selection 事务内增量维护，
+# 看板轮询只读这张小表：O(图片数)，与参与者数量无关，也不碰 user_selections。
+
+async def ensure_selection_counts(conn: asyncpg.Connection) -> None:
+    """计数表（migration 2）为空时用 user_selections 全量回填一次（只在首次部署时扫描主表）。"""
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE image_selection_counts IN EXCLUSIVE MODE")
+        if await conn.fetchval("SELECT EXISTS (SELECT 1 FROM image_selection_counts)"):
+            return
+        await conn.execute(
+            """
+            INSERT INTO image_selection_counts (image_id, count_a, count_b)
+            SELECT image_id,
+                   COUNT(*) FILTER (WHERE selection = 'A'),
+                   COUNT(*) FILTER (WHERE selection = 'B')
+            FROM user_selections
+            GROUP BY image_id
+            """
+        )
+
+
+BUMP_SELECTION_COUNTS_SQL = """
+    INSERT INTO image_selection_counts (image_id, count_a, count_b)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (image_id)
+    DO UPDATE SET count_a = image_selection_counts.count_a + EXCLUDED.count_a,
+                  count_b = image_selection_counts.count_b + EXCLUDED.count_b,
+                  updated_at = NOW()
+"""
+
+
+async def bump_selection_counts(
+    conn: asyncpg.Connection, image_id: str, old: Optional[str], new: str
+) -> None:
+    await conn.execute(BUMP_SELECTION_COUNTS_SQL, image_id, *count_deltas(old, new))
+
+
+SELECTION_COUNTS_JSON_SQL = """
+    SELECT COALESCE(json_agg(c ORDER BY c.image_id), '[]'::json)::text
+    FROM (
+        SELECT image_id, count_a, count_b, count_a + count_b AS total
+        FROM image_selection_counts
+    ) c
+"""
+
+
+@app.get("/api/aggregates/selections", response_model=List[ImageCountsOut])
+async def selection_aggregates():
+    storage = await get_storage()
+    body = await storage.selection_counts_json()
+    return json_response(body)
+
+
+# ================= Export APIs =================
+# 一次请求流式导出全部 user_selections（可选 JOIN users 的人口学字段），
+# 代替按 user 逐个调用 /api/users/{user_id}/selections 的 N+1 查询。
+# - 服务端游标（事务内 conn.cursor）分批取行，内存占用与总行数无关；
+# - 按 (user_id, image_id) 排序，断点续传用 after_user_id + after_image_id（keyset）；
+#   只给 after_user_id 表示从下一个用户开始（user_id > after_user_id）；
+# - 每 chunk_size 行 yield 一次，客户端边收边写；
+# - 导出列和 SQL 在 storage_common 里，与 SQLite 后端共用。
+
+def export_value(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return v
+
+
+async def stream_selections_export(
+    fmt: str,
+    include_users: bool,
+    after_user_id: Optional[int],
+    after_image_id: Optional[str],
+    chunk_size: int,
+) -> AsyncIterator[bytes]:
+    columns = SELECTION_EXPORT_COLUMNS + (USER_EXPORT_COLUMNS if include_users else [])
+
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+
+    storage = await get_storage()
+    n = 0
+    async for r in storage.export_rows(include_users, after_user_id, after_image_id, chunk_size):
+        values = [export_value(r[c]) for c in columns]
+        if writer:
+            writer.writerow(values)
+        else:
+            buf.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False))
+            buf.write("\n")
+        n += 1
+        if n % chunk_size == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    tail = buf.getvalue()
+    if tail:
+        yield tail.encode("utf-8")
+
+
+@app.get("/api/export/selections")
+async def export_selections(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    include_users: bool = False,
+    after_user_id: Optional[int] = None,
+    after_image_id: Optional[str] = None,
+    chunk_size: int = Query(1000, ge=1, le=50000),
+):
+    if after_image_id is not None and after_user_id is None:
+        raise HTTPException(status_code=422, detail="after_image_id requires after_user_id")
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    ext = "csv" if format == "csv" else "ndjson"
+    return StreamingResponse(
+        stream_selections_export(format, include_users, after_user_id, after_image_id, chunk_size),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="user_selections.{ext}"'},
+    )
+
+
+# ================= Stimuli APIs =================
+# 前端不再把整个 PhaseData 打包进 bundle：
+# - GET /api/stimuli/manifest 一次拿到 (persona, activity, 文件大小, sha256, url) 的紧凑索引；
+# - GET /api/stimuli/files/{name} 按需取单张图片 / 描述，带 ETag、Range、长缓存头，
+#   如果旁边有 name.br / name.gz 预压缩文件且客户端接受，就直接发压缩版本。
+# manifest 里的 url 带 ?v=<hash>，带版本号的请求可以 immutable 缓存一年。
+
+STIMULUS_RE = re.compile(r"^Persona_(\d+)_Activity_(\d+)(\.jpg|_Description\.txt)$")
+STIMULUS_CHUNK = 256 * 1024
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+class StimulusIndex:
+    """name -> (size, mtime_ns, sha256)，只对新增 / 变更的文件重新计算哈希。"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.files: Dict[str, Tuple[int, int, str]] = {}
+        self.manifest_body: Optional[str] = None
+        self.manifest_etag: Optional[str] = None
+        self.generation = 0  # 文件集合每变一次加一，StimulusAllocator 据此同步
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _sha256(path: Path) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _scan(self) -> bool:
+        changed = False
+        seen = set()
+        for path in self.root.iterdir():
+            if not STIMULUS_RE.match(path.name):
+                continue
+            seen.add(path.name)
+            st = path.stat()
+            cached = self.files.get(path.name)
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                continue
+            self.files[path.name] = (st.st_size, st.st_mtime_ns, self._sha256(path))
+            changed = True
+        for name in set(self.files) - seen:
+            del self.files[name]
+            changed = True
+        return changed
+
+    def _build_manifest(self) -> str:
+        items: Dict[str, dict] = {}
+        for name, (size, _, sha) in sorted(self.files.items()):
+            m = STIMULUS_RE.match(name)
+            pid, aid, kind = int(m.group(1)), int(m.group(2)), m.group(3)
+            key = f"Persona_{pid}_Activity_{aid}"
+            item = items.setdefault(key, {"key": key, "persona": pid, "activity": aid})
+            item["image" if kind == ".jpg" else "description"] = {
+                "name": name,
+                "size": size,
+                "sha256": sha,
+                "url": f"/api/stimuli/files/{name}?v={sha[:16]}",
+            }
+        ordered = sorted(items.values(), key=lambda it: (it["persona"], it["activity"]))
+        return json.dumps({"count": len(ordered), "items": ordered}, separators=(",", ":"))
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            changed = await asyncio.to_thread(self._scan)
+            if changed or self.manifest_body is None:
+                self.manifest_body = self._build_manifest()
+                self.manifest_etag = make_etag(self.manifest_body)
+                self.generation += 1
+
+    def image_keys(self) -> Set[str]:
+        """有图片的刺激：Persona_X_Activity_Y（与 user_selections.image_id 同一套 key）。"""
+        return {name[: -len(".jpg")] for name in self.files if name.endswith(".jpg")}
+
+    async def lookup(self, name: str) -> Tuple[int, int, str]:
+        info = self.files.get(name)
+        path = self.root / name
+        if info is None or not path.exists() or path.stat().st_mtime_ns != info[1]:
+            await self.refresh()
+            info = self.files.get(name)
+        if info is None:
+            raise HTTPException(status_code=404, detail="Stimulus not found")
+        return info
+
+
+stimulus_index = StimulusIndex(STIMULI_DIR)
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """只支持单段 bytes=start-end / start- / -suffix；不合法返回 None（按整文件发送）。"""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_s, _, end_s = range_header[6:].strip().partition("-")
+    try:
+        if start_s == "":
+            length = int(end_s)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding -> {编码: q}；q 缺省为 1，写不对的 q 按 0 处理。"""
+    prefs: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        prefs[token] = q
+    return prefs
+
+
+def pick_encoding(header: Optional[str], available: List[str]) -> Optional[str]:
+    """在有预压缩文件的编码里选 q 最高的（q=0 表示拒绝）；同分按 PRECOMPRESSED 的顺序。"""
+    prefs = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = prefs.get(encoding, prefs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+async def iter_file(path: Path, start: int, length: int) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(STIMULUS_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@app.get("/api/stimuli/manifest")
+async def stimuli_manifest(if_none_match: Optional[str] = Header(None)):
+    if not STIMULI_DIR.is_dir():
+        raise HTTPException(status_code=404, detail=f"Stimuli directory not found: {STIMULI_DIR}")
+    await stimulus_index.refresh()
+    return cached_json_response(stimulus_index.manifest_body, stimulus_index.manifest_etag, if_none_match)
+
+
+@app.get("/api/stimuli/files/{name}")
+async def stimulus_file(name: str, request: Request, v: Optional[str] = None):
+    if not STIMULUS_RE.match(name):
+        raise HTTPException(status_code=404, detail="Stimulus not found")
+    size, _, sha = await stimulus_index.lookup(name)
+    path = STIMULI_DIR / name
+
+    # 预压缩版本（只在不带 Range 时使用，Range 永远针对原始字节）
+    range_header = request.headers.get("range")
+    encoding, variant = None, None
+    if range_header is None:
+        variants = {enc: path.with_name(path.name + suffix) for enc, suffix in PRECOMPRESSED}
+        available = [enc for enc, vpath in variants.items() if vpath.exists()]
+        encoding = pick_encoding(request.headers.get("accept-encoding"), available)
+        variant = variants.get(encoding)
+
+    # 每种编码是不同的字节，ETag 各不相同
+    etag = f'"{sha}-{encoding}"' if encoding else f'"{sha}"'
+    media_type = "image/jpeg" if name.endswith(".jpg") else "text/plain; charset=utf-8"
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+        "Cache-Control": (
+            "public, max-age=31536000, immutable"
+            if v and sha.startswith(v)
+            else "public, max-age=300, must-revalidate"
+        ),
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if variant is not None:
+        vsize = variant.stat().st_size
+        headers.update({"Content-Encoding": encoding, "Content-Length": str(vsize)})
+        return StreamingResponse(iter_file(variant, 0, vsize), media_type=media_type, headers=headers)
+
+    byte_range = parse_range(range_header, size)
+    # If-Range 对不上说明客户端手里的片段已过期，发整个文件
+    if_range = request.headers.get("if-range")
+    if byte_range and if_range and if_range != etag:
+        byte_range = None
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(length)})
+        return StreamingResponse(iter_file(path, start, length), status_code=206, media_type=media_type, headers=headers)
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_file(path, 0, size), media_type=media_type, headers=headers)
+
+
+# ================= Stimulus allocation =================
+# ALLOCATION_SIZE > 0 时由服务端决定每个参与者看哪些刺激，保证各图片的曝光次数均衡：
+# - 内存里维护 image_id -> 已分配次数，启动时从 stimulus_allocations 重建；
+# - 最小堆 (次数, 随机数, image_id)：每次取曝光最少的 k 张，O(k log n)；计数变化后压入新项，
+#   旧项出堆时发现计数对不上就丢掉（lazy deletion）；随机数打散同次数的图片；
+# - 同一个 persona 最多占 ceil(k / persona 数) 张，避免一个人看到的都是同一个 persona；
+#   persona 之间图片数不均、上限凑不满 k 张时，再从超限推迟的图片里按曝光次数补齐；
+# - 选图是纯内存的同步操作，事件循环上不会和其它请求交错；落库在 save_allocation 的事务里，
+#   同一用户重复 / 并发请求返回同一份分配；写库失败把计数退回去；
+# - 计数是进程内的：多实例部署时各实例只在启动时对齐一次，均衡度会稍差但分配仍然正确。
+
+ALLOCATION_COUNTS_SQL = """
+    SELECT image_id, COUNT(*) AS n
+    FROM stimulus_allocations
+    GROUP BY image_id
+"""
+
+USER_ALLOCATION_SQL = """
+    SELECT image_id
+    FROM stimulus_allocations
+    WHERE user_id = $1
+    ORDER BY position
+"""
+
+LOCK_USER_SQL = "SELECT id FROM users WHERE id = $1 FOR UPDATE"
+
+INSERT_ALLOCATION_SQL = """
+    INSERT INTO stimulus_allocations (user_id, position, image_id)
+    SELECT $1, t.ord - 1, t.image_id
+    FROM unnest($2::text[]) WITH ORDINALITY AS t (image_id, ord)
+"""
+
+
+def persona_of(image_id: str) -> str:
+    return image_id.split("_Activity_", 1)[0]
+
+
+class StimulusAllocator:
+    def __init__(self, size: int):
+        self.size = size
+        self.counts: Dict[str, int] = {}
+        self.active: Set[str] = set()
+        self.heap: List[Tuple[int, float, str]] = []
+        self.generation = -1
+        self.inflight: Dict[int, asyncio.Future] = {}
+        self.stats = {"allocated": 0, "existing": 0, "failed": 0}
+        self._rng = random.Random()
+
+    def _push(self, image_id: str) -> None:
+        heapq.heappush(self.heap, (self.counts[image_id], self._rng.random(), image_id))
+
+    def _rebuild_heap(self) -> None:
+        self.heap = [(self.counts[i], self._rng.random(), i) for i in self.active]
+        heapq.heapify(self.heap)
+
+    def sync(self, image_ids: Iterable[str]) -> None:
+        """刺激集合变化：新图片从 0 次开始（会被优先分配），移除的图片不再入选。"""
+        self.active = set(image_ids)
+        for image_id in self.active:
+            self.counts.setdefault(image_id, 0)
+        self._rebuild_heap()
+
+    async def rebuild(self, storage) -> None:
+        await stimulus_index.refresh()
+        self.counts = await storage.allocation_counts()
+        self.generation = stimulus_index.generation
+        self.sync(stimulus_index.image_keys())
+
+    def _pick(self) -> List[str]:
+        if self.generation != stimulus_index.generation:
+            self.generation = stimulus_index.generation
+            self.sync(stimulus_index.image_keys())
+        k = min(self.size, len(self.active))
+        cap = -(-k // max(len({persona_of(i) for i in self.active}), 1))
+        chosen: List[str] = []
+        per_persona: Counter = Counter()
+        deferred = []
+        while len(chosen) < k and self.heap:
+            entry = heapq.heappop(self.heap)
+            n, _, image_id = entry
+            if image_id not in self.active or n != self.counts[image_id]:
+                continue  # 过期项
+            persona = persona_of(image_id)
+            if per_persona[persona] >= cap:
+                deferred.append(entry)
+                continue
+            chosen.append(image_id)
+            per_persona[persona] += 1
+        # deferred 是按出堆顺序（曝光从少到多）排的
+        fill = k - len(chosen)
+        chosen.extend(image_id for _, _, image_id in deferred[:fill])
+        for entry in deferred[fill:]:
+            heapq.heappush(self.heap, entry)
+        for image_id in chosen:
+            self.counts[image_id] += 1
+            self._push(image_id)
+        # 展示顺序也随机，顺序效应在参与者之间抵消
+        self._rng.shuffle(chosen)
+        return chosen
+
+    def _release(self, image_ids: List[str]) -> None:
+        for image_id in image_ids:
+            self.counts[image_id] -= 1
+            if image_id in self.active:
+                self._push(image_id)
+
+    async def allocate(self, storage, user_id: int) -> Optional[List[str]]:
+        """返回用户的分配（已有就返回已有的）；用户不存在返回 None。"""
+        waiting = self.inflight.get(user_id)
+        if waiting:
+            return await asyncio.shield(waiting)
+        fut = asyncio.get_running_loop().create_future()
+        self.inflight[user_id] = fut
+        try:
+            chosen = self._pick()
+            try:
+                stored = await storage.save_allocation(user_id, chosen)
+            except BaseException:
+                self._release(chosen)
+                self.stats["failed"] += 1
+                raise
+            if stored == chosen:
+                self.stats["allocated"] += 1
+            else:
+                # 用户不存在，或者之前已经分配过：这次选的不算数
+                self._release(chosen)
+                if stored is not None:
+                    self.stats["existing"] += 1
+            fut.set_result(stored)
+            return stored
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # 没有并发等待者时避免 "exception was never retrieved"
+            raise
+        finally:
+            if not fut.done():
+                fut.cancel()
+            self.inflight.pop(user_id, None)
+
+    def summary(self) -> dict:
+        exposures = [self.counts[i] for i in self.active]
+        return {
+            "size": self.size,
+            "stimuli": len(self.active),
+            "min_exposures": min(exposures, default=0),
+            "max_exposures": max(exposures, default=0),
+            "heap_entries": len(self.heap),
+            **self.stats,
+        }
+
+
+def get_allocator() -> StimulusAllocator:
+    allocator = app.state.allocator
+    if allocator is None:
+        raise HTTPException(status_code=404, detail="Stimulus allocation is disabled (ALLOCATION_SIZE=0)")
+    return allocator
+
+
+@app.post("/api/users/{user_id}/allocation", response_model=AllocationOut)
+async def allocate_stimuli(user_id: int):
+    allocator = get_allocator()
+    storage = await get_storage()
+    image_ids = await allocator.allocate(storage, user_id)
+    if image_ids is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return AllocationOut(user_id=user_id, image_ids=image_ids)
+
+
+@app.get("/api/users/{user_id}/allocation", response_model=AllocationOut)
+async def get_allocation(user_id: int):
+    get_allocator()
+    storage = await get_storage()
+    image_ids = await storage.get_allocation(user_id)
+    if not image_ids:
+        raise HTTPException(status_code=404, detail="No allocation for this user")
+    return AllocationOut(user_id=user_id, image_ids=image_ids)
+
+
+@app.get("/api/allocations/stats")
+async def allocation_stats():
+    return get_allocator().summary()
+
+
+# ================= Live events =================
+# upsert_selection / create_user 在写库的同一个事务里 NOTIFY 一条紧凑 JSON（提交后才投递）；
+# 本进程只用一条专用连接 LISTEN，再扇出给任意多个 SSE 订阅者（GET /api/events）：
+# - 每个订阅者一个有界队列（EVENTS_CLIENT_BUFFER）；积压满了说明客户端读得太慢，
+#   直接断开它（最后发一条 event: dropped），不拖慢发布者和其它订阅者；
+# - 每条事件带进程内递增的 id，最近 EVENTS_REPLAY 条留在内存里，EventSource 重连时按 Last-Event-ID 补发；
+#   补不全（缺口太大 / 进程重启过）就发 resync，让客户端重新拉 REST 接口；
+# - 空闲时每 EVENTS_HEARTBEAT_SECONDS 秒发一行注释心跳，代理不会断开空闲连接，也能发现客户端已离开；
+# - SQLite 后端没有 NOTIFY，由存储层在提交后直接调用同一个 publish（payload 都由 storage_common 生成）；
+# - pg_notify 的 payload 必须小于 8000 字节，否则整个写事务失败：超长的事件（image_id 由客户端
+#   提交，长度不受控）改发 resync，写入照常成功，订阅者重新拉一次 REST 接口。
+# 不管多少人在看看板，数据库都只多一条 LISTEN 连接。
+
+NOTIFY_SQL = "SELECT pg_notify($1, $2)"
+NOTIFY_MAX_BYTES = 7999
+EVENTS_HEARTBEAT_SECONDS = 15.0
+
+
+def notify_payload(event: str) -> str:
+    return event if len(event.encode("utf-8")) <= NOTIFY_MAX_BYTES else RESYNC_EVENT
+
+
+class EventSubscriber:
+    def __init__(self, maxsize: int, types: Optional[Set[str]]):
+        # 元素是 (id, type, payload)；None 表示被踢掉了
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.types = types
+
+
+class EventHub:
+    def __init__(self, buffer_size: int, replay: int):
+        self.buffer_size = max(buffer_size, 1)
+        self.subscribers: Set[EventSubscriber] = set()
+        self.recent: deque = deque(maxlen=replay)
+        self.seq = 0
+        self.stats = {"published": 0, "dropped_subscribers": 0}
+
+    def publish(self, payload: str) -> None:
+        try:
+            kind = json.loads(payload).get("type", "message")
+        except ValueError:
+            print(f"⚠️ Ignoring malformed event payload: {payload[:200]!r}")
+            return
+        self.seq += 1
+        item = (self.seq, kind, payload)
+        self.recent.append(item)
+        self.stats["published"] += 1
+        for sub in list(self.subscribers):
+            if sub.types and kind not in sub.types and kind != "resync":
+                continue
+            try:
+                sub.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self._drop(sub)
+
+    def _drop(self, sub: EventSubscriber) -> None:
+        self.subscribers.discard(sub)
+        self.stats["dropped_subscribers"] += 1
+        # 清空积压再放哨兵，唤醒正在等待的 SSE 生成器
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+
+    def subscribe(self, types: Optional[Set[str]], last_event_id: Optional[int]) -> EventSubscriber:
+        sub = EventSubscriber(self.buffer_size, types)
+        if last_event_id is not None and last_event_id != self.seq:
+            oldest = self.recent[0][0] if self.recent else self.seq + 1
+            backlog = [
+                it for it in self.recent
+                if it[0] > last_event_id and (not types or it[1] in types)
+            ]
+            if last_event_id > self.seq or last_event_id < oldest - 1 or len(backlog) >= self.buffer_size:
+                backlog = [(None, "resync", RESYNC_EVENT)]
+            for it in backlog:
+                sub.queue.put_nowait(it)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: EventSubscriber) -> None:
+        self.subscribers.discard(sub)
+
+
+async def stream_events(hub: EventHub, sub: EventSubscriber, request: Request) -> AsyncIterator[str]:
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(sub.queue.get(), timeout=EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": ping\n\n"
+                continue
+            if item is None:
+                yield 'event: dropped\ndata: {"reason":"slow consumer"}\n\n'
+                return
+            event_id, kind, payload = item
+            head = f"id: {event_id}\n" if event_id is not None else ""
+            yield f"{head}event: {kind}\ndata: {payload}\n\n"
+    finally:
+        hub.unsubscribe(sub)
+
+
+@app.get("/api/events")
+async def events(
+    request: Request,
+    types: Optional[str] = Query(None, description="Comma-separated event types, e.g. selection,user"),
+    last_event_id: Optional[str] = Header(None),
+):
+    hub: EventHub = app.state.events
+    wanted = {t.strip() for t in types.split(",") if t.strip()} if types else None
+    try:
+        resume = int(last_event_id) if last_event_id else None
+    except ValueError:
+        resume = None
+    sub = hub.subscribe(wanted, resume)
+    return StreamingResponse(
+        stream_events(hub, sub, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/events/stats")
+async def events_stats():
+    hub: EventHub = app.state.events
+    return {
+        "subscribers": len(hub.subscribers),
+        "last_event_id": hub.seq,
+        "buffer_size": hub.buffer_size,
+        **hub.stats,
+    }
@@ -0,0 +1,430 @@
+# sqlite_storage.py — Embedded SQLite backend for main.py (STORAGE_BACKEND=sqlite)
+#
+# Usage (from backend/):
+#   STORAGE_BACKEND=sqlite SQLITE_PATH=lab.sqlite3 uvicorn main:app --port 4000
+#
+# 单机实验不需要起 PostgreSQL：
+# - 标准库 sqlite3，WAL 模式 + synchronous=NORMAL：提交只追加 WAL，不等 fsync，本地写入亚毫秒；
+# - 所有写入都在同一个连接、同一个专用线程上串行执行（SQLite 本来就只有一个写者），
+#   事件循环不被阻塞；导出用独立的只读连接，WAL 下读写互不阻塞；
+# - 方法和返回的 JSON 与 main.PostgresStorage 一一对应，handler 不需要知道后端是谁；
+#   事件 payload、计数增量和导出 SQL 与 main 共用 storage_common，只有方言不同的 SQL 各写一份；
+# - schema 版本号与 main.SCHEMA_MIGRATIONS 对齐，记在 PRAGMA user_version 里；
+# - 没有 LISTEN/NOTIFY：listen() 只是登记回调，写事务提交后在事件循环上直接调用（单进程足够）。
+
+import asyncio
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from storage_common import build_export_sql, count_deltas, selection_event, user_event
+
+NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+SCHEMA_MIGRATIONS: List[Tuple[int, str, str]] = [
+    (
+        1,
+        "users and user_selections",
+        f"""
+        CREATE TABLE IF NOT EXISTS users (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            age_range           TEXT,
+            gender              TEXT,
+            education_level     TEXT,
+            occupation          TEXT,
+            smart_assistant_exp TEXT,
+            tech_comfort        INTEGER,
+            created_at          TEXT NOT NULL DEFAULT ({NOW}),
+            updated_at          TEXT NOT NULL DEFAULT ({NOW})
+        );
+        CREATE TABLE IF NOT EXISTS user_selections (
+            user_id    INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            image_id   TEXT    NOT NULL,
+            selection  TEXT    NOT NULL CHECK (selection IN ('A', 'B')),
+            created_at TEXT    NOT NULL DEFAULT ({NOW}),
+            updated_at TEXT    NOT NULL DEFAULT ({NOW}),
+            PRIMARY KEY (user_id, image_id)
+        ) WITHOUT ROWID;
+        """,
+    ),
+    (
+        2,
+        "image_selection_counts",
+        f"""
+        CREATE TABLE IF NOT EXISTS image_selection_counts (
+            image_id   TEXT PRIMARY KEY,
+            count_a    INTEGER NOT NULL DEFAULT 0,
+            count_b    INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT    NOT NULL DEFAULT ({NOW})
+        );
+        INSERT OR IGNORE INTO image_selection_counts (image_id, count_a, count_b)
+        SELECT image_id,
+               SUM(selection = 'A'),
+               SUM(selection = 'B')
+        FROM user_selections
+        GROUP BY image_id;
+        """,
+    ),
+    (
+        3,
+        "user_selections image_id index",
+        "CREATE INDEX IF NOT EXISTS user_selections_image_id_idx ON user_selections (image_id);",
+    ),
+    (
+        4,
+        "stimulus_allocations",
+        f"""
+        CREATE TABLE IF NOT EXISTS stimulus_allocations (
+            user_id    INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            position   INTEGER NOT NULL,
+            image_id   TEXT    NOT NULL,
+            created_at TEXT    NOT NULL DEFAULT ({NOW}),
+            PRIMARY KEY (user_id, position),
+            UNIQUE (user_id, image_id)
+        ) WITHOUT ROWID;
+        """,
+    ),
+]
+
+USER_COLUMNS = "id, age_range, gender, education_level, occupation, smart_assistant_exp, tech_comfort"
+
+USER_JSON_OBJECT = """json_object(
+    'id', id, 'age_range', age_range, 'gender', gender, 'education_level', education_level,
+    'occupation', occupation, 'smart_assistant_exp', smart_assistant_exp, 'tech_comfort', tech_comfort
+)"""
+
+USERS_JSON_SQL = f"""
+    SELECT COALESCE(json_group_array(json(u)), '[]')
+    FROM (SELECT {USER_JSON_OBJECT} AS u FROM users ORDER BY id)
+"""
+
+USER_JSON_SQL = f"SELECT {USER_JSON_OBJECT} FROM users WHERE id = ?"
+
+CREATE_USER_SQL = f"""
+    INSERT INTO users
+      (age_range, gender, education_level, occupation,
+       smart_assistant_exp, tech_comfort)
+    VALUES (?, ?, ?, ?, ?, ?)
+    RETURNING {USER_COLUMNS}
+"""
+
+UPDATE_USER_SQL = f"""
+    UPDATE users
+    SET age_range = ?,
+        gender = ?,
+        education_level = ?,
+        occupation = ?,
+        smart_assistant_exp = ?,
+        tech_comfort = ?,
+        updated_at = {NOW}
+    WHERE id = ?
+    RETURNING {USER_COLUMNS}
+"""
+
+USER_SELECTIONS_JSON_SQL = """
+    SELECT COALESCE(json_group_array(json(s)), '[]')
+    FROM (
+        SELECT json_object('user_id', user_id, 'image_id', image_id, 'selection', selection) AS s
+        FROM user_selections
+        WHERE user_id = ?
+        ORDER BY image_id
+    )
+"""
+
+INSERT_SELECTION_SQL = """
+    INSERT INTO user_selections (user_id, image_id, selection)
+    VALUES (?, ?, ?)
+    ON CONFLICT (user_id, image_id) DO NOTHING
+    RETURNING user_id, image_id, selection
+"""
+
+SELECT_SELECTION_SQL = "SELECT selection FROM user_selections WHERE user_id = ? AND image_id = ?"
+
+UPDATE_SELECTION_SQL = f"""
+    UPDATE user_selections
+    SET selection = ?,
+        updated_at = {NOW}
+    WHERE user_id = ? AND image_id = ?
+    RETURNING user_id, image_id, selection
+"""
+
+BUMP_SELECTION_COUNTS_SQL = f"""
+    INSERT INTO image_selection_counts (image_id, count_a, count_b)
+    VALUES (?, ?, ?)
+    ON CONFLICT (image_id)
+    DO UPDATE SET count_a = count_a + excluded.count_a,
+                  count_b = count_b + excluded.count_b,
+                  updated_at = {NOW}
+"""
+
+SELECTION_COUNTS_JSON_SQL = """
+    SELECT COALESCE(json_group_array(json(c)), '[]')
+    FROM (
+        SELECT json_object('image_id', image_id, 'count_a', count_a, 'count_b', count_b,
+                           'total', count_a + count_b) AS c
+        FROM image_selection_counts
+        ORDER BY image_id
+    )
+"""
+
+ALLOCATION_COUNTS_SQL = """
+    SELECT image_id, COUNT(*) AS n
+    FROM stimulus_allocations
+    GROUP BY image_id
+"""
+
+USER_ALLOCATION_SQL = "SELECT image_id FROM stimulus_allocations WHERE user_id = ? ORDER BY position"
+
+USER_EXISTS_SQL = "SELECT 1 FROM users WHERE id = ?"
+
+INSERT_ALLOCATION_SQL = "INSERT INTO stimulus_allocations (user_id, position, image_id) VALUES (?, ?, ?)"
+
+SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+
+
+def plan_check_queries() -> List[Tuple[str, str, tuple]]:
+    """与 main.plan_check_queries 对应的查询（INSERT 没有查询计划，不用查）。"""
+    return [
+        ("get_user", USER_JSON_SQL, (0,)),
+        ("update_user", UPDATE_USER_SQL, (None, None, None, None, None, None, 0)),
+        ("list_user_selections", USER_SELECTIONS_JSON_SQL, (0,)),
+        ("write_selection.select", SELECT_SELECTION_SQL, (0, "")),
+        ("write_selection.update", UPDATE_SELECTION_SQL, ("A", 0, "")),
+        ("get_allocation", USER_ALLOCATION_SQL, (0,)),
+    ]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def write_selection(
+    conn: sqlite3.Connection, user_id: int, image_id: str, selection: str, events: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    与 main.write_selection 相同的语义；调用方负责开事务（写连接是唯一写者，不需要行锁）。
+    选择有变化时把事件 payload 追加到 events，由调用方在提交后发布。
+    """
+    rows = conn.execute(INSERT_SELECTION_SQL, (user_id, image_id, selection)).fetchall()
+    old = None
+    if not rows:
+        old = conn.execute(SELECT_SELECTION_SQL, (user_id, image_id)).fetchone()[0]
+        rows = conn.execute(UPDATE_SELECTION_SQL, (selection, user_id, image_id)).fetchall()
+    if old != selection:
+        conn.execute(BUMP_SELECTION_COUNTS_SQL, (image_id, *count_deltas(old, selection)))
+        if events is not None:
+            events.append(selection_event(user_id, image_id, selection, old))
+    return dict(rows[0])
+
+
+class SQLiteStorage:
+    name = "sqlite"
+    pool = None  # /metrics 里没有连接池指标
+
+    def __init__(self, path: str, observe: Callable[[float], None]):
+        self.path = path
+        self.observe = observe
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._listeners: List[Callable[[str], None]] = []
+
+    @classmethod
+    async def open(cls, path: str, observe: Callable[[float], None]) -> "SQLiteStorage":
+        self = cls(path, observe)
+        self._conn = await asyncio.get_running_loop().run_in_executor(self._executor, connect, path)
+        print(f"Opened SQLite database {path} (WAL)")
+        return self
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        print("SQLite database closed")
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _publish(self, events: List[str]) -> None:
+        for payload in events:
+            for callback in self._listeners:
+                callback(payload)
+
+    def _fetchval(self, sql: str, args: tuple = ()) -> Any:
+        row = self._conn.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+    # ---------- schema ----------
+    async def migrate(self) -> int:
+        def run(conn: sqlite3.Connection) -> int:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            for version, name, sql in SCHEMA_MIGRATIONS:
+                if version <= current:
+                    continue
+                # executescript 会先 COMMIT，所以逐条执行，保证一条迁移和版本号在同一个事务里
+                for stmt in sql.split(";"):
+                    if stmt.strip():
+                        conn.execute(stmt)
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                current = version
+                print(f"Applied schema migration {version}: {name}")
+            return current
+
+        return await self._run(self._transaction, run)
+
+    async def check_query_plans(self) -> List[str]:
+        checked = {"users", "user_selections", "image_selection_counts", "stimulus_allocations"}
+
+        def run() -> List[str]:
+            problems = []
+            for name, sql, args in plan_check_queries():
+                for row in self._conn.execute("EXPLAIN QUERY PLAN " + sql, args):
+                    m = SCAN_RE.match(row["detail"])
+                    if m and m.group(1) in checked:
+                        problems.append(f"{name} sequential-scans {m.group(1)}")
+            return problems
+
+        return await self._run(run)
+
+    async def ping(self, timeout: float) -> None:
+        await asyncio.wait_for(self._run(self._fetchval, "SELECT 1"), timeout=timeout)
+
+    def health_info(self) -> dict:
+        return {"sqlite_path": self.path}
+
+    # ---------- users ----------
+    async def list_users_json(self) -> str:
+        return await self._run(self._fetchval, USERS_JSON_SQL)
+
+    async def get_user_json(self, user_id: int) -> Optional[str]:
+        return await self._run(self._fetchval, USER_JSON_SQL, (user_id,))
+
+    async def create_user(self, payload) -> Dict[str, Any]:
+        args = (
+            payload.age_range,
+            payload.gender,
+            payload.education_level,
+            payload.occupation,
+            payload.smart_assistant_exp,
+            payload.tech_comfort,
+        )
+        rows = await self._run(self._transaction, lambda c: c.execute(CREATE_USER_SQL, args).fetchall())
+        self._publish([user_event(rows[0]["id"])])
+        return dict(rows[0])
+
+    async def update_user(self, user_id: int, payload) -> Optional[Dict[str, Any]]:
+        args = (
+            payload.age_range,
+            payload.gender,
+            payload.education_level,
+            payload.occupation,
+            payload.smart_assistant_exp,
+            payload.tech_comfort,
+            user_id,
+        )
+        rows = await self._run(self._transaction, lambda c: c.execute(UPDATE_USER_SQL, args).fetchall())
+        return dict(rows[0]) if rows else None
+
+    # ---------- selections ----------
+    async def list_user_selections_json(self, user_id: int) -> str:
+        return await self._run(self._fetchval, USER_SELECTIONS_JSON_SQL, (user_id,))
+
+    async def write_selection(self, user_id: int, image_id: str, selection: str) -> Dict[str, Any]:
+        events: List[str] = []
+        row = await self._run(
+            self._transaction, lambda c: write_selection(c, user_id, image_id, selection, events)
+        )
+        self._publish(events)
+        return row
+
+    async def write_selections(self, items: Dict[Tuple[int, str], str]) -> List[Tuple[Tuple[int, str], str]]:
+        events: List[str] = []
+
+        def run(conn: sqlite3.Connection) -> List[Tuple[Tuple[int, str], str]]:
+            rejected = []
+            for (user_id, image_id), selection in items.items():
+                conn.execute("SAVEPOINT selection")
+                row_events: List[str] = []
+                try:
+                    write_selection(conn, user_id, image_id, selection, row_events)
+                    events.extend(row_events)
+                except sqlite3.IntegrityError as e:
+                    conn.execute("ROLLBACK TO selection")
+                    rejected.append(((user_id, image_id), str(e)))
+                conn.execute("RELEASE selection")
+            return rejected
+
+        rejected = await self._run(self._transaction, run)
+        self._publish(events)
+        return rejected
+
+    async def selection_counts_json(self) -> str:
+        return await self._run(self._fetchval, SELECTION_COUNTS_JSON_SQL)
+
+    # ---------- events ----------
+    async def listen(self, callback: Callable[[str], None]) -> None:
+        self._listeners.append(callback)
+
+    # ---------- allocations ----------
+    async def allocation_counts(self) -> Dict[str, int]:
+        rows = await self._run(lambda: self._conn.execute(ALLOCATION_COUNTS_SQL).fetchall())
+        return {r["image_id"]: r["n"] for r in rows}
+
+    async def get_allocation(self, user_id: int) -> List[str]:
+        rows = await self._run(lambda: self._conn.execute(USER_ALLOCATION_SQL, (user_id,)).fetchall())
+        return [r["image_id"] for r in rows]
+
+    async def save_allocation(self, user_id: int, image_ids: List[str]) -> Optional[List[str]]:
+        def run(conn: sqlite3.Connection) -> Optional[List[str]]:
+            if conn.execute(USER_EXISTS_SQL, (user_id,)).fetchone() is None:
+                return None
+            existing = [r["image_id"] for r in conn.execute(USER_ALLOCATION_SQL, (user_id,))]
+            if existing:
+                return existing
+            conn.executemany(INSERT_ALLOCATION_SQL, [(user_id, pos, i) for pos, i in enumerate(image_ids)])
+            return list(image_ids)
+
+        return await self._run(self._transaction, run)
+
+    async def export_rows(
+        self,
+        include_users: bool,
+        after_user_id: Optional[int],
+        after_image_id: Optional[str],
+        chunk_size: int,
+    ) -> AsyncIterator[Any]:
+        sql, args = build_export_sql(include_users, after_user_id, after_image_id, lambda i: "?")
+        # 独立连接 + 显式读事务：整个导出看到同一个快照，也不占用写线程
+        conn = await asyncio.to_thread(connect, self.path)
+        try:
+            await asyncio.to_thread(conn.execute, "BEGIN")
+            cur = await asyncio.to_thread(conn.execute, sql, args)
+            while True:
+                rows = await asyncio.to_thread(cur.fetchmany, chunk_size)
+                if not rows:
+                    break
+                for r in rows:
+                    yield r
+        finally:
+            await asyncio.to_thread(conn.close)
@@ -0,0 +1,82 @@
+# storage_common.py — Helpers shared by main.PostgresStorage and sqlite_storage.SQLiteStorage
+#
+# main.py 按需 import sqlite_storage，sqlite_storage 不能反过来 import main；两边都要用的
+# 事件 payload、A/B 计数增量和导出 SQL 放在这里，只写一份：
+# - 事件 payload 是 GET /api/events 的对外格式，两个后端必须逐字节一致；
+# - 导出 SQL 只有占位符不同（asyncpg 的 $n / sqlite3 的 ?），由调用方传入。
+
+import json
+import re
+from typing import Callable, List, Optional, Tuple
+
+RESYNC_EVENT = json.dumps({"type": "resync"}, separators=(",", ":"))
+
+# user_selections.image_id / 计数表 / 分配表 / StimulusIndex.image_keys 共用的刺激 key（不带扩展名）
+IMAGE_ID_RE = re.compile(r"^Persona_\d+_Activity_\d+$")
+
+
+def image_key(name: str) -> Optional[str]:
+    """viewer 记下的文件名（Persona_4_Activity_103.jpg）→ 刺激 key；不是刺激的名字返回 None。"""
+    name = name.strip().rsplit("/", 1)[-1]
+    for ext in (".jpg", ".jpeg", ".png", ".webp"):
+        if name.lower().endswith(ext):
+            name = name[: -len(ext)]
+            break
+    return name if IMAGE_ID_RE.match(name) else None
+
+
+def selection_event(user_id: int, image_id: str, selection: str, previous: Optional[str]) -> str:
+    return json.dumps(
+        {"type": "selection", "user_id": user_id, "image_id": image_id, "selection": selection, "previous": previous},
+        separators=(",", ":"),
+    )
+
+
+def user_event(user_id: int) -> str:
+    return json.dumps({"type": "user", "user_id": user_id}, separators=(",", ":"))
+
+
+def count_deltas(old: Optional[str], new: str) -> Tuple[int, int]:
+    """改票 old -> new 时 image_selection_counts 的 (count_a, count_b) 增量；新投票 old 为 None。"""
+    return (new == "A") - (old == "A"), (new == "B") - (old == "B")
+
+
+# ================= Export =================
+
+SELECTION_EXPORT_COLUMNS = ["user_id", "image_id", "selection", "updated_at"]
+USER_EXPORT_COLUMNS = [
+    "age_range",
+    "gender",
+    "education_level",
+    "occupation",
+    "smart_assistant_exp",
+    "tech_comfort",
+]
+
+
+def build_export_sql(
+    include_users: bool,
+    after_user_id: Optional[int],
+    after_image_id: Optional[str],
+    placeholder: Callable[[int], str],
+) -> Tuple[str, tuple]:
+    """(sql, args)。只给 after_user_id 时从下一个用户开始，两个都给时从 (user_id, image_id) 这一行之后开始。"""
+    cols: List[str] = [f"s.{c}" for c in SELECTION_EXPORT_COLUMNS]
+    join = ""
+    if include_users:
+        cols += [f"u.{c}" for c in USER_EXPORT_COLUMNS]
+        join = "LEFT JOIN users u ON u.id = s.user_id"
+    where, args = "", ()
+    if after_user_id is not None and after_image_id is None:
+        where, args = f"WHERE s.user_id > {placeholder(1)}", (after_user_id,)
+    elif after_user_id is not None:
+        where = f"WHERE (s.user_id, s.image_id) > ({placeholder(1)}, {placeholder(2)})"
+        args = (after_user_id, after_image_id)
+    sql = f"""
+        SELECT {", ".join(cols)}
+        FROM user_selections s
+        {join}
+        {where}
+        ORDER BY s.user_id ASC, s.image_id ASC
+    """
+    return sql, args
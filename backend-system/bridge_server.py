@@ -0,0 +1,339 @@
+# bridge_server.py — asyncio WebSocket bridge between /ui clients and the /model server
+#
+# Implements the relay described in frontend-viewer/FRONTEND_INTEGRATION_GUIDE.md:
+#   Frontend (ws://HOST:PORT/ui)  <->  bridge  <->  Model server (ws://HOST:PORT/model)
+#
+# - 每个 UI 连接的第一条消息必须是 hello（带 user_id），user_id 即 session key；
+# - UI -> model 的消息会加上 "session_id" 字段；model 回复时带回 session_id（或 user_id），
+#   bridge 据此路由到对应 UI，并在转发前去掉 session_id；
+# - UI 断线后 session 保留 --session_ttl 秒，期间 model 的回复先缓冲，
+#   UI 用 hello + resume 重连后立即补发；
+# - 所有队列都有上限：发往 model 的队列满时 UI 读循环会阻塞（背压），超时回 BRIDGE_BUSY；
+#   发往 UI 的队列满说明客户端太慢，断开该 UI（session 保留，可 resume）；
+# - context 发出后 --response_timeout 秒内没有 response，回 MODEL_TIMEOUT；
+# - GET /stats 返回计数器与转发延迟分位数（JSON），GET /health 返回 ok。
+#
+# Usage:
+#   python bridge_server.py --host 0.0.0.0 --port 8765
+#
+# Requires websockets >= 13 (websockets.asyncio API).
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from http import HTTPStatus
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+
+# -----------------------------------------
+# Metrics
+# -----------------------------------------
+class LatencyWindow:
+    """最近 N 次转发延迟（毫秒），用于计算分位数。"""
+
+    def __init__(self, size: int = 4096):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, ms: float) -> None:
+        self.samples.append(ms)
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        ms = sorted(self.samples)
+        if not ms:
+            return {"count": self.count}
+
+        def q(p: float) -> float:
+            return ms[min(len(ms) - 1, int(p * (len(ms) - 1)))]
+
+        return {"count": self.count, "p50_ms": q(0.50), "p95_ms": q(0.95), "p99_ms": q(0.99), "max_ms": ms[-1]}
+
+
+# -----------------------------------------
+# Session
+# -----------------------------------------
+class Session:
+    def __init__(self, user_id: str, outbox_size: int):
+        self.user_id = user_id
+        self.ui: Optional[ServerConnection] = None
+        self.outbox: "asyncio.Queue[Tuple[float, str]]" = asyncio.Queue(maxsize=outbox_size)
+        self.sender: Optional[asyncio.Task] = None
+        self.detached_at: Optional[float] = None
+        self.awaiting_since: Optional[float] = None
+
+
+class Bridge:
+    def __init__(self, args):
+        self.args = args
+        self.sessions: Dict[str, Session] = {}
+        self.model: Optional[ServerConnection] = None
+        self.model_ready = asyncio.Event()
+        self.to_model: "asyncio.Queue[Tuple[float, str]]" = asyncio.Queue(maxsize=args.model_queue)
+        self.counters = {
+            "ui_connections": 0,
+            "model_connections": 0,
+            "ui_to_model": 0,
+            "model_to_ui": 0,
+            "unroutable": 0,
+            "dropped": 0,
+            "busy_rejections": 0,
+            "slow_consumers": 0,
+            "timeouts": 0,
+            "resumes": 0,
+        }
+        self.latency = {"ui_to_model": LatencyWindow(), "model_to_ui": LatencyWindow()}
+
+    # ---------- helpers ----------
+    @staticmethod
+    async def send_json(conn: ServerConnection, obj: Dict[str, Any]) -> None:
+        await conn.send(json.dumps(obj, ensure_ascii=False))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model_connected": self.model is not None,
+            "sessions": len(self.sessions),
+            "attached_sessions": sum(1 for s in self.sessions.values() if s.ui is not None),
+            "model_queue": self.to_model.qsize(),
+            "counters": self.counters,
+            "relay_latency": {k: v.snapshot() for k, v in self.latency.items()},
+        }
+
+    def deliver(self, session: Session, t_recv: float, text: str) -> None:
+        """把一条消息放进 session 的发件箱；UI 在线但队列满 = 慢消费者，断开它。"""
+        try:
+            session.outbox.put_nowait((t_recv, text))
+            return
+        except asyncio.QueueFull:
+            pass
+        if session.ui is not None:
+            self.counters["slow_consumers"] += 1
+            asyncio.create_task(session.ui.close(code=1013, reason="client too slow"))
+        # 离线（或刚被断开）：丢最旧的一条给新消息腾位置
+        session.outbox.get_nowait()
+        session.outbox.put_nowait((t_recv, text))
+        self.counters["dropped"] += 1
+
+    async def ui_sender(self, session: Session, conn: ServerConnection) -> None:
+        while True:
+            t_recv, text = await session.outbox.get()
+            try:
+                await conn.send(text)
+            except ConnectionClosed:
+                # 没发出去的重新入队，UI 重连后补发
+                self.deliver(session, t_recv, text)
+                return
+            self.counters["model_to_ui"] += 1
+            self.latency["model_to_ui"].add((time.perf_counter() - t_recv) * 1000.0)
+
+    async def model_sender(self) -> None:
+        pending: Optional[Tuple[float, str]] = None
+        while True:
+            if pending is None:
+                pending = await self.to_model.get()
+            await self.model_ready.wait()
+            try:
+                await self.model.send(pending[1])
+            except (ConnectionClosed, AttributeError):
+                continue  # model 断线：等它重连后重发同一条
+            self.counters["ui_to_model"] += 1
+            self.latency["ui_to_model"].add((time.perf_counter() - pending[0]) * 1000.0)
+            pending = None
+
+    async def reaper(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            for user_id, s in list(self.sessions.items()):
+                if s.ui is None and s.detached_at and now - s.detached_at > self.args.session_ttl:
+                    del self.sessions[user_id]
+                    continue
+                if s.awaiting_since and now - s.awaiting_since > self.args.response_timeout:
+                    s.awaiting_since = None
+                    self.counters["timeouts"] += 1
+                    self.deliver(s, time.perf_counter(), json.dumps({
+                        "type": "error",
+                        "code": "MODEL_TIMEOUT",
+                        "message": f"No response from model within {self.args.response_timeout:.0f}s",
+                    }))
+
+    # ---------- /ui ----------
+    async def handle_ui(self, conn: ServerConnection) -> None:
+        self.counters["ui_connections"] += 1
+        try:
+            first = json.loads(await asyncio.wait_for(conn.recv(), timeout=self.args.hello_timeout))
+        except (asyncio.TimeoutError, ValueError, ConnectionClosed):
+            await conn.close(code=1008, reason="expected hello")
+            return
+        if not isinstance(first, dict):
+            first = {}
+        user_id = str(first.get("user_id") or "")
+        if first.get("type") != "hello" or not user_id:
+            await self.send_json(conn, {
+                "type": "error",
+                "code": "INVALID_SESSION",
+                "message": "First message must be {\"type\": \"hello\", \"user_id\": ...}",
+            })
+            await conn.close()
+            return
+
+        session = self.sessions.get(user_id)
+        if session is None:
+            session = self.sessions[user_id] = Session(user_id, self.args.ui_queue)
+        else:
+            self.counters["resumes"] += 1
+            if session.ui is not None:
+                await session.ui.close(code=4000, reason="superseded by new connection")
+            if session.sender:
+                session.sender.cancel()
+        session.ui = conn
+        session.detached_at = None
+        session.sender = asyncio.create_task(self.ui_sender(session, conn))
+
+        try:
+            await self.forward_to_model(conn, session, first, time.perf_counter())
+            async for raw in conn:
+                t_recv = time.perf_counter()
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    await self.send_json(conn, {"type": "error", "code": "INVALID_JSON", "message": "Message is not valid JSON"})
+                    continue
+                if not isinstance(msg, dict):
+                    continue
+                if msg.get("type") == "ping":
+                    await self.send_json(conn, {"type": "pong"})
+                    continue
+                await self.forward_to_model(conn, session, msg, t_recv)
+                if msg.get("type") == "end":
+                    self.sessions.pop(user_id, None)
+                    break
+        except ConnectionClosed:
+            pass
+        finally:
+            if session.ui is conn:
+                session.ui = None
+                session.detached_at = time.monotonic()
+                session.sender.cancel()
+
+    async def forward_to_model(self, conn: ServerConnection, session: Session, msg: Dict[str, Any], t_recv: float) -> None:
+        msg["session_id"] = session.user_id
+        if msg.get("type") == "context":
+            session.awaiting_since = time.monotonic()
+        try:
+            # 队列满时在这里等待 = 不再读这个 UI 的 socket（TCP 层背压）
+            await asyncio.wait_for(
+                self.to_model.put((t_recv, json.dumps(msg, ensure_ascii=False))),
+                timeout=self.args.busy_timeout,
+            )
+        except asyncio.TimeoutError:
+            self.counters["busy_rejections"] += 1
+            session.awaiting_since = None
+            await self.send_json(conn, {"type": "error", "code": "BRIDGE_BUSY", "message": "Model queue is full, please retry"})
+
+    # ---------- /model ----------
+    async def handle_model(self, conn: ServerConnection) -> None:
+        self.counters["model_connections"] += 1
+        if self.model is not None:
+            await self.model.close(code=4000, reason="superseded by new model connection")
+        self.model = conn
+        self.model_ready.set()
+        try:
+            async for raw in conn:
+                t_recv = time.perf_counter()
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    self.counters["unroutable"] += 1
+                    continue
+                if not isinstance(msg, dict):
+                    self.counters["unroutable"] += 1
+                    continue
+                sid = msg.pop("session_id", None) or msg.get("user_id")
+                session = self.sessions.get(str(sid)) if sid is not None else None
+                if session is None and sid is None and len(self.sessions) == 1:
+                    # 老版本 model server 不回 session_id：只有一个 session 时仍可路由
+                    session = next(iter(self.sessions.values()))
+                if session is None:
+                    self.counters["unroutable"] += 1
+                    continue
+                if msg.get("type") in ("response", "error"):
+                    session.awaiting_since = None
+                self.deliver(session, t_recv, json.dumps(msg, ensure_ascii=False))
+        except ConnectionClosed:
+            pass
+        finally:
+            if self.model is conn:
+                self.model = None
+                self.model_ready.clear()
+
+    # ---------- routing ----------
+    async def handler(self, conn: ServerConnection) -> None:
+        path = conn.request.path.split("?", 1)[0]
+        if path == "/ui":
+            await self.handle_ui(conn)
+        elif path == "/model":
+            await self.handle_model(conn)
+        else:
+            await conn.close(code=1008, reason=f"unknown path {path}")
+
+    def process_request(self, conn: ServerConnection, request):
+        path = request.path.split("?", 1)[0]
+        if path == "/stats":
+            return conn.respond(HTTPStatus.OK, json.dumps(self.stats(), indent=2) + "\n")
+        if path == "/health":
+            return conn.respond(HTTPStatus.OK, "ok\n")
+        return None
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+async def run(args) -> None:
+    bridge = Bridge(args)
+    background = [asyncio.create_task(bridge.model_sender()), asyncio.create_task(bridge.reaper())]
+    async with serve(
+        bridge.handler,
+        args.host,
+        args.port,
+        process_request=bridge.process_request,
+        ping_interval=args.ping_interval,
+        ping_timeout=args.ping_timeout,
+        max_size=args.max_message_bytes,
+        compression=None,  # 小 JSON 消息压缩得不偿失，只会增加转发延迟
+    ) as server:
+        print(f"🔌 Bridge listening on ws://{args.host}:{args.port} (/ui, /model, GET /stats)")
+        try:
+            await server.serve_forever()
+        finally:
+            for t in background:
+                t.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket bridge relaying /ui <-> /model JSON messages.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--model_queue", type=int, default=1024, help="Max messages waiting for the model")
+    parser.add_argument("--ui_queue", type=int, default=64, help="Max messages buffered per UI session")
+    parser.add_argument("--busy_timeout", type=float, default=2.0, help="Seconds to wait on a full model queue")
+    parser.add_argument("--hello_timeout", type=float, default=10.0)
+    parser.add_argument("--response_timeout", type=float, default=120.0, help="Seconds before MODEL_TIMEOUT")
+    parser.add_argument("--session_ttl", type=float, default=900.0, help="Seconds a detached session is kept for resume")
+    parser.add_argument("--ping_interval", type=float, default=20.0)
+    parser.add_argument("--ping_timeout", type=float, default=20.0)
+    parser.add_argument("--max_message_bytes", type=int, default=1 << 20)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("\n👋 Bridge stopped.")
+
+
+if __name__ == "__main__":
+    main()
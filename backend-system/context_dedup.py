@@ -0,0 +1,264 @@
+# context_dedup.py — Find near-duplicate scenarios in a contexts JSON before generating prompts
+#
+# Usage:
+#   python context_dedup.py --contexts data/combined_contexts_100.json                      # 只出报告
+#   python context_dedup.py --contexts data/combined_contexts_100.json --action drop \
+#       --out data/combined_contexts_100.dedup.json                                         # 每个簇只留一条
+#   python context_dedup.py --contexts data/context_seen+unseen.json --threshold 0.5 --scope global
+#
+# 每条 context 都要花 Section 4/5 两次 LLM 调用和一次出图，近似重复的场景不值得再付一遍：
+# - 文本 = activity + expanded_activity（去掉 [LOCATION: …] 标注和 "Step N:"），取 k 词 shingle，crc32 成 uint32；
+# - MinHash：multiply-shift 哈希，所有文档的 shingle 拼成一个数组，按块用 np.minimum.reduceat 求签名；
+# - LSH 分桶（bands × rows）只产生候选对，再用签名一致率估计 Jaccard，过 --threshold 的才算重复；
+# - 重复对用向量化的 label propagation 合并成簇，簇内保留最早出现的那条；
+# - 默认只在同一 persona 内比较（不同 persona 的同一场景会生成不同的 Section 4/5），--scope global 放开。
+# 全程没有文档两两比较的 Python 循环，几万条 context 也是秒级。
+
+import argparse
+import json
+import re
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from sharding import context_ids, item_key
+
+ANNOTATION_RE = re.compile(r"\[[^\]]*\]|\bstep\s+\d+\s*:", re.IGNORECASE)
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+# 一次参与签名计算的 shingle 数上限（num_perm × 这个数 × 8 字节）
+BLOCK_SHINGLES = 1 << 17
+
+
+# -----------------------------------------
+# Text → shingles
+# -----------------------------------------
+def scenario_text(it: Dict[str, Any], fields: List[str]) -> str:
+    src = it.get("context_scenario") if isinstance(it.get("context_scenario"), dict) else it
+    return " ".join(str(src.get(f) or "") for f in fields)
+
+
+def shingles(text: str, k: int) -> np.ndarray:
+    tokens = TOKEN_RE.findall(ANNOTATION_RE.sub(" ", text).lower())
+    if not tokens:
+        return np.empty(0, dtype=np.uint32)
+    if len(tokens) < k:
+        grams = [" ".join(tokens)]
+    else:
+        grams = [" ".join(tokens[i : i + k]) for i in range(len(tokens) - k + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint32, count=len(grams)))
+
+
+# -----------------------------------------
+# MinHash + LSH
+# -----------------------------------------
+def minhash_signatures(docs: List[np.ndarray], num_perm: int, seed: int = 1) -> np.ndarray:
+    """docs 里每个元素是一篇文档的 shingle 哈希（非空）；返回 (n_docs, num_perm) uint32 签名。"""
+    rng = np.random.default_rng(seed)
+    a = (rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1))[:, None]  # 奇数乘子
+    b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)[:, None]
+    sig = np.empty((len(docs), num_perm), dtype=np.uint32)
+
+    start = 0
+    while start < len(docs):
+        # 取一块文档，使块内 shingle 总数不超过 BLOCK_SHINGLES（至少一篇）
+        end, total = start, 0
+        while end < len(docs) and (end == start or total + len(docs[end]) <= BLOCK_SHINGLES):
+            total += len(docs[end])
+            end += 1
+        block = docs[start:end]
+        h = np.concatenate(block).astype(np.uint64)[None, :]
+        offsets = np.cumsum([0] + [len(d) for d in block[:-1]])
+        # multiply-shift：uint64 乘法自然回绕，取高 32 位
+        vals = (((h ^ b) * a) >> np.uint64(32)).astype(np.uint32)
+        sig[start:end] = np.minimum.reduceat(vals, offsets, axis=1).T
+        start = end
+    return sig
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """选 bands × rows = num_perm，使 LSH 的 S 曲线拐点 (1/b)^(1/r) 略低于阈值（宁多勿漏）。"""
+    target = threshold * 0.85
+    best = None
+    for r in range(1, num_perm + 1):
+        if num_perm % r:
+            continue
+        b = num_perm // r
+        err = abs((1.0 / b) ** (1.0 / r) - target)
+        if best is None or err < best[0]:
+            best = (err, b, r)
+    return best[1], best[2]
+
+
+def candidate_pairs(sig: np.ndarray, groups: np.ndarray, bands: int, rows: int, max_bucket: int) -> np.ndarray:
+    """返回 (m, 2) 的候选对 i < j；groups 相同的文档才会落进同一个桶。"""
+    n = sig.shape[0]
+    found = []
+    for k in range(bands):
+        keys = np.concatenate([groups[:, None].astype(np.uint32), sig[:, k * rows : (k + 1) * rows]], axis=1)
+        keys = np.ascontiguousarray(keys).view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+        _, bucket = np.unique(keys, return_inverse=True)
+        order = np.argsort(bucket, kind="stable")
+        sorted_b = bucket[order]
+        cuts = np.flatnonzero(np.diff(sorted_b)) + 1
+        starts = np.concatenate([[0], cuts])
+        sizes = np.diff(np.concatenate([starts, [n]]))
+        for s, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = order[s : s + size]
+            if size > max_bucket:
+                # 超大桶（模板化文本）：连成星形就够聚成一个簇，不展开 O(size²) 个对
+                found.append(np.stack([np.full(size - 1, members[0]), members[1:]], axis=1))
+            else:
+                i, j = np.triu_indices(size, 1)
+                found.append(np.stack([members[i], members[j]], axis=1))
+    if not found:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(found).astype(np.int64), axis=1)
+    codes = np.unique(pairs[:, 0] * n + pairs[:, 1])
+    return np.stack([codes // n, codes % n], axis=1)
+
+
+def estimate_similarity(sig: np.ndarray, pairs: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    out = np.empty(len(pairs), dtype=np.float32)
+    for s in range(0, len(pairs), chunk):
+        p = pairs[s : s + chunk]
+        out[s : s + chunk] = (sig[p[:, 0]] == sig[p[:, 1]]).mean(axis=1)
+    return out
+
+
+def connected_components(n: int, pairs: np.ndarray) -> np.ndarray:
+    """向量化 label propagation：每个点的 label 收敛到所在连通分量里最小的下标。"""
+    labels = np.arange(n)
+    if len(pairs) == 0:
+        return labels
+    i, j = pairs[:, 0], pairs[:, 1]
+    while True:
+        m = np.minimum(labels[i], labels[j])
+        new = labels.copy()
+        np.minimum.at(new, i, m)
+        np.minimum.at(new, j, m)
+        new = new[new]  # pointer jumping，加速收敛
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+def item_label(it: Dict[str, Any], idx: int) -> str:
+    ids = context_ids(it)
+    return item_key(*ids) if ids else f"#{idx}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MinHash/LSH near-duplicate detection over context scenarios.")
+    parser.add_argument("--contexts", required=True, help="Contexts JSON array (combined or raw scenarios)")
+    parser.add_argument("--fields", nargs="+", default=["activity", "expanded_activity"],
+                        help="Scenario fields that make up the compared text")
+    parser.add_argument("--threshold", type=float, default=0.6, help="Estimated Jaccard similarity to call a duplicate")
+    parser.add_argument("--shingle", type=int, default=3, help="Words per shingle")
+    parser.add_argument("--num_perm", type=int, default=128)
+    parser.add_argument("--max_bucket", type=int, default=200)
+    parser.add_argument("--scope", choices=["persona", "global"], default="persona",
+                        help="Only compare contexts of the same persona (default) or all of them")
+    parser.add_argument("--action", choices=["report", "drop"], default="report",
+                        help="drop: write --out with one context per duplicate cluster")
+    parser.add_argument("--out", default=None, help="Deduplicated contexts JSON (default: <contexts>.dedup.json)")
+    parser.add_argument("--report", default=None, help="Cluster report JSON (default: <contexts>.dedup_report.json)")
+    args = parser.parse_args()
+
+    ctx_path = Path(args.contexts)
+    items = json.loads(ctx_path.read_text(encoding="utf-8"))
+    if not isinstance(items, list):
+        raise SystemExit("❌ contexts JSON top level must be an array ([...])")
+
+    t0 = time.perf_counter()
+    docs = [shingles(scenario_text(it, args.fields), args.shingle) if isinstance(it, dict) else np.empty(0, np.uint32)
+            for it in items]
+    usable = np.array([len(d) > 0 for d in docs])
+    idx = np.flatnonzero(usable)
+    if not usable.all():
+        print(f"⚠️  {int((~usable).sum())} context(s) have no scenario text; they are never treated as duplicates")
+
+    # persona 范围：同一 persona 的文档共享一个 group id
+    group_ids: Dict[Optional[str], int] = {}
+    groups = np.zeros(len(idx), dtype=np.int64)
+    if args.scope == "persona":
+        for n, i in enumerate(idx):
+            ids = context_ids(items[i])
+            groups[n] = group_ids.setdefault(ids[0] if ids else None, len(group_ids))
+
+    sig = minhash_signatures([docs[i] for i in idx], args.num_perm)
+    t_sig = time.perf_counter() - t0
+
+    bands, rows = choose_bands(args.num_perm, args.threshold)
+    pairs = candidate_pairs(sig, groups, bands, rows, args.max_bucket)
+    sims = estimate_similarity(sig, pairs)
+    keep = sims >= args.threshold
+    dup_pairs, dup_sims = pairs[keep], sims[keep]
+    labels = connected_components(len(idx), dup_pairs)
+    t_total = time.perf_counter() - t0
+
+    # 簇：label 就是簇里最早的那条（下标最小），它被保留
+    clusters: Dict[int, List[int]] = {}
+    for n, lab in enumerate(labels):
+        if lab != n:
+            clusters.setdefault(int(lab), []).append(n)
+    best_sim: Dict[int, float] = {}
+    for (a, b), s in zip(dup_pairs, dup_sims):
+        lab = int(labels[a])
+        best_sim[lab] = max(best_sim.get(lab, 0.0), float(s))
+
+    dropped = {int(idx[m]) for members in clusters.values() for m in members}
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "contexts": str(ctx_path),
+        "fields": args.fields,
+        "threshold": args.threshold,
+        "num_perm": args.num_perm,
+        "bands": bands,
+        "rows": rows,
+        "scope": args.scope,
+        "items": len(items),
+        "candidate_pairs": int(len(pairs)),
+        "duplicate_pairs": int(len(dup_pairs)),
+        "clusters": [
+            {
+                "keep": item_label(items[idx[lab]], int(idx[lab])),
+                "drop": [item_label(items[idx[m]], int(idx[m])) for m in members],
+                "max_similarity": round(best_sim.get(lab, 0.0), 3),
+                "activity": scenario_text(items[idx[lab]], args.fields[:1]),
+            }
+            for lab, members in sorted(clusters.items())
+        ],
+        "dropped": len(dropped),
+        "seconds": round(t_total, 3),
+    }
+
+    report_path = Path(args.report) if args.report else ctx_path.with_suffix(".dedup_report.json")
+    report_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(
+        f"🔎 {len(items)} context(s): {len(pairs)} candidate pair(s) from {bands}×{rows} LSH bands, "
+        f"{len(dup_pairs)} above {args.threshold} → {len(clusters)} cluster(s), {len(dropped)} duplicate(s) "
+        f"(signatures {t_sig:.2f}s, total {t_total:.2f}s)"
+    )
+    for c in report["clusters"][:10]:
+        print(f"   keep {c['keep']}  drop {', '.join(c['drop'])}  (sim {c['max_similarity']})")
+    if len(clusters) > 10:
+        print(f"   … {len(clusters) - 10} more cluster(s)")
+    print(f"🗂 Report written: {report_path}")
+
+    if args.action == "drop":
+        out_path = Path(args.out) if args.out else ctx_path.with_suffix(".dedup.json")
+        kept = [it for i, it in enumerate(items) if i not in dropped]
+        out_path.write_text(json.dumps(kept, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"✂️  Wrote {len(kept)} context(s) → {out_path} (run prompt_factory.py --contexts on this file)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import json
 import random
 from pathlib import Path
@@ -13,8 +14,16 @@ OUT_FILE = Path("/Users/joeyyan/PyHCI/data/combined_contexts_100.json")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Pair 6 random personas with every scenario into combined contexts.")
+    parser.add_argument("--personas", default=str(PERSONA_FILE))
+    parser.add_argument("--contexts", default=str(CONTEXT_FILE))
+    parser.add_argument("--out", default=str(OUT_FILE))
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a reproducible pairing")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
     # 1. 读取 Persona JSON
-    with PERSONA_FILE.open("r", encoding="utf-8") as f:
+    with Path(args.personas).open("r", encoding="utf-8") as f:
         personas = json.load(f)
 
     # 至少需要 6 个
@@ -22,10 +31,10 @@ def main():
         raise ValueError(f"需要至少 6 个 persona，但目前只有 {len(personas)} 个")
 
     # 2. 从 personas 随机挑选 6 个不同的人物
-    selected_personas = random.sample(personas, 6)
+    selected_personas = rng.sample(personas, 6)
 
     # 3. 读取 Context 场景 JSON
-    with CONTEXT_FILE.open("r", encoding="utf-8") as f:
+    with Path(args.contexts).open("r", encoding="utf-8") as f:
         contexts = json.load(f)
 
     results = []
@@ -33,7 +42,7 @@ def main():
 
     for ctx in contexts:
         # 从 6 个随机挑一个 persona
-        persona = random.choice(selected_personas)
+        persona = rng.choice(selected_personas)
 
         # 构建新的 JSON 条目
         new_item = {
@@ -59,10 +68,10 @@ def main():
         context_id_counter += 1
 
     # 写入输出文件
-    with OUT_FILE.open("w", encoding="utf-8") as f:
+    with Path(args.out).open("w", encoding="utf-8") as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
 
-    print(f"✔ 成功随机挑选 6 个 persona，并与场景组合生成 {len(results)} 条记录 → {OUT_FILE}")
+    print(f"✔ 成功随机挑选 6 个 persona，并与场景组合生成 {len(results)} 条记录 → {args.out}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+# image_dedup.py — Perceptual-hash index over generated comics, flag near-duplicates
+#
+# Usage:
+#   python image_dedup.py --images_dir images                      # 扫描 + 报告
+#   python image_dedup.py --images_dir images --action requeue     # 把重复图移到 quarantine，image_runner 下次会重画
+#   python image_dedup.py --images_dir images/preview --action skip
+#   python image_runner.py --tier final ... --skip_list images/preview/skip.txt   # 重复的预览不出终稿
+#   python image_dedup.py --images_dir images --query images/Persona_4_Activity_103.jpg --radius 12
+#
+# - pHash：灰度 32×32 → 二维 DCT（矩阵乘法，整批一起算）→ 左上 8×8 与中位数比较 → 64 bit；
+# - 多进程按批计算，索引（phash_index.json）按 size + mtime 增量更新，只重算新增 / 变更的图；
+# - 近邻查询：uint64 XOR + 查表 popcount，全向量化，按块做 all-pairs，没有 Python 双重循环；
+# - 默认只比较同一 persona 的不同 activity（--cross_persona 放开）。
+
+import argparse
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+NAME_RE = re.compile(r"^Persona_(\d+)_Activity_(\d+)\.jpg$")
+HASH_SIZE = 8
+DCT_SIZE = 32
+POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# -----------------------------------------
+# Hashing
+# -----------------------------------------
+def dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m.astype(np.float32)
+
+
+def load_gray(path: str) -> np.ndarray:
+    with Image.open(path) as im:
+        # JPEG draft 模式直接按 1/8 解码，1024×1024 的图解码成本降一个量级
+        im.draft("L", (DCT_SIZE * 2, DCT_SIZE * 2))
+        im = im.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS)
+        return np.asarray(im, dtype=np.float32)
+
+
+def phash_batch(paths: List[str]) -> List[int]:
+    """一批图片一起做 DCT：(B,32,32) 的张量两次矩阵乘法。"""
+    d = dct_matrix(DCT_SIZE)
+    imgs = np.stack([load_gray(p) for p in paths])
+    coeffs = d @ imgs @ d.T
+    low = coeffs[:, :HASH_SIZE, :HASH_SIZE].reshape(len(paths), -1)
+    med = np.median(low[:, 1:], axis=1, keepdims=True)  # 去掉 DC 分量再取中位数
+    bits = low > med
+    packed = np.packbits(bits, axis=1)  # (B, 8) uint8
+    return [int(x) for x in packed.view(">u8").ravel()]
+
+
+# -----------------------------------------
+# Index
+# -----------------------------------------
+def load_index(path: Path) -> Dict[str, dict]:
+    if not path.exists():
+        return {}
+    data = json.loads(path.read_text(encoding="utf-8"))
+    return data.get("items", {})
+
+
+def save_index(path: Path, items: Dict[str, dict]) -> None:
+    payload = {"version": 1, "hash": f"phash{HASH_SIZE * HASH_SIZE}", "items": dict(sorted(items.items()))}
+    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def update_index(images_dir: Path, index: Dict[str, dict], workers: int, batch_size: int) -> Tuple[Dict[str, dict], int]:
+    """只对新增或 size/mtime 变化的图片重新计算；已删除的图片从索引里去掉。"""
+    current = {}
+    todo = []
+    for p in sorted(images_dir.glob("Persona_*_Activity_*.jpg")):
+        if not NAME_RE.match(p.name):
+            continue
+        st = p.stat()
+        old = index.get(p.name)
+        if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            current[p.name] = old
+        else:
+            current[p.name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            todo.append(p)
+
+    if todo:
+        batches = [todo[i : i + batch_size] for i in range(0, len(todo), batch_size)]
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = ex.map(phash_batch, [[str(p) for p in b] for b in batches])
+            for batch, hashes in zip(batches, results):
+                for p, h in zip(batch, hashes):
+                    current[p.name]["phash"] = f"{h:016x}"
+    return current, len(todo)
+
+
+# -----------------------------------------
+# Hamming queries (vectorized)
+# -----------------------------------------
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a、b 为可广播的 uint64 数组，返回逐元素的汉明距离。"""
+    x = np.bitwise_xor(a, b)
+    return POPCOUNT8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def index_arrays(items: Dict[str, dict]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    names = sorted(items)
+    hashes = np.array([int(items[n]["phash"], 16) for n in names], dtype=np.uint64)
+    personas = np.array([int(NAME_RE.match(n).group(1)) for n in names], dtype=np.int64)
+    return names, hashes, personas
+
+
+def find_pairs(hashes: np.ndarray, personas: np.ndarray, radius: int, cross_persona: bool,
+               block: int = 1024) -> List[Tuple[int, int, int]]:
+    pairs = []
+    n = len(hashes)
+    for start in range(0, n, block):
+        rows = np.arange(start, min(start + block, n))
+        dist = hamming(hashes[rows, None], hashes[None, :])
+        mask = (dist <= radius) & (np.arange(n)[None, :] > rows[:, None])
+        if not cross_persona:
+            mask &= personas[rows, None] == personas[None, :]
+        ii, jj = np.nonzero(mask)
+        pairs.extend(zip(rows[ii].tolist(), jj.tolist(), dist[ii, jj].tolist()))
+    return pairs
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual-hash index + near-duplicate detection for generated comics.")
+    parser.add_argument("--images_dir", default="images")
+    parser.add_argument("--index", default=None, help="Index file (default <images_dir>/phash_index.json)")
+    parser.add_argument("--radius", type=int, default=10, help="Max Hamming distance (of 64 bits) to count as duplicate")
+    parser.add_argument("--cross_persona", action="store_true", help="Also compare images of different personas")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--query", default=None, help="Print neighbours of this image and exit")
+    parser.add_argument("--action", choices=["report", "skip", "requeue"], default="report",
+                        help="skip: write --skip_list for image_runner.py; requeue: move the later duplicate to --quarantine_dir")
+    parser.add_argument("--skip_list", default=None, help="Default <images_dir>/skip.txt")
+    parser.add_argument("--quarantine_dir", default=None, help="Default <images_dir>/_duplicates")
+    parser.add_argument("--report", default=None, help="Default <images_dir>/duplicates.json")
+    args = parser.parse_args()
+
+    images_dir = Path(args.images_dir)
+    if not images_dir.is_dir():
+        raise SystemExit(f"❌ images directory not found: {images_dir}")
+    index_path = Path(args.index) if args.index else images_dir / "phash_index.json"
+
+    items, n_new = update_index(images_dir, load_index(index_path), args.workers, args.batch_size)
+    save_index(index_path, items)
+    print(f"🗂 Index: {len(items)} image(s), {n_new} (re)hashed → {index_path}")
+    if not items:
+        return
+
+    names, hashes, personas = index_arrays(items)
+
+    if args.query:
+        q = Path(args.query)
+        h = np.array(phash_batch([str(q)]), dtype=np.uint64)
+        dist = hamming(h, hashes)
+        order = np.argsort(dist, kind="stable")
+        for i in order[dist[order] <= args.radius]:
+            print(f"  {dist[i]:>2}  {names[i]}")
+        return
+
+    pairs = find_pairs(hashes, personas, args.radius, args.cross_persona)
+    report = [{"a": names[i], "b": names[j], "distance": d} for i, j, d in sorted(pairs, key=lambda t: t[2])]
+    # 每对里保留排序靠前的那张，后一张视为重复
+    dup_names = sorted({names[j] for _, j, _ in pairs})
+    report_path = Path(args.report) if args.report else images_dir / "duplicates.json"
+    report_path.write_text(
+        json.dumps({"radius": args.radius, "pairs": report, "duplicates": dup_names}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    for r in report:
+        print(f"⚠️  {r['a']} ~ {r['b']} (distance {r['distance']})")
+    print(f"📄 {len(report)} near-duplicate pair(s), {len(dup_names)} image(s) flagged → {report_path}")
+
+    if args.action == "skip":
+        # 每行一个 key，image_runner.py --skip_list 读它（read_stems 的格式）
+        skip_path = Path(args.skip_list) if args.skip_list else images_dir / "skip.txt"
+        skip_path.write_text("".join(f"{Path(n).stem}\n" for n in dup_names), encoding="utf-8")
+        print(f"⏭️  Skip list written: {skip_path}; pass it to image_runner.py --skip_list")
+    elif args.action == "requeue":
+        qdir = Path(args.quarantine_dir) if args.quarantine_dir else images_dir / "_duplicates"
+        qdir.mkdir(parents=True, exist_ok=True)
+        for n in dup_names:
+            (images_dir / n).replace(qdir / n)
+            items.pop(n, None)
+        save_index(index_path, items)
+        print(f"🔁 Moved {len(dup_names)} image(s) to {qdir}; rerun image_runner.py to regenerate them")
+
+
+if __name__ == "__main__":
+    main()
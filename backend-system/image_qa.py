@@ -0,0 +1,262 @@
+# image_qa.py — Automated visual QA gate for generated 2×2 comics
+#
+# Usage:
+#   python image_qa.py --images_dir images                         # 打分 + 报告（images/qa_report.json）
+#   python image_qa.py --images_dir images --action requeue        # 不合格的图移到 _qa_failed，image_runner 下次会重画
+#   python image_qa.py --images_dir images --fail_on warn --workers 8
+#
+# 检查的都是 build_combined_prompt 里明确要求、又能用图像统计量判断的几条：
+# - 网格：复用 panel_splitter.detect_panels 找 gutter；找不到（fallback）或四格大小 / gutter 位置明显不均 → 不合格；
+# - 助手：每格在 HSV 里取「蓝色、够饱和、够亮」的像素，缩到粗网格后做连通域（向量化的 label propagation），
+#   面积在 [min_orb, max_orb] 之间的蓝色块算一个 orb。每格不是恰好 1 个只给 warn（人工挑过的 PhaseData 里
+#   本来就有助手不出场或出现两次的格子），整张图里有 orb 的格子少于 --min_orb_panels 才算不合格；
+#   超过 max_orb 的大块记为蓝色背景，这时 orb 计数不可靠；
+# - 空白 / 过曝：每格灰度标准差太低（空白）或整体太亮且低饱和（washed out）→ 不合格；
+# - 「气泡外不能有文字」没法用这类统计量可靠判断，不在这里检查。
+#
+# 颜色阈值是在 frontend-viewer/src/assets/PhaseData 的 100 张图上标定的：orb 实际色相在 PIL 的 119-134 左右
+# （偏青），淡色的饱和度只有 45 上下；小 orb 缩图后只占 panel 的 0.1%-0.2%。
+#
+# 结果按 size + mtime 增量缓存在报告里，只重新检查新增 / 变更的图；检查在进程池里跑。
+# 每条结果带图片的 sha1，image_runner --tier final 只在它和 tiers.json 里记录的预览一致时才采纳。
+
+import argparse
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from panel_splitter import detect_panels
+
+QA_VERSION = 3
+ANALYSIS_SIZE = 512  # 统计量在缩小后的图上算，JPEG draft 模式直接按比例解码
+CELL = 4  # orb 连通域在 CELL×CELL 的粗网格上算
+
+# PIL 的 HSV 三个通道都是 0-255：(110, 180) 大约是 155°-255°，覆盖青蓝到蓝
+BLUE_HUE = (110, 180)
+MIN_SAT = 40
+MIN_VAL = 120
+
+
+# -----------------------------------------
+# Image statistics
+# -----------------------------------------
+def load_rgb(path: str) -> Image.Image:
+    with Image.open(path) as im:
+        im.draft("RGB", (ANALYSIS_SIZE, ANALYSIS_SIZE))
+        im = im.convert("RGB")
+        if max(im.size) > ANALYSIS_SIZE:
+            im.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.BILINEAR)
+        return im
+
+
+def label_components(mask: np.ndarray) -> np.ndarray:
+    """4 邻域连通域：每个前景格取邻居最大编号，直到不再变化。背景为 0。"""
+    h, w = mask.shape
+    labels = np.where(mask, np.arange(1, h * w + 1).reshape(h, w), 0)
+    while True:
+        padded = np.pad(labels, 1)
+        nxt = np.maximum.reduce([
+            labels,
+            padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:],
+        ])
+        nxt = np.where(mask, nxt, 0)
+        if np.array_equal(nxt, labels):
+            return labels
+        labels = nxt
+
+
+def blue_blobs(hsv: np.ndarray, min_frac: float, max_frac: float) -> Tuple[int, float]:
+    """返回 (orb 数, 最大蓝色块占 panel 的比例)。"""
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    mask = (h >= BLUE_HUE[0]) & (h <= BLUE_HUE[1]) & (s >= MIN_SAT) & (v >= MIN_VAL)
+    gh, gw = mask.shape[0] // CELL, mask.shape[1] // CELL
+    if gh == 0 or gw == 0:
+        return 0, 0.0
+    # 粗网格：一个格子里蓝色像素过半才算前景，顺便去掉零星噪点
+    coarse = mask[: gh * CELL, : gw * CELL].reshape(gh, CELL, gw, CELL).mean(axis=(1, 3)) > 0.5
+    labels = label_components(coarse)
+    _, sizes = np.unique(labels[labels > 0], return_counts=True)
+    fracs = sizes / float(gh * gw)
+    n_orbs = int(((fracs >= min_frac) & (fracs <= max_frac)).sum())
+    return n_orbs, float(fracs.max()) if len(fracs) else 0.0
+
+
+def grid_irregularity(boxes: Dict[str, list], width: int, height: int) -> float:
+    """四格宽高相对差异与 gutter 偏离中心程度中的最大值（0 = 完全规则）。"""
+    ws = np.array([b[2] for b in boxes.values()], dtype=np.float64)
+    hs = np.array([b[3] for b in boxes.values()], dtype=np.float64)
+    size_dev = max((ws.max() - ws.min()) / max(ws.mean(), 1.0), (hs.max() - hs.min()) / max(hs.mean(), 1.0))
+    gutter_x = (boxes["p1"][0] + boxes["p1"][2] + boxes["p2"][0]) / 2.0
+    gutter_y = (boxes["p1"][1] + boxes["p1"][3] + boxes["p3"][1]) / 2.0
+    center_dev = max(abs(gutter_x / width - 0.5), abs(gutter_y / height - 0.5)) * 2.0
+    return float(max(size_dev, center_dev))
+
+
+# -----------------------------------------
+# Per-image job (runs in worker processes)
+# -----------------------------------------
+def qa_one(job: Tuple[str, dict]) -> Tuple[str, Optional[dict], Optional[str]]:
+    src, opts = job
+    src_path = Path(src)
+    try:
+        im = load_rgb(src)
+        gray = np.asarray(im.convert("L"), dtype=np.float32)
+        hsv = np.asarray(im.convert("HSV"), dtype=np.int16)
+        boxes, fallback = detect_panels(gray, opts["min_prominence"])
+        height, width = gray.shape
+
+        issues: List[Tuple[str, str]] = []  # (severity, message)
+        irregularity = 0.0
+        if fallback:
+            issues.append(("fail", "gutters not found"))
+        else:
+            irregularity = grid_irregularity(boxes, width, height)
+            if irregularity > opts["max_irregularity"]:
+                issues.append(("fail", f"irregular grid ({irregularity:.2f})"))
+
+        panels = {}
+        for name, (x, y, bw, bh) in boxes.items():
+            if bw <= 0 or bh <= 0:
+                issues.append(("fail", f"{name}: empty panel box"))
+                continue
+            g = gray[y : y + bh, x : x + bw]
+            p_hsv = hsv[y : y + bh, x : x + bw]
+            std = float(g.std())
+            mean = float(g.mean())
+            sat = float(p_hsv[..., 1].mean())
+            orbs, largest_blue = blue_blobs(p_hsv, opts["min_orb"], opts["max_orb"])
+            panels[name] = {
+                "orbs": orbs,
+                "largest_blue": round(largest_blue, 4),
+                "gray_mean": round(mean, 1),
+                "gray_std": round(std, 1),
+                "saturation": round(sat, 1),
+            }
+            if std < opts["min_std"]:
+                issues.append(("fail", f"{name}: blank panel (std {std:.1f})"))
+                continue
+            if mean > opts["washed_mean"] and sat < opts["washed_sat"]:
+                issues.append(("fail", f"{name}: washed out (mean {mean:.0f}, sat {sat:.0f})"))
+            if orbs != 1:
+                issues.append(("warn", f"{name}: {orbs} assistant orb(s)"))
+
+        # 大面积蓝色背景会吞掉 orb 或被拆成多块，这种格子不参与「助手缺席」的判断
+        with_orb = sum(1 for p in panels.values() if p["orbs"] >= 1 or p["largest_blue"] > opts["max_orb"])
+        if panels and with_orb < opts["min_orb_panels"]:
+            issues.append(("fail", f"assistant orb in only {with_orb} panel(s)"))
+
+        n_fail = sum(1 for sev, _ in issues if sev == "fail")
+        n_warn = len(issues) - n_fail
+        st = src_path.stat()
+        entry = {
+            "version": QA_VERSION,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha1": hashlib.sha1(src_path.read_bytes()).hexdigest(),
+            "status": "fail" if n_fail else ("warn" if n_warn else "pass"),
+            "score": round(max(0.0, 1.0 - 0.25 * n_fail - 0.1 * n_warn), 2),
+            "fallback": fallback,
+            "irregularity": round(irregularity, 3),
+            "issues": [f"{sev}: {msg}" for sev, msg in issues],
+            "panels": panels,
+        }
+        return src_path.name, entry, None
+    except Exception as e:
+        return src_path.name, None, str(e)
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Visual QA gate for generated 2x2 comics.")
+    parser.add_argument("--images_dir", default="images")
+    parser.add_argument("--report", default=None, help="Default <images_dir>/qa_report.json")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--recheck", action="store_true", help="Ignore cached results")
+    parser.add_argument("--action", choices=["report", "requeue"], default="report",
+                        help="requeue: move failed images to --quarantine_dir so image_runner re-renders them")
+    parser.add_argument("--quarantine_dir", default=None, help="Default <images_dir>/_qa_failed")
+    parser.add_argument("--fail_on", choices=["fail", "warn"], default="fail",
+                        help="Lowest status that counts as a failure for requeue / exit code")
+    # 阈值（在 ANALYSIS_SIZE 缩放后的图上）
+    parser.add_argument("--min_prominence", type=float, default=8.0, help="Gutter prominence (see panel_splitter)")
+    parser.add_argument("--max_irregularity", type=float, default=0.15, help="Max relative panel size / gutter offset")
+    parser.add_argument("--min_orb", type=float, default=0.001, help="Min blue blob area as a fraction of the panel")
+    parser.add_argument("--max_orb", type=float, default=0.12, help="Max blue blob area as a fraction of the panel")
+    parser.add_argument("--min_orb_panels", type=int, default=2, help="Fail when fewer panels contain an orb")
+    parser.add_argument("--min_std", type=float, default=6.0, help="Gray std below this = blank panel")
+    parser.add_argument("--washed_mean", type=float, default=235.0)
+    parser.add_argument("--washed_sat", type=float, default=20.0)
+    args = parser.parse_args()
+
+    images_dir = Path(args.images_dir)
+    if not images_dir.is_dir():
+        raise SystemExit(f"❌ images directory not found: {images_dir}")
+    report_path = Path(args.report) if args.report else images_dir / "qa_report.json"
+    opts = {k: getattr(args, k) for k in
+            ("min_prominence", "max_irregularity", "min_orb", "max_orb", "min_orb_panels", "min_std", "washed_mean",
+             "washed_sat")}
+
+    old: Dict[str, dict] = {}
+    if report_path.exists() and not args.recheck:
+        data = json.loads(report_path.read_text(encoding="utf-8"))
+        # 阈值变了缓存就不能用
+        if data.get("thresholds") == opts:
+            old = data.get("items", {})
+
+    files = sorted(images_dir.glob("Persona_*_Activity_*.jpg"))
+    if args.limit:
+        files = files[: args.limit]
+    if not files:
+        raise SystemExit(f"❌ No images found under {images_dir}")
+
+    items: Dict[str, dict] = {}
+    jobs = []
+    for f in files:
+        prev = old.get(f.name)
+        st = f.stat()
+        if prev and prev.get("version") == QA_VERSION and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+            items[f.name] = prev
+        else:
+            jobs.append((str(f), opts))
+
+    print(f"🔍 Checking {len(jobs)} image(s) ({len(files) - len(jobs)} cached)")
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        for name, entry, err in ex.map(qa_one, jobs, chunksize=4):
+            if err:
+                print(f"❌ {name}: {err}")
+                continue
+            items[name] = entry
+
+    bad_status = {"fail"} if args.fail_on == "fail" else {"fail", "warn"}
+    failed = sorted(n for n, e in items.items() if e["status"] in bad_status)
+    counts = {s: sum(1 for e in items.values() if e["status"] == s) for s in ("pass", "warn", "fail")}
+    for n in failed:
+        print(f"⚠️  {n} ({items[n]['score']}): {'; '.join(items[n]['issues'][:3])}")
+
+    report_path.write_text(
+        json.dumps({"thresholds": opts, "summary": counts, "failed": failed, "items": dict(sorted(items.items()))},
+                   ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    print(f"📄 {counts['pass']} pass, {counts['warn']} warn, {counts['fail']} fail → {report_path}")
+
+    if args.action == "requeue" and failed:
+        qdir = Path(args.quarantine_dir) if args.quarantine_dir else images_dir / "_qa_failed"
+        qdir.mkdir(parents=True, exist_ok=True)
+        for n in failed:
+            (images_dir / n).replace(qdir / n)
+        print(f"🔁 Moved {len(failed)} image(s) to {qdir}; rerun image_runner.py to regenerate them")
+    elif failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,38 @@
 # image_runner.py — Generate ONE 2×2 image per Prompt, skip existing JPGs
-
-import os, json, argparse, base64
+#
+# Variant mode（A/B 刺激材料）：
+#   python image_runner.py --variants 2                                  # 同一 prompt 一次请求 n=2 → _A / _B
+#   python image_runner.py --condition_dirs prompts_condA prompts_condB  # 每个条件一个 prompts 目录 → _A / _B
+# - 同一 prompt 的多个样本用 images.generate(n=...) 一次拿回来，不再顺序渲染多次；
+# - prompt 不同的条件（以及不同 item）放进线程池并发提交（--concurrency）；
+# - 文件名 Persona_X_Activity_Y_A.jpg / _B.jpg …，字母与后端 SelectionIn.selection 对应；
+# - manifest 里每个 item 记录 variants：字母 -> {file, condition, prompt, sample}。
+#
+# Tiered mode（先出预览，审过再出终稿）：
+#   python image_runner.py --tier preview                                        # 全部 prompt 低质量并发渲染 → images/preview/
+#   python image_qa.py --images_dir images/preview                               # 自动验收（可选）
+#   python image_runner.py --tier final --qa_report images/preview/qa_report.json --approved reviewed.txt
+# - 预览用 --preview_quality（默认 low），与终稿同尺寸、同 prompt，只是便宜、快；
+# - 终稿只重画通过的 item（--approved 名单 和/或 image_qa 报告里 pass 的），写到 out_dir，下游工具不用改；
+# - tiers.json 记录每个 item 所处的阶段（preview / rejected / final）和 prompt 的哈希：
+#   prompt 改过的 item 预览自动重画，旧预览上的批准不会被用来出终稿；
+# - --skip_list（image_dedup.py --action skip 写的重复图名单）里的 item 任何模式下都不渲染，
+#   记在 manifest 的 "skipped" 里；
+# - 同时记录预览文件的 sha1：image_qa 报告里的结论只有在它看的正是这张预览时才算数，
+#   预览重画后没重新跑 QA 的条目会被忽略。
+
+import os, json, argparse, base64, hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
-from dotenv import load_dotenv
-from openai import OpenAI
+from string import ascii_uppercase
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from sharding import in_shard, manifest_name, parse_shard
+
+# openai / dotenv 只在 main 里导入，import 本模块不付 SDK 的启动开销
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
 # -----------------------------------------
@@ -124,15 +153,223 @@ def build_combined_prompt(full_prompt: dict) -> str:
 # -----------------------------------------
 # Call OpenAI image generation
 # -----------------------------------------
-def call_image(client: OpenAI, prompt: str, size: str, quality: str) -> bytes:
+def call_images(client: "OpenAI", prompt: str, size: str, quality: str, n: int = 1) -> List[bytes]:
     res = client.images.generate(
         model="gpt-image-1",
         prompt=prompt,
         size=size,
         quality=quality,
+        n=n,
     )
-    b64 = res.data[0].b64_json
-    return base64.b64decode(b64)
+    return [base64.b64decode(d.b64_json) for d in res.data]
+
+
+def call_image(client: "OpenAI", prompt: str, size: str, quality: str) -> bytes:
+    return call_images(client, prompt, size, quality)[0]
+
+
+# -----------------------------------------
+# Variant mode
+# -----------------------------------------
+def variant_letters(n_conditions: int, n_samples: int) -> List[List[str]]:
+    """按条件、样本顺序分配字母：2 个条件 × 1 个样本 -> [[A], [B]]；1 × 2 -> [[A, B]]。"""
+    total = n_conditions * n_samples
+    if total > len(ascii_uppercase):
+        raise SystemExit(f"❌ Too many variants ({total}); at most {len(ascii_uppercase)}")
+    letters = list(ascii_uppercase[:total])
+    return [letters[c * n_samples : (c + 1) * n_samples] for c in range(n_conditions)]
+
+
+def run_variants(client: "OpenAI", args, stems: List[str], condition_dirs: List[Path], out_dir: Path, manifest: dict) -> None:
+    letters = variant_letters(len(condition_dirs), args.variants)
+    items: Dict[str, dict] = {}
+    jobs = []
+    for stem in stems:
+        item = {"key": stem, "variants": {}, "status": "existing"}
+        items[stem] = item
+        for cond, (cdir, cond_letters) in enumerate(zip(condition_dirs, letters)):
+            pf = cdir / f"{stem}.txt"
+            targets = [out_dir / f"{stem}_{letter}.jpg" for letter in cond_letters]
+            for sample, (letter, path) in enumerate(zip(cond_letters, targets)):
+                item["variants"][letter] = {"file": str(path), "condition": cond, "prompt": str(pf), "sample": sample}
+            if not pf.exists():
+                print(f"⚠️  {stem}: missing prompt for condition {cond} ({pf})")
+                item["status"] = "missing_prompt"
+                continue
+            if all(p.exists() for p in targets) and not args.overwrite:
+                continue
+            jobs.append((stem, pf, targets))
+
+    print(f"🎨 {len(jobs)} request(s) for {len(stems)} item(s) × {len(condition_dirs)} condition(s), "
+          f"{args.variants} image(s) per request, concurrency {args.concurrency}")
+
+    def render(pf: Path, n: int) -> List[bytes]:
+        prompt = build_combined_prompt(load_json(pf))
+        return call_images(client, prompt, size=args.size, quality=args.quality, n=n)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = {pool.submit(render, pf, len(targets)): (stem, pf, targets) for stem, pf, targets in jobs}
+        for fut in as_completed(futures):
+            stem, pf, targets = futures[fut]
+            item = items[stem]
+            try:
+                images = fut.result()
+            except Exception as e:
+                print(f"❌ {pf.name}: {e}")
+                item["status"] = "failed"
+                continue
+            if len(images) < len(targets):
+                print(f"❌ {pf.name}: asked for {len(targets)} image(s), got {len(images)}")
+                item["status"] = "failed"
+                continue
+            for path, img_bytes in zip(targets, images):
+                with open(path, "wb") as f:
+                    f.write(img_bytes)
+            if item["status"] == "existing":
+                item["status"] = "generated"
+            print(f"✅ Saved: {', '.join(p.name for p in targets)}")
+
+    manifest["variant_mode"] = {
+        "conditions": [str(d) for d in condition_dirs],
+        "samples_per_condition": args.variants,
+        "letters": [l for group in letters for l in group],
+    }
+    for stem in stems:
+        manifest["items"].append(items[stem])
+        if items[stem]["status"] in ("existing", "generated"):
+            manifest["count"] += 1
+
+
+# -----------------------------------------
+# Tiered mode (preview -> final)
+# -----------------------------------------
+def prompt_digest(pf: Path) -> str:
+    return hashlib.sha1(pf.read_bytes()).hexdigest()[:16]
+
+
+def read_stems(path: Path) -> Set[str]:
+    """每行一个 key（可以带 .jpg / .txt 后缀），# 开头的是注释。"""
+    stems = set()
+    for line in read_text(path).splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            stems.add(Path(line).stem if line.endswith((".jpg", ".txt")) else line)
+    return stems
+
+
+def read_approvals(args, tiers: Dict[str, dict]) -> Tuple[Set[str], Set[str]]:
+    """(approved, rejected)：人工名单优先于 image_qa 的结论。
+
+    QA 条目的 sha1 必须与 tiers.json 里当前预览的 sha1 一致，否则是针对旧预览的结论，忽略。
+    """
+    listed = read_stems(Path(args.approved)) if args.approved else set()
+    qa_ok, qa_bad = set(), set()
+    if args.qa_report:
+        ok_status = {"pass", "warn"} if args.accept_warn else {"pass"}
+        report = load_json(Path(args.qa_report))
+        stale = 0
+        for name, entry in report.get("items", {}).items():
+            stem = Path(name).stem
+            preview = tiers.get(stem, {}).get("preview") or {}
+            if "sha1" not in preview and Path(preview.get("file", "")).is_file():
+                # 旧版 tiers.json 没记 sha1：按磁盘上的预览补上
+                preview["sha1"] = hashlib.sha1(Path(preview["file"]).read_bytes()).hexdigest()
+            if not entry.get("sha1") or entry.get("sha1") != preview.get("sha1"):
+                stale += 1
+                continue
+            (qa_ok if entry.get("status") in ok_status else qa_bad).add(stem)
+        if stale:
+            print(f"⚠️  Ignoring {stale} QA result(s) that do not match the current preview; rerun image_qa.py")
+    return listed | qa_ok, qa_bad - listed
+
+
+def run_tiered(client: "OpenAI", args, files: List[Path], out_dir: Path, tiers_path: Path, manifest: dict) -> None:
+    tiers: Dict[str, dict] = load_json(tiers_path).get("items", {}) if tiers_path.exists() else {}
+    preview_dir = out_dir / "preview"
+    jobs = []
+
+    if args.tier == "preview":
+        ensure_dir(preview_dir)
+        quality = args.preview_quality
+        for pf in files:
+            digest = prompt_digest(pf)
+            target = preview_dir / f"{pf.stem}.jpg"
+            entry = tiers.get(pf.stem)
+            if entry and entry.get("prompt_sha1") == digest and target.exists() and not args.overwrite:
+                manifest["items"].append({"key": pf.stem, "file": str(target), "prompt": str(pf), "status": "existing"})
+                continue
+            jobs.append((pf, target, digest))
+    else:
+        quality = args.quality
+        approved, rejected = read_approvals(args, tiers)
+        for stem in rejected:
+            if stem in tiers and tiers[stem].get("tier") == "preview":
+                tiers[stem]["tier"] = "rejected"
+        for pf in files:
+            if pf.stem not in approved:
+                continue
+            entry = tiers.get(pf.stem)
+            digest = prompt_digest(pf)
+            if not entry or entry.get("prompt_sha1") != digest:
+                print(f"⚠️  {pf.stem}: prompt changed since its preview (or never previewed); render a new preview first")
+                continue
+            target = out_dir / f"{pf.stem}.jpg"
+            if entry.get("tier") == "final" and target.exists() and not args.overwrite:
+                manifest["items"].append({"key": pf.stem, "file": str(target), "prompt": str(pf), "status": "existing"})
+                continue
+            jobs.append((pf, target, digest))
+        print(f"✅ {len(approved)} approved, {len(rejected)} rejected")
+
+    print(f"🎨 {args.tier}: {len(jobs)} image(s) at quality={quality}, concurrency {args.concurrency}")
+
+    def render(pf: Path) -> bytes:
+        return call_image(client, build_combined_prompt(load_json(pf)), size=args.size, quality=quality)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = {pool.submit(render, pf): (pf, target, digest) for pf, target, digest in jobs}
+            for fut in as_completed(futures):
+                pf, target, digest = futures[fut]
+                item = {"key": pf.stem, "file": str(target), "prompt": str(pf)}
+                try:
+                    img_bytes = fut.result()
+                except Exception as e:
+                    print(f"❌ {pf.name}: {e}")
+                    manifest["items"].append({**item, "status": "failed"})
+                    continue
+                with open(target, "wb") as f:
+                    f.write(img_bytes)
+                rendered = {
+                    "file": str(target),
+                    "quality": quality,
+                    "sha1": hashlib.sha1(img_bytes).hexdigest(),
+                    "rendered_at": datetime.now().isoformat(timespec="seconds"),
+                }
+                entry = tiers.setdefault(pf.stem, {"key": pf.stem})
+                entry["prompt"] = str(pf)
+                if args.tier == "preview":
+                    if entry.get("prompt_sha1") != digest:
+                        entry.pop("final", None)  # 旧终稿对应的是旧 prompt
+                    entry.update({"tier": "preview", "prompt_sha1": digest, "preview": rendered})
+                else:
+                    entry.update({"tier": "final", "final": rendered})
+                manifest["items"].append({**item, "status": "generated"})
+                print(f"✅ Saved: {target}")
+    finally:
+        # 中途 Ctrl-C 也把已经画好的记下来
+        counts: Dict[str, int] = {}
+        for entry in tiers.values():
+            counts[entry.get("tier", "?")] = counts.get(entry.get("tier", "?"), 0) + 1
+        tiers_path.write_text(
+            json.dumps({"updated_at": datetime.now().isoformat(timespec="seconds"), "counts": counts,
+                        "items": dict(sorted(tiers.items()))}, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+        print(f"🗂 Tier manifest written: {tiers_path} ({', '.join(f'{k}={v}' for k, v in sorted(counts.items()))})")
+
+    manifest["tier"] = args.tier
+    manifest["quality"] = quality
+    manifest["count"] = sum(1 for it in manifest["items"] if it["status"] in ("existing", "generated"))
 
 
 # -----------------------------------------
@@ -146,7 +383,29 @@ def main():
     parser.add_argument("--quality", default="high")
     parser.add_argument("--limit", type=int, default=None)
     parser.add_argument("--overwrite", action="store_true", help="Overwrite existing JPGs")
+    parser.add_argument("--shard", default=None, help="Only render items of shard i/N (stable hash of the file stem)")
+    parser.add_argument("--variants", type=int, default=1,
+                        help="Images per prompt, requested in one call and saved as _A, _B, ... (variant mode if > 1)")
+    parser.add_argument("--condition_dirs", nargs="+", default=None,
+                        help="One prompts directory per condition (variant mode); conditions are rendered concurrently")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel image requests (variant and tiered mode)")
+    parser.add_argument("--tier", choices=["preview", "final"], default=None,
+                        help="Tiered mode: preview renders everything cheaply into <out_dir>/preview, "
+                             "final re-renders only approved items at --quality")
+    parser.add_argument("--preview_quality", default="low")
+    parser.add_argument("--approved", default=None, help="[final] File listing approved keys, one per line")
+    parser.add_argument("--qa_report", default=None, help="[final] image_qa.py report on the previews; 'pass' items are approved")
+    parser.add_argument("--accept_warn", action="store_true", help="[final] Also approve image_qa 'warn' items")
+    parser.add_argument("--skip_list", default=None, help="File listing keys not to render (image_dedup.py --action skip)")
     args = parser.parse_args()
+    shard = parse_shard(args.shard)
+    if args.tier and (args.condition_dirs or args.variants > 1):
+        raise SystemExit("❌ --tier cannot be combined with variant mode")
+    if args.tier == "final" and not (args.approved or args.qa_report):
+        raise SystemExit("❌ --tier final needs --approved and/or --qa_report")
+
+    from dotenv import load_dotenv
+    from openai import OpenAI
 
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY")
@@ -158,29 +417,69 @@ def main():
     out_dir = Path(args.out_dir)
     ensure_dir(out_dir)
 
+    # variant mode 下 item 集合由第一个条件目录决定
+    condition_dirs: Optional[List[Path]] = [Path(d) for d in args.condition_dirs] if args.condition_dirs else None
+    if condition_dirs:
+        prompts_dir = condition_dirs[0]
+
     files = sorted(prompts_dir.glob("Persona_*_Activity_*.txt"))
+    files = [pf for pf in files if in_shard(pf.stem, shard)]
+    skipped: List[str] = []
+    if args.skip_list:
+        skip = read_stems(Path(args.skip_list))
+        skipped = [pf.stem for pf in files if pf.stem in skip]
+        files = [pf for pf in files if pf.stem not in skip]
+        print(f"⏭️  Skipping {len(skipped)} item(s) from {args.skip_list}")
     if args.limit:
         files = files[:args.limit]
-    if not files:
+    if not files and not skipped:
         raise SystemExit("❌ No prompt files found")
 
-    for pf in files:
-        out_path = out_dir / (pf.stem + ".jpg")
-
-        # ⭐ 跳过已经生成的文件（除非 --overwrite）
-        if out_path.exists() and not args.overwrite:
-            print(f"⏭️ Skip existing image: {out_path.name}")
-            continue
-
-        print(f"🎨 Generating for {pf.name} ...")
-        data = load_json(pf)
-        prompt = build_combined_prompt(data)
-        img_bytes = call_image(client, prompt, size=args.size, quality=args.quality)
-
-        with open(out_path, "wb") as f:
-            f.write(img_bytes)
-
-        print(f"✅ Saved: {out_path}")
+    manifest = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "size": args.size,
+        "quality": args.quality,
+        "shard": list(shard) if shard else None,
+        "count": 0,
+        "items": [],
+        "skipped": skipped,
+    }
+
+    manifest_dir = out_dir
+    if args.tier:
+        tiers_path = out_dir / manifest_name(shard).replace("manifest", "tiers", 1)
+        run_tiered(client, args, files, out_dir, tiers_path, manifest)
+        if args.tier == "preview":
+            manifest_dir = out_dir / "preview"
+    elif condition_dirs or args.variants > 1:
+        run_variants(client, args, [pf.stem for pf in files], condition_dirs or [prompts_dir], out_dir, manifest)
+    else:
+        for pf in files:
+            out_path = out_dir / (pf.stem + ".jpg")
+            item = {"key": pf.stem, "file": str(out_path), "prompt": str(pf)}
+
+            # ⭐ 跳过已经生成的文件（除非 --overwrite）
+            if out_path.exists() and not args.overwrite:
+                print(f"⏭️ Skip existing image: {out_path.name}")
+                manifest["items"].append({**item, "status": "existing"})
+                manifest["count"] += 1
+                continue
+
+            print(f"🎨 Generating for {pf.name} ...")
+            data = load_json(pf)
+            prompt = build_combined_prompt(data)
+            img_bytes = call_image(client, prompt, size=args.size, quality=args.quality)
+
+            with open(out_path, "wb") as f:
+                f.write(img_bytes)
+
+            print(f"✅ Saved: {out_path}")
+            manifest["items"].append({**item, "status": "generated"})
+            manifest["count"] += 1
+
+    manifest_path = manifest_dir / manifest_name(shard)
+    manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"🗂 Manifest written: {manifest_path}")
 
     print("\n🎉 All done.")
 
@@ -0,0 +1,108 @@
+# llm_hedging.py — Per-call deadlines + hedged requests for the blocking OpenAI SDK calls
+#
+# prompt_factory.py / narrator_generater.py 的 call_llm 都通过 HedgedCaller 调用：
+# - 每次调用有总 deadline，超时抛 TimeoutError（SDK 自己的 HTTP timeout 也设成同一个值，
+#   被放弃的那个请求最终也会结束，不会永远挂着线程）；client 要用 max_retries=0 创建，
+#   否则 SDK 会在超时后自己重试，被放弃的请求最多跑到 3 倍 deadline，而且每次都计费；
+#   调用方按 TimeoutError 把这一项记为失败继续跑，不要让它终止整批；
+# - 根据最近调用的耗时学习一个分位数（默认 p90）；主请求超过它还没回来，就再发一个
+#   完全相同的请求，谁先回来用谁；
+# - 每次运行的 hedge 次数有上限（--max_hedges），额外开销可控；
+# - 结束时 summary() 打印调用数、hedge 次数 / 胜出次数、超时数和 p50/p99。
+
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Optional
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        s = sorted(self.samples)
+        return s[min(len(s) - 1, int(q * (len(s) - 1)))]
+
+
+class HedgedCaller:
+    def __init__(
+        self,
+        deadline: float = 120.0,
+        hedge_quantile: float = 0.9,
+        max_hedges: int = 0,
+        min_samples: int = 8,
+        min_hedge_delay: float = 2.0,
+    ):
+        self.deadline = deadline
+        self.hedge_quantile = hedge_quantile
+        self.max_hedges = max_hedges
+        self.min_samples = min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.latency = LatencyTracker()
+        self.all_latency = LatencyTracker(window=10000)
+        self.stats = {"calls": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0, "errors": 0}
+        # 被放弃的请求还会在后台跑到 SDK timeout 为止，所以线程数要留余量
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm")
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.stats["hedges"] >= self.max_hedges or len(self.latency.samples) < self.min_samples:
+            return None
+        q = self.latency.quantile(self.hedge_quantile)
+        return max(q, self.min_hedge_delay)
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """fn 会收到 timeout=<剩余 deadline> 关键字参数，用来设置 SDK 的请求超时。"""
+        self.stats["calls"] += 1
+        start = time.monotonic()
+        end = start + self.deadline
+        primary: Future = self._pool.submit(fn, *args, timeout=self.deadline, **kwargs)
+        futures = {primary}
+
+        delay = self.hedge_delay()
+        if delay is not None and delay < self.deadline:
+            done, _ = wait(futures, timeout=delay)
+            if not done:
+                self.stats["hedges"] += 1
+                futures.add(self._pool.submit(fn, *args, timeout=max(1.0, end - time.monotonic()), **kwargs))
+
+        last_error: Optional[BaseException] = None
+        while futures:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            done, futures = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is not None:
+                    last_error = f.exception()
+                    continue
+                elapsed = time.monotonic() - start
+                self.latency.add(elapsed)
+                self.all_latency.add(elapsed)
+                if f is not primary:
+                    self.stats["hedge_wins"] += 1
+                return f.result()
+
+        if last_error is not None and not futures:
+            self.stats["errors"] += 1
+            raise last_error
+        self.stats["timeouts"] += 1
+        raise TimeoutError(f"LLM call exceeded deadline of {self.deadline:.0f}s")
+
+    def summary(self) -> str:
+        p50 = self.all_latency.quantile(0.5)
+        p99 = self.all_latency.quantile(0.99)
+        lat = f"p50={p50:.2f}s p99={p99:.2f}s" if p50 is not None else "no successful calls"
+        s = self.stats
+        return (
+            f"LLM calls: {s['calls']} ({lat}); hedges {s['hedges']}/{self.max_hedges} "
+            f"(won {s['hedge_wins']}); timeouts {s['timeouts']}; errors {s['errors']}"
+        )
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,14 +1,21 @@
+import argparse
 import os
 import base64
 from io import BytesIO
-from dotenv import load_dotenv
-from openai import OpenAI
-from PIL import Image
 
-load_dotenv()
+_client = None
 
-#Open AI API Key
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+def get_client():
+    """OpenAI client 在第一次调用模型时才创建（import 本文件不加载 SDK、不读 .env）。"""
+    global _client
+    if _client is None:
+        from dotenv import load_dotenv
+        from openai import OpenAI
+
+        load_dotenv()
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
 
 # === 你的 Prompt 模板 ===
 PROMPT_TEMPLATE = """You are a senior prompt engineer for image generation.
@@ -31,7 +38,7 @@ user_constraints = "Style: cinematic, volumetric lighting, golden hour; Composit
 def generate_image_prompt(brief, constraints):
     """生成英文出图Prompt"""
     filled = PROMPT_TEMPLATE.format(brief=brief, constraints=constraints)
-    response = client.responses.create(
+    response = get_client().responses.create(
         model="gpt-4o-mini",
         input=filled,
         temperature=0.7,
@@ -41,7 +48,9 @@ def generate_image_prompt(brief, constraints):
 
 def generate_image(prompt, out_path="result.jpg"):
     """使用 GPT-Image-1 生成图像"""
-    result = client.images.generate(
+    from PIL import Image
+
+    result = get_client().images.generate(
         model="gpt-image-1",
         prompt=prompt,
         size="1024x1536",
@@ -57,13 +66,20 @@ def generate_image(prompt, out_path="result.jpg"):
     print(f"✅ Image saved to: {out_path}")
 
 def main():
+    # 先解析参数：--help 在创建 client / 调模型之前就退出
+    parser = argparse.ArgumentParser(description="One-off prompt + image demo (calls the OpenAI API).")
+    parser.add_argument("--brief", default=user_brief)
+    parser.add_argument("--constraints", default=user_constraints)
+    parser.add_argument("--out", default="output.jpg")
+    args = parser.parse_args()
+
     print("🧠 Generating prompt...")
-    final_prompt = generate_image_prompt(user_brief, user_constraints)
+    final_prompt = generate_image_prompt(args.brief, args.constraints)
     print("\n=== Final Prompt ===\n")
     print(final_prompt)
 
     print("\n🎨 Generating image...")
-    generate_image(final_prompt, "output.jpg")
+    generate_image(final_prompt, args.out)
 
 if __name__ == "__main__":
     main()
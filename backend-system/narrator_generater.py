@@ -23,10 +23,20 @@ import os
 import json
 import argparse
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Dict, Optional
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from llm_hedging import HedgedCaller
+from output_schemas import (
+    ParseStats,
+    chat_response_format,
+    extract_json_text,
+    is_unsupported_format_error,
+    responses_format,
+)
+
+# openai / dotenv 只在 main 里导入，import 本模块不付 SDK 的启动开销
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
 # -----------------------------
@@ -99,11 +109,17 @@ def extract_text(resp) -> str:
     )
 
 
-def call_llm(client: OpenAI, model: str, sys_prompt: Optional[str], user_prompt: str, temperature: float) -> str:
+def call_llm(client: "OpenAI", model: str, sys_prompt: Optional[str], user_prompt: str, temperature: float,
+             timeout: Optional[float] = None, schema_name: Optional[str] = None) -> str:
     """
     优先使用 Responses API，失败则回退到 Chat Completions。
-    返回纯文本。
+    返回纯文本。timeout 为单次 HTTP 请求超时（秒），由 HedgedCaller 按剩余 deadline 传入；
+    schema_name 不为空时两种 API 都用 structured output（json_schema）约束输出。
     """
+    if timeout is not None:
+        client = client.with_options(timeout=timeout)
+    resp_extra = {"text": responses_format(schema_name)} if schema_name else {}
+    chat_extra = {"response_format": chat_response_format(schema_name)} if schema_name else {}
     # Try Responses API
     try:
         if sys_prompt:
@@ -114,12 +130,14 @@ def call_llm(client: OpenAI, model: str, sys_prompt: Optional[str], user_prompt:
                     {"role": "user", "content": user_prompt},
                 ],
                 temperature=temperature,
+                **resp_extra,
             )
         else:
             resp = client.responses.create(
                 model=model,
                 input=user_prompt,
                 temperature=temperature,
+                **resp_extra,
             )
         try:
             return extract_text(resp)
@@ -137,36 +155,49 @@ def call_llm(client: OpenAI, model: str, sys_prompt: Optional[str], user_prompt:
         model=model,
         messages=messages,
         temperature=temperature,
+        **chat_extra,
     )
     return extract_text(resp)
 
 
-def parse_json_from_model_output(text: str) -> Dict[str, Any]:
+def normalize_narrator_keys(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """回退（无 structured output）路径下，兼容模型把 key 写成小写 / 下划线的情况。"""
+    user_name = obj.get("User Name") or obj.get("user_name") or obj.get("name") or ""
+    activity_desc = (
+        obj.get("Activity Description")
+        or obj.get("activity_description")
+        or obj.get("Activity")
+        or ""
+    )
+    return {"User Name": user_name, "Activity Description": activity_desc}
+
+
+def generate_narrator_json(hedger: HedgedCaller, stats: ParseStats, client: "OpenAI", model: str,
+                           sys_prompt: Optional[str], user_prompt: str, temperature: float) -> Optional[Dict[str, Any]]:
     """
-    模型必须输出 JSON，但为了防御：
-    - 去掉 ```json ... ``` 或 ``` 包裹
-    - 再做 json.loads
+    用 narrator schema 生成 JSON。structured output 不可用时（只探测一次）回退为
+    普通调用 + 本地 schema 校验；返回 None 表示解析 / 校验失败（已计入 stats）。
     """
-    s = text.strip()
-
-    # 去掉代码块
-    if s.startswith("```"):
-        # 可能是 ```json ... ```
-        lines = s.splitlines()
-        if len(lines) >= 2 and lines[0].startswith("```"):
-            # 找到最后一个 ``` 的行号
-            end_idx = None
-            for i in range(len(lines) - 1, -1, -1):
-                if lines[i].strip().startswith("```"):
-                    end_idx = i
-                    break
-            if end_idx is not None and end_idx > 0:
-                s = "\n".join(lines[1:end_idx]).strip()
-
+    structured = stats.structured_supported
     try:
-        return json.loads(s)
+        raw_output = hedger.call(
+            call_llm,
+            client=client,
+            model=model,
+            sys_prompt=sys_prompt,
+            user_prompt=user_prompt,
+            temperature=temperature,
+            schema_name="narrator_summary" if structured else None,
+        )
     except Exception as e:
-        raise RuntimeError(f"Failed to parse model output as JSON.\nOutput was:\n{s}\nError: {e}")
+        if structured and is_unsupported_format_error(e):
+            print(f"⚠️  Structured output not supported, falling back to local validation: {e}")
+            stats.structured_supported = False
+            return generate_narrator_json(hedger, stats, client, model, sys_prompt, user_prompt, temperature)
+        raise
+    stats.counts["structured" if structured else "unstructured"] += 1
+    text = raw_output if structured else extract_json_text(raw_output)
+    return stats.parse(text, "narrator_summary", prepare=None if structured else normalize_narrator_keys)
 
 
 # -----------------------------
@@ -236,14 +267,23 @@ def main():
     parser.add_argument("--limit", type=int, default=None, help="Optional limit on number of files to process")
     parser.add_argument("--overwrite", action="store_true", help="Overwrite existing output files")
     parser.add_argument("--system", default=None, help="Custom system prompt string or @path/to/file")
+    parser.add_argument("--deadline", type=float, default=120.0, help="Per-call deadline in seconds")
+    parser.add_argument("--max_hedges", type=int, default=0,
+                        help="Max duplicate requests per run for calls slower than --hedge_quantile (0 = off)")
+    parser.add_argument("--hedge_quantile", type=float, default=0.9)
     args = parser.parse_args()
 
     # --- API client ---
+    from dotenv import load_dotenv
+    from openai import OpenAI
+
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise SystemExit("❌ Missing OPENAI_API_KEY in .env or environment")
-    client = OpenAI(api_key=api_key)
+    # SDK 自带的重试关掉：deadline / hedge 由 HedgedCaller 管，被放弃的请求不能再在后台重试计费
+    client = OpenAI(api_key=api_key, max_retries=0)
+    parse_stats = ParseStats()
 
     # --- System prompt ---
     base_system_prompt = (
@@ -270,68 +310,66 @@ def main():
         raise SystemExit(f"❌ No prompt files found under {prompts_dir}/Persona_*_Activity_*.txt")
 
     processed = 0
-    for pf in files:
-        try:
-            base_stem = pf.stem  # e.g. Persona_1_Activity_35
-            out_path = out_dir / f"{base_stem}_Description.txt"  # 与旧命名保持一致
-
-            # 关键逻辑：默认不覆盖，只补缺失文件
-            if out_path.exists() and not args.overwrite:
-                print(f"⏭️  Skip (exists): {out_path.name}")
-                continue
-
-            print(f"📝 Processing {pf.name}")
-            data = load_json(pf)
-
-            user_prompt = build_user_prompt_for_narrator(data)
-
-            # 调用一次 LLM，返回文本，再 parse 为 JSON
+    failed = []
+    hedger = HedgedCaller(deadline=args.deadline, hedge_quantile=args.hedge_quantile, max_hedges=args.max_hedges)
+    try:
+        for pf in files:
             try:
-                raw_output = call_llm(
-                    client=client,
-                    model=args.model,
-                    sys_prompt=sys_prompt,
-                    user_prompt=user_prompt,
-                    temperature=args.temperature,
-                )
-            except Exception as e:
-                print(f"⚠️  LLM call failed for {pf.name}: {e}")
-                continue
+                base_stem = pf.stem  # e.g. Persona_1_Activity_35
+                out_path = out_dir / f"{base_stem}_Description.txt"  # 与旧命名保持一致
+
+                # 关键逻辑：默认不覆盖，只补缺失文件
+                if out_path.exists() and not args.overwrite:
+                    print(f"⏭️  Skip (exists): {out_path.name}")
+                    continue
+
+                print(f"📝 Processing {pf.name}")
+                data = load_json(pf)
+
+                user_prompt = build_user_prompt_for_narrator(data)
+
+                # 调用一次 LLM（structured output），解析并按 schema 校验
+                try:
+                    partial_obj = generate_narrator_json(
+                        hedger,
+                        parse_stats,
+                        client,
+                        args.model,
+                        sys_prompt,
+                        user_prompt,
+                        args.temperature,
+                    )
+                except Exception as e:
+                    print(f"⚠️  LLM call failed for {pf.name}: {e}")
+                    failed.append(pf.name)
+                    continue
+                if partial_obj is None:
+                    failed.append(pf.name)
+                    continue
+
+                user_name = partial_obj["User Name"]
+                activity_desc = partial_obj["Activity Description"]
+
+                narrator_obj = {
+                    "User Name": user_name,
+                    "Activity Description": activity_desc,
+                    "Smart Assistant Interaction": "PlaceHolderA",
+                }
+
+                json_text = json.dumps(narrator_obj, ensure_ascii=False, indent=2)
+                write_text(out_path, json_text)
+                print(f"✅ Saved: {out_path.name}")
+                processed += 1
 
-            try:
-                partial_obj = parse_json_from_model_output(raw_output)
             except Exception as e:
-                print(f"⚠️  Failed to parse JSON for {pf.name}: {e}")
-                continue
-
-            # 取出名称与活动描述，稍微防御一下 key 大小写或下划线
-            user_name = (
-                partial_obj.get("User Name")
-                or partial_obj.get("user_name")
-                or partial_obj.get("name")
-                or ""
-            )
-            activity_desc = (
-                partial_obj.get("Activity Description")
-                or partial_obj.get("activity_description")
-                or partial_obj.get("Activity")
-                or ""
-            )
-
-            narrator_obj = {
-                "User Name": user_name,
-                "Activity Description": activity_desc,
-                "Smart Assistant Interaction": "PlaceHolderA",
-            }
-
-            json_text = json.dumps(narrator_obj, ensure_ascii=False, indent=2)
-            write_text(out_path, json_text)
-            print(f"✅ Saved: {out_path.name}")
-            processed += 1
-
-        except Exception as e:
-            print(f"❌ Error: {pf.name}: {e}")
-
+                print(f"❌ Error: {pf.name}: {e}")
+
+        print(f"⏱  {hedger.summary()}")
+        print(f"🧾 {parse_stats.summary()}")
+        if failed:
+            print(f"⚠️  {len(failed)} file(s) need a rerun: {', '.join(failed)}")
+    finally:
+        hedger.shutdown()
     print(f"\n🎉 Done. Generated {processed} file(s) into: {out_dir}")
 
 
@@ -0,0 +1,232 @@
+# output_schemas.py — JSON schemas for the model outputs + a small local validator
+#
+# prompt_factory.py（Section 4 / Section 5）和 narrator_generater.py 都要求模型只输出 JSON。
+# 这里集中定义它们的 schema：
+# - 调用时作为 structured output（json_schema）交给 API，由 API 约束解码；
+# - API / 模型不支持 structured output 时回退到普通调用，再用 validate() 在本地校验；
+# - ParseStats 统计解析 / 校验失败次数，不再静默降级成 {"raw": ...}。
+#
+# validate() 只实现这里用到的 JSON Schema 子集：
+# type / properties / required / additionalProperties / items / enum / minItems。
+
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+# 字段与 templates/Section4_PersonaStyle.txt 的 OUTPUT SCHEMA 一一对应（strict 要求全部 required）。
+# image_runner 只读 summary，其余字段留在 prompt 文件里供人工检查。
+SECTION4_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "section": {"type": "string"},
+        "summary": {"type": "string"},
+        "visual_motifs": {"type": "array", "items": {"type": "string"}},
+        "attire_and_props": {"type": "array", "items": {"type": "string"}},
+        "color_and_mood": {"type": "string"},
+        "style_references": {"type": "array", "items": {"type": "string"}},
+        "behaviors_and_posture": {"type": "array", "items": {"type": "string"}},
+        "negative_cues": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": [
+        "section",
+        "summary",
+        "visual_motifs",
+        "attire_and_props",
+        "color_and_mood",
+        "style_references",
+        "behaviors_and_posture",
+        "negative_cues",
+    ],
+    "additionalProperties": False,
+}
+
+# 字段与 templates/Section5_ActivityOfPanel.txt 的 OUTPUT SCHEMA 一一对应（strict 要求全部 required）。
+# scene_note 只是规划备注，build_combined_prompt 不会把它画出来。
+PANEL_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "panel": {"type": "integer"},
+        "action": {"type": "string"},
+        "composition": {"type": "string"},
+        "camera": {"type": "string"},
+        "key_objects": {"type": "array", "items": {"type": "string"}},
+        "scene_note": {"type": "string"},
+        "narration": {"type": "string"},
+        "assistant_presence": {"type": "string", "enum": ["must_show"]},
+        "assistant_action": {"type": "string"},
+        "assistant_position": {"type": "string"},
+        "assistant_scale": {"type": "string"},
+        "assistant_interaction": {"type": "string"},
+        "assistant_visibility_rule": {"type": "string"},
+    },
+    "required": [
+        "panel",
+        "action",
+        "composition",
+        "camera",
+        "key_objects",
+        "scene_note",
+        "narration",
+        "assistant_presence",
+        "assistant_action",
+        "assistant_position",
+        "assistant_scale",
+        "assistant_interaction",
+        "assistant_visibility_rule",
+    ],
+    "additionalProperties": False,
+}
+
+GLOBAL_CONTEXT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "setting": {"type": "string"},
+        "time_of_day": {"type": "string"},
+        "atmosphere": {"type": "string"},
+        "lighting_cue": {"type": "string"},
+    },
+    "required": ["setting", "time_of_day", "atmosphere", "lighting_cue"],
+    "additionalProperties": False,
+}
+
+# Section 5：build_combined_prompt 读 panels / negative_cues；panel 数量由 validate_section5 再检查
+SECTION5_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "section": {"type": "string"},
+        "global_context": GLOBAL_CONTEXT_SCHEMA,
+        "panels": {"type": "array", "items": PANEL_SCHEMA},
+        "negative_cues": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["section", "global_context", "panels", "negative_cues"],
+    "additionalProperties": False,
+}
+
+NARRATOR_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "User Name": {"type": "string"},
+        "Activity Description": {"type": "string"},
+    },
+    "required": ["User Name", "Activity Description"],
+    "additionalProperties": False,
+}
+
+# name -> (schema, strict)
+SCHEMAS = {
+    "section4_persona_style": (SECTION4_SCHEMA, True),
+    "section5_activity_of_panel": (SECTION5_SCHEMA, True),
+    "narrator_summary": (NARRATOR_SCHEMA, True),
+}
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+# -----------------------------------------
+# API request helpers
+# -----------------------------------------
+def responses_format(name: str) -> Dict[str, Any]:
+    """Responses API 的 text= 参数。"""
+    schema, strict = SCHEMAS[name]
+    return {"format": {"type": "json_schema", "name": name, "schema": schema, "strict": strict}}
+
+
+def chat_response_format(name: str) -> Dict[str, Any]:
+    """Chat Completions 的 response_format= 参数。"""
+    schema, strict = SCHEMAS[name]
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": strict}}
+
+
+def is_unsupported_format_error(e: Exception) -> bool:
+    """API 拒绝 json_schema（旧模型 / 不支持的参数）时返回 True，调用方改走本地校验。"""
+    msg = str(e).lower()
+    return getattr(e, "status_code", None) == 400 and any(
+        k in msg for k in ("json_schema", "response_format", "text.format", "structured")
+    )
+
+
+# -----------------------------------------
+# Local validation
+# -----------------------------------------
+def validate(obj: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    errors: List[str] = []
+    t = schema.get("type")
+    if t:
+        expected = _TYPES[t]
+        # bool 是 int 的子类，单独排除
+        if not isinstance(obj, expected) or (t in ("integer", "number") and isinstance(obj, bool)):
+            return [f"{path}: expected {t}, got {type(obj).__name__}"]
+    if "enum" in schema and obj not in schema["enum"]:
+        errors.append(f"{path}: {obj!r} not in {schema['enum']}")
+    if isinstance(obj, dict):
+        props = schema.get("properties", {})
+        for k in schema.get("required", []):
+            if k not in obj:
+                errors.append(f"{path}: missing required key {k!r}")
+        if schema.get("additionalProperties") is False:
+            for k in obj:
+                if k not in props:
+                    errors.append(f"{path}: unexpected key {k!r}")
+        for k, sub in props.items():
+            if k in obj:
+                errors.extend(validate(obj[k], sub, f"{path}.{k}"))
+    if isinstance(obj, list):
+        if len(obj) < schema.get("minItems", 0):
+            errors.append(f"{path}: expected at least {schema['minItems']} item(s)")
+        if "items" in schema:
+            for i, item in enumerate(obj):
+                errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+class ParseStats:
+    def __init__(self):
+        self.counts = {"structured": 0, "unstructured": 0, "parse_failures": 0, "schema_failures": 0}
+        self.structured_supported = True
+
+    def parse(self, text: str, name: str, prepare: Optional[Callable[[Any], Any]] = None) -> Optional[Dict[str, Any]]:
+        """json.loads +（可选的 prepare 清理）+ schema 校验；失败时计数、打印原因并返回 None。"""
+        try:
+            obj = json.loads(text)
+        except ValueError as e:
+            self.counts["parse_failures"] += 1
+            print(f"⚠️  [{name}] output is not valid JSON: {e}")
+            return None
+        if prepare is not None and isinstance(obj, dict):
+            obj = prepare(obj)
+        errors = validate(obj, SCHEMAS[name][0])
+        if errors:
+            self.counts["schema_failures"] += 1
+            print(f"⚠️  [{name}] output violates schema: {'; '.join(errors[:5])}")
+            return None
+        return obj
+
+    def summary(self) -> str:
+        c = self.counts
+        return (
+            f"Structured output: {c['structured']} constrained / {c['unstructured']} unconstrained call(s); "
+            f"{c['parse_failures']} parse failure(s), {c['schema_failures']} schema failure(s)"
+        )
+
+
+def extract_json_text(text: str) -> str:
+    """
+    只用于没有 structured output 的回退路径：去掉 ``` 代码块包裹，
+    再截取最外层 {...}，交给 ParseStats.parse 做严格解析和校验。
+    """
+    s = text.strip()
+    if s.startswith("```"):
+        lines = s.splitlines()
+        end = next((i for i in range(len(lines) - 1, 0, -1) if lines[i].strip().startswith("```")), None)
+        s = "\n".join(lines[1:end]).strip() if end else "\n".join(lines[1:]).strip()
+    start, stop = s.find("{"), s.rfind("}")
+    if start != -1 and stop > start:
+        s = s[start : stop + 1]
+    return s
@@ -0,0 +1,204 @@
+# panel_splitter.py — Split 2×2 comic grids into per-panel tiles
+#
+# Usage:
+#   python panel_splitter.py --images_dir images --out_dir tiles
+#   python panel_splitter.py --images_dir ../frontend-viewer/src/assets/PhaseData --out_dir tiles --quality 82
+#
+# build_combined_prompt 要求的是「等大 2×2 + 细 gutter」，所以：
+# - 整图转灰度后只算一次行 / 列的均值和标准差（向量化 intensity profile）；
+# - 在中间区域找「亮且均匀」的那一段列 / 行作为竖 / 横 gutter（score = mean - k·std 取峰值，
+#   再向两边扩展到所有 std 低、均值接近峰值的列 / 行）；
+# - 从四边往里剥掉同样均匀的外边框；
+# - 检测不可靠（gutter 不够突出）时退回几何等分，并在 manifest 里标记 fallback；
+# - 每个 panel 存成优化过的 JPEG：Persona_X_Activity_Y_p1.jpg … _p4.jpg（顺序同 grid_order：左上、右上、左下、右下）；
+# - manifest.json 以 Persona_X_Activity_Y 为 key，记录每个 panel 的 bbox [x, y, w, h]。
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+PANEL_SUFFIXES = ("p1", "p2", "p3", "p4")
+GUTTER_MAX_STD = 12.0  # gutter / 外边框的一行（列）灰度标准差上限；画面内容一般 30 以上
+GUTTER_TOL = 30.0  # gutter 内部比边缘最亮的那条线暗多少以内仍算 gutter
+
+
+# -----------------------------------------
+# Gutter detection
+# -----------------------------------------
+def line_stats(gray: np.ndarray, axis: int) -> Tuple[np.ndarray, np.ndarray]:
+    """axis=0 → 每一列的 (均值, 标准差)；axis=1 → 每一行的。"""
+    return gray.mean(axis=axis), gray.std(axis=axis)
+
+
+def line_scores(mean: np.ndarray, std: np.ndarray, k: float = 2.0) -> np.ndarray:
+    """亮且均匀的线分数高。"""
+    return mean - k * std
+
+
+def find_gutter(
+    mean: np.ndarray,
+    std: np.ndarray,
+    lo: float = 0.35,
+    hi: float = 0.65,
+    max_std: float = GUTTER_MAX_STD,
+    tol: float = GUTTER_TOL,
+) -> Tuple[int, int, float]:
+    """
+    在 [lo, hi] 区间里找分数最高的位置，再向两边扩展成一段连续 gutter。
+    返回 (start, end_exclusive, prominence)；prominence = gutter 分数 - 中区分数中位数。
+
+    分数最高的往往是 gutter 边缘那条最亮的线（≈250），gutter 内部只有 ≈235，所以扩展不和峰值比，
+    只要求「均匀」（std ≤ max_std）且「够亮」（均值不低于峰值 tol 以上）。
+    """
+    scores = line_scores(mean, std)
+    n = len(scores)
+    a, b = int(n * lo), int(n * hi)
+    band = scores[a:b]
+    best = a + int(np.argmax(band))
+    floor = mean[best] - tol
+
+    def in_gutter(i: int) -> bool:
+        return std[i] <= max_std and mean[i] >= floor
+
+    start, end = best, best + 1
+    while start > a and in_gutter(start - 1):
+        start -= 1
+    while end < b and in_gutter(end):
+        end += 1
+    return start, end, float(scores[start:end].mean() - np.median(band))
+
+
+def trim_border(
+    mean: np.ndarray, std: np.ndarray, floor: float, max_std: float = GUTTER_MAX_STD, max_frac: float = 0.08
+) -> Tuple[int, int]:
+    """从两端剥掉和 gutter 一样均匀、够亮的外边框（最多 max_frac）。"""
+    n = len(mean)
+    limit = int(n * max_frac)
+    border = (std <= max_std) & (mean >= floor)
+    lead = int(np.argmin(border[:limit])) if not border[:limit].all() else limit
+    tail = int(np.argmin(border[::-1][:limit])) if not border[::-1][:limit].all() else limit
+    return lead, n - tail
+
+
+def detect_panels(gray: np.ndarray, min_prominence: float) -> Tuple[Dict[str, list], bool]:
+    h, w = gray.shape
+    col_mean, col_std = line_stats(gray, axis=0)
+    row_mean, row_std = line_stats(gray, axis=1)
+    x0, x1, px = find_gutter(col_mean, col_std)
+    y0, y1, py = find_gutter(row_mean, row_std)
+
+    fallback = px < min_prominence or py < min_prominence
+    if fallback:
+        x0 = x1 = w // 2
+        y0 = y1 = h // 2
+        left, right, top, bottom = 0, w, 0, h
+    else:
+        left, right = trim_border(col_mean, col_std, float(col_mean[x0:x1].mean()) - GUTTER_TOL)
+        top, bottom = trim_border(row_mean, row_std, float(row_mean[y0:y1].mean()) - GUTTER_TOL)
+
+    boxes = {
+        "p1": [left, top, x0 - left, y0 - top],
+        "p2": [x1, top, right - x1, y0 - top],
+        "p3": [left, y1, x0 - left, bottom - y1],
+        "p4": [x1, y1, right - x1, bottom - y1],
+    }
+    return boxes, fallback
+
+
+# -----------------------------------------
+# Per-image job (runs in worker processes)
+# -----------------------------------------
+def split_one(job: Tuple[str, str, int, float]) -> Tuple[str, Optional[dict], Optional[str]]:
+    src, out_dir, quality, min_prominence = job
+    src_path = Path(src)
+    try:
+        with Image.open(src_path) as im:
+            im = im.convert("RGB")
+            gray = np.asarray(im.convert("L"), dtype=np.float32)
+            boxes, fallback = detect_panels(gray, min_prominence)
+            tiles = {}
+            for name, (x, y, bw, bh) in boxes.items():
+                tile_name = f"{src_path.stem}_{name}.jpg"
+                im.crop((x, y, x + bw, y + bh)).save(
+                    Path(out_dir) / tile_name, "JPEG", quality=quality, optimize=True, progressive=True
+                )
+                tiles[name] = {"file": tile_name, "bbox": [x, y, bw, bh]}
+        st = src_path.stat()
+        entry = {
+            "source": src_path.name,
+            "source_size": st.st_size,
+            "source_mtime_ns": st.st_mtime_ns,
+            "width": int(gray.shape[1]),
+            "height": int(gray.shape[0]),
+            "fallback": fallback,
+            "panels": tiles,
+        }
+        return src_path.stem, entry, None
+    except Exception as e:
+        return src_path.stem, None, str(e)
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Split 2x2 comic grids into per-panel tiles + bbox manifest.")
+    parser.add_argument("--images_dir", default="images")
+    parser.add_argument("--out_dir", default="tiles")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG quality of the tiles")
+    parser.add_argument("--min_prominence", type=float, default=8.0,
+                        help="Below this gutter score the image is split geometrically (fallback)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true", help="Re-split images already in the manifest")
+    args = parser.parse_args()
+
+    images_dir = Path(args.images_dir)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / "manifest.json"
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {}
+
+    files = sorted(images_dir.glob("Persona_*_Activity_*.jpg"))
+    if args.limit:
+        files = files[: args.limit]
+    if not files:
+        raise SystemExit(f"❌ No images found under {images_dir}")
+
+    jobs = []
+    for f in files:
+        old = manifest.get(f.stem)
+        st = f.stat()
+        if (
+            old
+            and not args.overwrite
+            and old.get("source_size") == st.st_size
+            and old.get("source_mtime_ns") == st.st_mtime_ns
+            and all((out_dir / p["file"]).exists() for p in old["panels"].values())
+        ):
+            continue
+        jobs.append((str(f), str(out_dir), args.quality, args.min_prominence))
+
+    print(f"✂️  Splitting {len(jobs)} image(s) ({len(files) - len(jobs)} up to date)")
+    n_fallback = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        for key, entry, err in ex.map(split_one, jobs, chunksize=4):
+            if err:
+                print(f"❌ {key}: {err}")
+                continue
+            manifest[key] = entry
+            if entry["fallback"]:
+                n_fallback += 1
+                print(f"⚠️  {key}: gutters not found, split geometrically")
+
+    manifest_path.write_text(json.dumps(dict(sorted(manifest.items())), ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"🗂 Manifest written: {manifest_path} ({len(manifest)} image(s), {n_fallback} fallback)")
+
+
+if __name__ == "__main__":
+    main()
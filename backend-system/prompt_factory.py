@@ -3,10 +3,15 @@ import json
 import argparse
 from pathlib import Path
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from llm_hedging import HedgedCaller
+from output_schemas import ParseStats, extract_json_text, is_unsupported_format_error, responses_format
+from sharding import context_ids, in_shard, item_key, manifest_name, parse_shard
+
+# openai / dotenv 只在真正调用模型时导入（main 里），import 本模块不付 SDK 的启动开销
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 # -----------------------------
 # Utility functions
@@ -20,11 +25,6 @@ def read_text(path: Path) -> str:
 def write_text(path: Path, text: str) -> None:
     path.write_text(text, encoding="utf-8")
 
-def slug(s: Any) -> str:
-    import re
-    s = re.sub(r"[^\w\-]+", "_", str(s).strip())
-    return s.strip("_") or "untitled"
-
 def coalesce(d: Dict[str, Any], *keys, default=None):
     for k in keys:
         if k in d and d[k] not in (None, ""):
@@ -52,7 +52,12 @@ def extract_text(resp) -> str:
         pass
     raise RuntimeError("Unable to extract text from response; SDK return structure may have changed.")
 
-def call_llm(client: OpenAI, model: str, sys_prompt: Optional[str], user_prompt: str, temperature: float) -> str:
+def call_llm(client: "OpenAI", model: str, sys_prompt: Optional[str], user_prompt: str, temperature: float,
+             timeout: Optional[float] = None, schema_name: Optional[str] = None) -> str:
+    if timeout is not None:
+        client = client.with_options(timeout=timeout)
+    # schema_name 不为空时用 structured output，让 API 按 schema 约束解码
+    extra = {"text": responses_format(schema_name)} if schema_name else {}
     if sys_prompt:
         resp = client.responses.create(
             model=model,
@@ -61,38 +66,48 @@ def call_llm(client: OpenAI, model: str, sys_prompt: Optional[str], user_prompt:
                 {"role": "user", "content": user_prompt},
             ],
             temperature=temperature,
+            **extra,
         )
     else:
         resp = client.responses.create(
             model=model,
             input=user_prompt,
             temperature=temperature,
+            **extra,
         )
     return extract_text(resp)
 
+def generate_json(hedger: HedgedCaller, stats: ParseStats, schema_name: str, client: "OpenAI", model: str,
+                  sys_prompt: Optional[str], user_prompt: str, temperature: float,
+                  prepare=None) -> Optional[Dict]:
+    """
+    按 schema 生成并解析一个 JSON 对象。
+    API 不支持 structured output 时（只会探测一次）回退为普通调用 + 本地 schema 校验。
+    返回 None 表示解析 / 校验失败（已计入 stats）。
+    """
+    structured = stats.structured_supported
+    try:
+        out = hedger.call(
+            call_llm, client, model, sys_prompt, user_prompt,
+            temperature=temperature, schema_name=schema_name if structured else None,
+        )
+    except Exception as e:
+        if structured and is_unsupported_format_error(e):
+            print(f"⚠️  Structured output not supported, falling back to local validation: {e}")
+            stats.structured_supported = False
+            return generate_json(
+                hedger, stats, schema_name, client, model, sys_prompt, user_prompt, temperature, prepare
+            )
+        raise
+    stats.counts["structured" if structured else "unstructured"] += 1
+    return stats.parse(out if structured else extract_json_text(out), schema_name, prepare)
+
 def find_template_file(templates_dir: Path, keyword: str) -> Optional[Path]:
     for f in templates_dir.glob("*.txt"):
         if keyword.lower() in f.name.lower():
             return f
     return None
 
-def safe_json_loads(text: str) -> Optional[Any]:
-    text = text.strip()
-    # 直接尝试整体解析
-    try:
-        return json.loads(text)
-    except Exception:
-        pass
-    # 尝试截取最外层 {...}
-    try:
-        start = text.find("{")
-        end = text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            return json.loads(text[start : end + 1])
-    except Exception:
-        pass
-    return None
-
 # -----------------------------
 # Validators & repair helpers
 # （现在不再关心 caption，只关注结构完整性和 assistant 规则）
@@ -201,15 +216,30 @@ def main():
     parser.add_argument(
         "--system", default=None, help="Optional system prompt string or @path/to/file"
     )
+    parser.add_argument(
+        "--shard", default=None, help="Only generate items of shard i/N (stable hash of Persona_X_Activity_Y)"
+    )
+    parser.add_argument("--deadline", type=float, default=120.0, help="Per-call deadline in seconds")
+    parser.add_argument(
+        "--max_hedges", type=int, default=0,
+        help="Max duplicate requests per run for calls slower than --hedge_quantile (0 = off)",
+    )
+    parser.add_argument("--hedge_quantile", type=float, default=0.9)
     args = parser.parse_args()
+    shard = parse_shard(args.shard)
 
     # API Key
+    from dotenv import load_dotenv
+    from openai import OpenAI
+
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise SystemExit("❌ Missing OPENAI_API_KEY in .env or environment")
 
-    client = OpenAI(api_key=api_key)
+    # SDK 自带的重试关掉：deadline / hedge 由 HedgedCaller 管，被放弃的请求不能再在后台重试计费
+    client = OpenAI(api_key=api_key, max_retries=0)
+    parse_stats = ParseStats()
 
     # Templates
     templates_dir = Path(args.templates_dir)
@@ -279,140 +309,159 @@ def main():
         "created_at": datetime.now().isoformat(timespec="seconds"),
         "model": args.model,
         "temperature": args.temperature,
+        "shard": list(shard) if shard else None,
         "count": 0,
         "items": [],
+        "failed": [],
     }
 
-    for it in items:
-        pid_val = coalesce(
-            it,
-            "persona_id",
-            "personaId",
-            "personaID",
-            "persona_index",
-            "id",
-        )
-        cid_val = coalesce(
-            it, "context_id", "contextId", "contextID", "cid"
-        )
-        if pid_val is None or cid_val is None:
-            print(
-                f"⏭️  Skip non-persona item (missing persona_id/context_id): {it.get('id', '<no-id>')}"
-            )
-            continue
-
-        pid = slug(pid_val)
-        cid = slug(cid_val)
-
-        # persona_desc normalize
-        pdesc = it.get("persona_desc")
-        if isinstance(pdesc, str):
-            persona_desc_obj = {"raw": pdesc}
-        elif isinstance(pdesc, dict):
-            persona_desc_obj = pdesc
-        else:
-            pdesc = coalesce(it, "persona", "personaDescription", "persona_profile")
+    hedger = HedgedCaller(
+        deadline=args.deadline, hedge_quantile=args.hedge_quantile, max_hedges=args.max_hedges
+    )
+    try:
+        for it in items:
+            ids = context_ids(it)
+            if ids is None:
+                print(
+                    f"⏭️  Skip non-persona item (missing persona_id/context_id): {it.get('id', '<no-id>')}"
+                )
+                continue
+
+            pid, cid = ids
+            key = item_key(pid, cid)
+            if not in_shard(key, shard):
+                continue
+
+            # persona_desc normalize
+            pdesc = it.get("persona_desc")
             if isinstance(pdesc, str):
                 persona_desc_obj = {"raw": pdesc}
             elif isinstance(pdesc, dict):
                 persona_desc_obj = pdesc
             else:
-                raise SystemExit(f"❌ persona_desc must be string or object: {it}")
-        persona_desc_json = json.dumps(
-            persona_desc_obj, ensure_ascii=False, indent=2
-        )
+                pdesc = coalesce(it, "persona", "personaDescription", "persona_profile")
+                if isinstance(pdesc, str):
+                    persona_desc_obj = {"raw": pdesc}
+                elif isinstance(pdesc, dict):
+                    persona_desc_obj = pdesc
+                else:
+                    raise SystemExit(f"❌ persona_desc must be string or object: {it}")
+            persona_desc_json = json.dumps(
+                persona_desc_obj, ensure_ascii=False, indent=2
+            )
 
-        # context_scenario normalize
-        csc = it.get("context_scenario")
-        if not isinstance(csc, dict):
-            csc = {
-                "activity": coalesce(it, "activity", "task", default=""),
-                "expanded_activity": coalesce(
-                    it, "expanded_activity", "steps", default=""
-                ),
-                "time": coalesce(
-                    it,
-                    "time",
-                    "start_timestamp",
-                    "end_timestamp",
-                    default="",
-                ),
+            # context_scenario normalize
+            csc = it.get("context_scenario")
+            if not isinstance(csc, dict):
+                csc = {
+                    "activity": coalesce(it, "activity", "task", default=""),
+                    "expanded_activity": coalesce(
+                        it, "expanded_activity", "steps", default=""
+                    ),
+                    "time": coalesce(
+                        it,
+                        "time",
+                        "start_timestamp",
+                        "end_timestamp",
+                        default="",
+                    ),
+                }
+            activity_json = json.dumps(csc, ensure_ascii=False, indent=2)
+
+            # ---------- Generate Section 4 ----------
+            sec4_user_prompt = sec4_template.replace(
+                "{persona_desc}", persona_desc_json
+            )
+            try:
+                sec4_json = generate_json(
+                    hedger,
+                    parse_stats,
+                    "section4_persona_style",
+                    client,
+                    args.model,
+                    sys_prompt,
+                    sec4_user_prompt,
+                    temperature=min(args.temperature, 0.75),
+                )
+            except TimeoutError as e:
+                # 单个慢调用不拖垮整批：记到 manifest 里，下次只需补这些
+                print(f"⚠️  Section 4 timed out for {key}: {e}")
+                manifest["failed"].append({"key": key, "section": 4, "reason": "timeout"})
+                continue
+            except Exception as e:
+                raise SystemExit(
+                    f"❌ LLM call failed for Section 4 ({pid}/{cid}): {e}"
+                )
+            if sec4_json is None:
+                # 不再写 {"raw": ...} 的残缺 prompt，记到 manifest 里，下次只需补这些
+                manifest["failed"].append({"key": key, "section": 4})
+                continue
+
+            # ---------- Generate Section 5 (optionally conditioned on Section 4) ----------
+            # 你当前的 Section 5 模板如果不包含 {persona_style} 占位符，
+            # 这行 replace 也不会产生副作用，只是多给一点上下文。
+            sec5_user_prompt = (
+                sec5_template.replace("{activity}", activity_json).replace(
+                    "{persona_style}",
+                    json.dumps(sec4_json, ensure_ascii=False, indent=2),
+                )
+            )
+            try:
+                sec5_json = generate_json(
+                    hedger,
+                    parse_stats,
+                    "section5_activity_of_panel",
+                    client,
+                    args.model,
+                    sys_prompt,
+                    sec5_user_prompt,
+                    temperature=min(args.temperature, 0.65),
+                    # 安全清除 caption 字段，避免画 panel 底字幕（回退路径下模型仍可能生成）
+                    prepare=strip_panel_captions,
+                )
+            except TimeoutError as e:
+                # 单个慢调用不拖垮整批：记到 manifest 里，下次只需补这些
+                print(f"⚠️  Section 5 timed out for {key}: {e}")
+                manifest["failed"].append({"key": key, "section": 5, "reason": "timeout"})
+                continue
+            except Exception as e:
+                raise SystemExit(
+                    f"❌ LLM call failed for Section 5 ({pid}/{cid}): {e}"
+                )
+            if sec5_json is None:
+                manifest["failed"].append({"key": key, "section": 5})
+                continue
+
+            # Combine
+            full_prompt = {
+                "section_1_drawing_style": section1_json,
+                "section_2_panel_design_style": section2_json,
+                "section_3_smart_assistant_style": section3_json,
+                "section_4_persona_style": sec4_json,
+                "section_5_activity_of_the_panel": sec5_json,
             }
-        activity_json = json.dumps(csc, ensure_ascii=False, indent=2)
 
-        # ---------- Generate Section 4 ----------
-        sec4_user_prompt = sec4_template.replace(
-            "{persona_desc}", persona_desc_json
-        )
-        try:
-            sec4_out = call_llm(
-                client,
-                args.model,
-                sys_prompt,
-                sec4_user_prompt,
-                temperature=min(args.temperature, 0.75),
-            ).strip()
-        except Exception as e:
-            raise SystemExit(
-                f"❌ LLM call failed for Section 4 ({pid}/{cid}): {e}"
+            out_file = outdir / f"{key}.txt"
+            write_text(
+                out_file, json.dumps(full_prompt, ensure_ascii=False, indent=2)
             )
+            print(f"✅ Saved: {out_file}")
 
-        sec4_json = safe_json_loads(sec4_out) or {"raw": sec4_out}
-
-        # ---------- Generate Section 5 (optionally conditioned on Section 4) ----------
-        # 你当前的 Section 5 模板如果不包含 {persona_style} 占位符，
-        # 这行 replace 也不会产生副作用，只是多给一点上下文。
-        sec5_user_prompt = (
-            sec5_template.replace("{activity}", activity_json).replace(
-                "{persona_style}",
-                json.dumps(sec4_json, ensure_ascii=False, indent=2),
-            )
-        )
-        try:
-            sec5_out = call_llm(
-                client,
-                args.model,
-                sys_prompt,
-                sec5_user_prompt,
-                temperature=min(args.temperature, 0.65),
-            ).strip()
-        except Exception as e:
-            raise SystemExit(
-                f"❌ LLM call failed for Section 5 ({pid}/{cid}): {e}"
+            manifest["items"].append(
+                {"key": key, "file": str(out_file), "persona_id": pid, "context_id": cid}
             )
+            manifest["count"] += 1
 
-        sec5_json = safe_json_loads(sec5_out)
-        if isinstance(sec5_json, dict):
-            # 安全清除 caption 字段，避免画 panel 底字幕
-            sec5_json = strip_panel_captions(sec5_json)
-        else:
-            sec5_json = {"raw": sec5_out}
-
-        # Combine
-        full_prompt = {
-            "section_1_drawing_style": section1_json,
-            "section_2_panel_design_style": section2_json,
-            "section_3_smart_assistant_style": section3_json,
-            "section_4_persona_style": sec4_json,
-            "section_5_activity_of_the_panel": sec5_json,
-        }
-
-        out_file = outdir / f"Persona_{pid}_Activity_{cid}.txt"
+        manifest_path = outdir / manifest_name(shard)
         write_text(
-            out_file, json.dumps(full_prompt, ensure_ascii=False, indent=2)
-        )
-        print(f"✅ Saved: {out_file}")
-
-        manifest["items"].append(
-            {"file": str(out_file), "persona_id": pid, "context_id": cid}
+            manifest_path,
+            json.dumps(manifest, ensure_ascii=False, indent=2),
         )
-        manifest["count"] += 1
-
-    write_text(
-        outdir / "manifest.json",
-        json.dumps(manifest, ensure_ascii=False, indent=2),
-    )
-    print(f"🗂 Manifest written: {outdir/'manifest.json'}")
+        print(f"🗂 Manifest written: {manifest_path}")
+        print(f"⏱  {hedger.summary()}")
+        print(f"🧾 {parse_stats.summary()}")
+    finally:
+        hedger.shutdown()
 
 
 if __name__ == "__main__":
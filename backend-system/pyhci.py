@@ -0,0 +1,210 @@
+# pyhci.py — Single entry point for the backend-system scripts
+#
+# Usage (from backend-system/):
+#   python pyhci.py                                   # 列出所有子命令
+#   python pyhci.py prompts --contexts data/combined_contexts_100.json --shard 0/4
+#   python pyhci.py pending --contexts data/combined_contexts_100.json
+#   python pyhci.py validate
+#   python pyhci.py bench-startup --repeat 5
+#
+# 启动快的关键是「用到才 import」：
+# - 本文件顶层只 import 标准库；子命令对应的模块在分发时才 import；
+# - 各脚本自己也只在 main() 里 import openai / dotenv / PIL，所以 --help、pending、validate、
+#   sample 这类不调模型的操作不付 SDK 的导入开销；
+# - bench-startup 在子进程里测每个子命令的冷启动时间（python pyhci.py <cmd> --help）。
+
+import argparse
+import importlib
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+# 子命令 -> (模块, 说明)；模块的 main() 自己解析剩余参数
+SCRIPTS: Dict[str, Tuple[str, str]] = {
+    "prompts": ("prompt_factory", "Generate Section 1-5 prompts from contexts (LLM)"),
+    "narrate": ("narrator_generater", "Generate Narrator/*_Description.txt from prompts (LLM)"),
+    "images": ("image_runner", "Render 2x2 comics from prompts (image model)"),
+    "demo": ("main", "One-off prompt + image demo"),
+    "sample": ("sample_collection", "Sample one persona's contexts into data/contexts.json"),
+    "combine": ("generate_combined_contexts", "Pair random personas with scenarios"),
+    "dedup-contexts": ("context_dedup", "MinHash/LSH near-duplicate check for contexts (run before prompts)"),
+    "dedup": ("image_dedup", "Perceptual-hash near-duplicate check for images"),
+    "qa": ("image_qa", "Visual QA gate for rendered comics (orbs, grid, blank panels); requeue failures"),
+    "split": ("panel_splitter", "Split 2x2 comics into panel tiles"),
+    "merge-shards": ("sharding", "Merge per-shard manifests and report gaps"),
+    "bridge": ("bridge_server", "WebSocket bridge between the viewer and a model client"),
+}
+
+BUILTINS: Dict[str, str] = {
+    "pending": "List items still missing a prompt, narrator file or image",
+    "validate": "Check prompt / narrator files against the output schemas",
+    "bench-startup": "Measure cold-start time of every subcommand",
+}
+
+
+# -----------------------------------------
+# pending
+# -----------------------------------------
+def cmd_pending(argv: List[str]) -> None:
+    from sharding import expected_from_contexts, expected_from_dir, in_shard, parse_shard
+
+    parser = argparse.ArgumentParser(prog="pyhci.py pending", description=BUILTINS["pending"])
+    parser.add_argument("--contexts", default=None, help="Contexts JSON; without it the prompts dir defines the full set")
+    parser.add_argument("--prompts_dir", default="prompts")
+    parser.add_argument("--narrator_dir", default="Narrator")
+    parser.add_argument("--images_dir", default="images")
+    parser.add_argument("--shard", default=None, help="Only report items of shard i/N")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args(argv)
+    shard = parse_shard(args.shard)
+
+    def keys(path: Path) -> Set[str]:
+        return {k for k in expected_from_dir(path) if in_shard(k, shard)} if path.exists() else set()
+
+    prompts = keys(Path(args.prompts_dir))
+    narrated = keys(Path(args.narrator_dir))
+    rendered = keys(Path(args.images_dir))
+    if args.contexts:
+        expected = {k for k in expected_from_contexts(Path(args.contexts)) if in_shard(k, shard)}
+    else:
+        expected = prompts
+
+    pending = {
+        "prompts": sorted(expected - prompts),
+        "narrator": sorted(prompts - narrated),
+        "images": sorted(prompts - rendered),
+    }
+    if args.json:
+        print(json.dumps({"expected": len(expected), **pending}, ensure_ascii=False, indent=2))
+        return
+    print(f"📊 {len(expected)} expected item(s)")
+    for stage, missing in pending.items():
+        print(f"{'✅' if not missing else '⏳'} {stage}: {len(missing)} pending")
+        for k in missing:
+            print(f"   - {k}")
+
+
+# -----------------------------------------
+# validate
+# -----------------------------------------
+def cmd_validate(argv: List[str]) -> None:
+    from output_schemas import NARRATOR_SCHEMA, SECTION4_SCHEMA, SECTION5_SCHEMA, validate
+    from prompt_factory import validate_section5
+
+    parser = argparse.ArgumentParser(prog="pyhci.py validate", description=BUILTINS["validate"])
+    parser.add_argument("--prompts_dir", default="prompts")
+    parser.add_argument("--narrator_dir", default="Narrator")
+    args = parser.parse_args(argv)
+
+    def check_prompt(obj) -> List[str]:
+        errors = validate(obj.get("section_4_persona_style"), SECTION4_SCHEMA, "section_4")
+        s5 = obj.get("section_5_activity_of_the_panel")
+        errors += validate(s5, SECTION5_SCHEMA, "section_5")
+        if not errors:
+            ok, why = validate_section5(s5)
+            if not ok:
+                errors.append(f"section_5: {why}")
+        return errors
+
+    def check_narrator(obj) -> List[str]:
+        # Smart Assistant Interaction 是脚本补的占位字段，不属于模型输出
+        obj = {k: v for k, v in obj.items() if k != "Smart Assistant Interaction"}
+        return validate(obj, NARRATOR_SCHEMA)
+
+    jobs = [
+        (Path(args.prompts_dir), "Persona_*_Activity_*.txt", check_prompt),
+        (Path(args.narrator_dir), "Persona_*_Activity_*_Description.txt", check_narrator),
+    ]
+    n_files = n_bad = 0
+    for folder, pattern, check in jobs:
+        for f in sorted(folder.glob(pattern)):
+            if check is check_prompt and f.stem.endswith("_Description"):
+                continue
+            n_files += 1
+            try:
+                obj = json.loads(f.read_text(encoding="utf-8"))
+                errors = check(obj) if isinstance(obj, dict) else ["top level is not an object"]
+            except ValueError as e:
+                errors = [f"invalid JSON: {e}"]
+            if errors:
+                n_bad += 1
+                print(f"❌ {f}: {'; '.join(errors[:3])}")
+    print(f"🧾 {n_files - n_bad}/{n_files} file(s) valid")
+    if n_bad:
+        raise SystemExit(1)
+
+
+# -----------------------------------------
+# bench-startup
+# -----------------------------------------
+def time_command(cmd: List[str], repeat: int) -> float:
+    """子进程冷启动的中位数耗时（毫秒）。"""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=Path(__file__).parent)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(samples)
+
+
+def cmd_bench_startup(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog="pyhci.py bench-startup", description=BUILTINS["bench-startup"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--commands", nargs="*", default=None, help="Subset of subcommands (default: all)")
+    args = parser.parse_args(argv)
+
+    me = str(Path(__file__).resolve())
+    rows = [("python -c pass", time_command([sys.executable, "-c", "pass"], args.repeat))]
+    # 参照：以前每个脚本 import 时都要付的 SDK 开销
+    for mod in ("openai", "dotenv", "PIL.Image"):
+        if subprocess.run([sys.executable, "-c", f"import {mod}"], capture_output=True).returncode == 0:
+            rows.append((f"import {mod}", time_command([sys.executable, "-c", f"import {mod}"], args.repeat)))
+        else:
+            print(f"ℹ️  {mod} is not installed; skipping its reference timing")
+    for name in args.commands or [*BUILTINS, *SCRIPTS]:
+        if name == "bench-startup":
+            continue
+        rows.append((f"pyhci {name} --help", time_command([sys.executable, me, name, "--help"], args.repeat)))
+
+    width = max(len(r[0]) for r in rows)
+    print(f"⏱  Cold start, median of {args.repeat} run(s):")
+    for label, ms in rows:
+        print(f"   {label:<{width}}  {ms:8.1f} ms")
+
+
+# -----------------------------------------
+# Main
+# -----------------------------------------
+def usage() -> str:
+    lines = ["usage: python pyhci.py <command> [args...]", "", "commands:"]
+    width = max(len(k) for k in [*SCRIPTS, *BUILTINS])
+    for name, (_, help_text) in SCRIPTS.items():
+        lines.append(f"  {name:<{width}}  {help_text}")
+    for name, help_text in BUILTINS.items():
+        lines.append(f"  {name:<{width}}  {help_text}")
+    return "\n".join(lines)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print(usage())
+        return
+    name, rest = sys.argv[1], sys.argv[2:]
+    builtins = {"pending": cmd_pending, "validate": cmd_validate, "bench-startup": cmd_bench_startup}
+    if name in builtins:
+        builtins[name](rest)
+        return
+    if name not in SCRIPTS:
+        raise SystemExit(f"❌ Unknown command: {name}\n\n{usage()}")
+    module = importlib.import_module(SCRIPTS[name][0])
+    # 子模块的 argparse 读 sys.argv；prog 显示成 "pyhci.py <command>"
+    sys.argv = [f"pyhci.py {name}", *rest]
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
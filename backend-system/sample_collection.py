@@ -1,31 +1,46 @@
+import argparse
 import json
 import random
 from pathlib import Path
 
-# === 参数 ===
+# === 参数（默认值，可用命令行覆盖）===
 SOURCE_PATH = Path("data/persona_reflections.json")
 OUTPUT_PATH = Path("data/contexts.json")
 PERSONA_ID = 1           # 固定 persona_id
 SAMPLE_SIZE = 48         # 随机选取的 context 数量
 
-# === 读取主数据集 ===
-with open(SOURCE_PATH, "r", encoding="utf-8") as f:
-    data = json.load(f)
 
-# === 筛选指定 persona_id 的所有条目 ===
-persona_data = [item for item in data if item.get("persona_id") == PERSONA_ID]
+def main():
+    parser = argparse.ArgumentParser(description="Randomly sample one persona's contexts into data/contexts.json.")
+    parser.add_argument("--source", default=str(SOURCE_PATH))
+    parser.add_argument("--out", default=str(OUTPUT_PATH))
+    parser.add_argument("--persona_id", type=int, default=PERSONA_ID)
+    parser.add_argument("--sample_size", type=int, default=SAMPLE_SIZE)
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a reproducible sample")
+    args = parser.parse_args()
 
-if not persona_data:
-    raise ValueError(f"No entries found for persona_id={PERSONA_ID}")
+    # === 读取主数据集 ===
+    with open(args.source, "r", encoding="utf-8") as f:
+        data = json.load(f)
 
-# === 如果总数不足 48，就全部保留 ===
-if len(persona_data) <= SAMPLE_SIZE:
-    sampled_data = persona_data
-else:
-    sampled_data = random.sample(persona_data, SAMPLE_SIZE)
+    # === 筛选指定 persona_id 的所有条目 ===
+    persona_data = [item for item in data if item.get("persona_id") == args.persona_id]
 
-# === 输出结果到 data/contexts.json ===
-with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-    json.dump(sampled_data, f, ensure_ascii=False, indent=2)
+    if not persona_data:
+        raise ValueError(f"No entries found for persona_id={args.persona_id}")
 
-print(f"✅ 已生成 {len(sampled_data)} 条样本到 {OUTPUT_PATH}")
+    # === 如果总数不足 sample_size，就全部保留 ===
+    if len(persona_data) <= args.sample_size:
+        sampled_data = persona_data
+    else:
+        sampled_data = random.Random(args.seed).sample(persona_data, args.sample_size)
+
+    # === 输出结果到 data/contexts.json ===
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(sampled_data, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ 已生成 {len(sampled_data)} 条样本到 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
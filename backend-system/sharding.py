@@ -0,0 +1,218 @@
+# sharding.py — Deterministic --shard i/N partitioning + merge of per-shard manifests
+#
+# prompt_factory.py / image_runner.py 都用 Persona_X_Activity_Y 作为 item key：
+#   shard(key) = int(sha1(key)) % N
+# 与文件顺序、机器、Python 的 hash 随机化都无关，所以多台机器各跑一个 --shard i/N，
+# 切出来的子集互不相交且合起来正好是全集。
+#
+# Merge:
+#   python sharding.py --manifests prompts/manifest.shard-*-of-4.json --out prompts/manifest.json \
+#       --expected_contexts data/combined_contexts_100.json
+#   python sharding.py --manifests images/manifest.shard-*-of-4.json --out images/manifest.json \
+#       --expected_dir prompts
+
+import argparse
+import glob
+import hashlib
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+KEY_RE = re.compile(r"^(Persona_[^_]+_Activity_[^_.]+)")
+
+
+# -----------------------------------------
+# Keys & shards
+# -----------------------------------------
+def slug(s: Any) -> str:
+    s = re.sub(r"[^\w\-]+", "_", str(s).strip())
+    return s.strip("_") or "untitled"
+
+
+def coalesce(d: Dict[str, Any], *keys, default=None):
+    for k in keys:
+        if k in d and d[k] not in (None, ""):
+            return d[k]
+    return default
+
+
+def context_ids(it: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """从 contexts JSON 的一条记录里取 (persona_id, context_id)，兼容各种字段名；缺失返回 None。"""
+    pid_val = coalesce(it, "persona_id", "personaId", "personaID", "persona_index", "id")
+    cid_val = coalesce(it, "context_id", "contextId", "contextID", "cid")
+    if pid_val is None or cid_val is None:
+        return None
+    return slug(pid_val), slug(cid_val)
+
+
+def item_key(pid: str, cid: str) -> str:
+    return f"Persona_{pid}_Activity_{cid}"
+
+
+def parse_shard(text: Optional[str]) -> Optional[Tuple[int, int]]:
+    """'2/8' -> (2, 8)；index 从 0 开始。None 表示不分片。"""
+    if not text:
+        return None
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text)
+    if not m:
+        raise SystemExit(f"❌ --shard must look like i/N, got: {text}")
+    i, n = int(m.group(1)), int(m.group(2))
+    if n < 1 or not 0 <= i < n:
+        raise SystemExit(f"❌ --shard index must satisfy 0 <= i < N, got: {text}")
+    return i, n
+
+
+def shard_of(key: str, n: int) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big") % n
+
+
+def in_shard(key: str, shard: Optional[Tuple[int, int]]) -> bool:
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+
+def manifest_name(shard: Optional[Tuple[int, int]]) -> str:
+    """分片时每个 shard 写自己的 manifest，避免共享目录里互相覆盖。"""
+    if shard is None:
+        return "manifest.json"
+    return f"manifest.shard-{shard[0]}-of-{shard[1]}.json"
+
+
+# -----------------------------------------
+# Merge
+# -----------------------------------------
+def expected_from_contexts(path: Path) -> Set[str]:
+    items = json.loads(path.read_text(encoding="utf-8"))
+    keys = set()
+    for it in items:
+        ids = context_ids(it) if isinstance(it, dict) else None
+        if ids:
+            keys.add(item_key(*ids))
+    return keys
+
+
+def expected_from_dir(path: Path) -> Set[str]:
+    keys = set()
+    for f in path.glob("Persona_*_Activity_*"):
+        m = KEY_RE.match(f.name)
+        if m:
+            keys.add(m.group(1))
+    return keys
+
+
+# image_runner 的 item 带 status，只有这两种算产出了文件；prompt_factory 的 item 都是成功的
+# （没有 status），失败的记在 manifest 顶层的 "failed" 里
+DONE_STATUS = ("existing", "generated")
+
+
+def manifest_key(it: Dict[str, Any]) -> str:
+    return it.get("key") or KEY_RE.match(Path(it["file"]).name).group(1)
+
+
+def is_done(it: Dict[str, Any]) -> bool:
+    return it.get("status", "generated") in DONE_STATUS
+
+
+def merge(paths: Iterable[Path]) -> Tuple[Dict[str, Any], Dict[str, List[str]], Set[Tuple[int, int]]]:
+    merged: Dict[str, Dict[str, Any]] = {}
+    seen_in: Dict[str, List[str]] = {}
+    shards: Set[Tuple[int, int]] = set()
+    base: Dict[str, Any] = {}
+    failed: Dict[str, Dict[str, Any]] = {}
+    skipped: Set[str] = set()
+    for p in paths:
+        m = json.loads(p.read_text(encoding="utf-8"))
+        if m.get("shard"):
+            shards.add(tuple(m["shard"]))
+        for k in ("model", "temperature", "size", "quality"):
+            if k in m:
+                base.setdefault(k, m[k])
+        for it in m.get("items", []):
+            key = manifest_key(it)
+            seen_in.setdefault(key, []).append(p.name)
+            merged[key] = it
+        for it in m.get("failed", []):
+            failed.setdefault(it["key"], it)
+        skipped.update(m.get("skipped", []))
+    duplicates = {k: v for k, v in seen_in.items() if len(v) > 1}
+    for key, it in merged.items():
+        if not is_done(it):
+            failed.setdefault(key, {"key": key, "status": it.get("status")})
+    out = {
+        **base,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "merged_from": sorted(str(p) for p in paths),
+        "count": sum(1 for it in merged.values() if is_done(it)),
+        "items": [merged[k] for k in sorted(merged)],
+        # 别的 shard 里已经成功的不算失败（比如重跑过）
+        "failed": [failed[k] for k in sorted(failed) if not (k in merged and is_done(merged[k]))],
+        # image_runner --skip_list 有意不渲染的，不算缺失
+        "skipped": sorted(skipped - set(merged)),
+    }
+    return out, duplicates, shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge per-shard manifests and report missing / duplicated items.")
+    parser.add_argument("--manifests", nargs="+", required=True, help="Manifest files or glob patterns")
+    parser.add_argument("--out", required=True, help="Merged manifest path")
+    parser.add_argument("--expected_contexts", default=None, help="Contexts JSON the prompts were generated from")
+    parser.add_argument("--expected_dir", default=None, help="Directory whose Persona_*_Activity_* files define the full set")
+    args = parser.parse_args()
+
+    paths = sorted({Path(p) for pat in args.manifests for p in (glob.glob(pat) or [pat])})
+    missing_files = [p for p in paths if not p.exists()]
+    if missing_files:
+        raise SystemExit(f"❌ Manifest not found: {', '.join(map(str, missing_files))}")
+
+    out, duplicates, shards = merge(paths)
+    Path(args.out).write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"🗂 Merged {len(paths)} manifest(s) → {args.out} "
+          f"({out['count']} item(s), {len(out['failed'])} failed, {len(out['skipped'])} skipped)")
+
+    ok = True
+    totals = {n for _, n in shards}
+    if len(totals) > 1:
+        ok = False
+        print(f"⚠️  Manifests use different shard counts: {sorted(totals)}")
+    for n in totals:
+        absent = sorted(set(range(n)) - {i for i, m in shards if m == n})
+        if absent:
+            ok = False
+            print(f"⚠️  Missing shard(s) of {n}: {absent}")
+    for key, where in sorted(duplicates.items()):
+        ok = False
+        print(f"⚠️  Duplicate {key} in: {', '.join(where)}")
+    for it in out["failed"]:
+        ok = False
+        detail = it.get("status") or f"section {it.get('section')}"
+        if it.get("reason"):
+            detail += f", {it['reason']}"
+        print(f"❌ Failed {it['key']} ({detail})")
+
+    expected: Set[str] = set()
+    if args.expected_contexts:
+        expected |= expected_from_contexts(Path(args.expected_contexts))
+    if args.expected_dir:
+        expected |= expected_from_dir(Path(args.expected_dir))
+    if expected:
+        have = {manifest_key(it) for it in out["items"] if is_done(it)}
+        failed = {it["key"] for it in out["failed"]}
+        # 失败的上面已经列过了，这里只列根本没跑到的
+        missing = sorted(expected - have - failed - set(out["skipped"]))
+        extra = sorted(have - expected)
+        for key in missing:
+            print(f"⚠️  Missing {key} (shard {shard_of(key, max(totals)) if totals else '-'})")
+        for key in extra:
+            print(f"ℹ️  Not in expected set: {key}")
+        ok = ok and not missing
+        print(f"📊 {len(have & expected)}/{len(expected)} expected item(s) present")
+
+    if not ok:
+        raise SystemExit(1)
+    print("✅ Shards are complete and disjoint")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 脚本都在 backend-system/ 根目录下，按脚本同目录的方式 import
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
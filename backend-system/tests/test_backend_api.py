@@ -0,0 +1,252 @@
+import importlib.util
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("asyncpg")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+BACKEND = Path(__file__).resolve().parents[1] / "backend"
+
+USER = {
+    "age_range": "25-34",
+    "gender": "female",
+    "education_level": "bachelor",
+    "occupation": "designer",
+    "smart_assistant_exp": "daily",
+    "tech_comfort": 5,
+}
+
+
+def load_backend(monkeypatch, tmp_path, storage="sqlite", **env):
+    """加载 backend/main.py（模块名避开 backend-system/main.py），默认用 SQLite 后端。"""
+    monkeypatch.setenv("STORAGE_BACKEND", storage)
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "hci.sqlite3"))
+    monkeypatch.setenv("WRITE_BEHIND_JOURNAL", str(tmp_path / "journal.ndjson"))
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    monkeypatch.syspath_prepend(str(BACKEND))
+    spec = importlib.util.spec_from_file_location("backend_main", BACKEND / "main.py")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+@pytest.fixture
+def write_behind(monkeypatch, tmp_path):
+    mod = load_backend(monkeypatch, tmp_path, SELECTION_WRITE_BEHIND="1")
+    with TestClient(mod.app) as client:
+        yield mod, client
+
+
+def test_write_behind_rejects_unknown_user_before_ack(write_behind):
+    _, client = write_behind
+    r = client.put("/api/selections", json={"user_id": 999, "image_id": "Persona_4_Activity_103", "selection": "A"})
+    assert r.status_code == 404
+
+    uid = client.post("/api/users", json=USER).json()["id"]
+    r = client.put("/api/selections", json={"user_id": uid, "image_id": "Persona_4_Activity_103", "selection": "B"})
+    assert r.status_code == 200
+    rows = client.get(f"/api/users/{uid}/selections").json()
+    assert [(s["image_id"], s["selection"]) for s in rows] == [("Persona_4_Activity_103", "B")]
+
+    stats = client.get("/api/selections/write-behind").json()
+    assert stats["rejected"] == 0 and stats["recent_rejections"] == []
+
+
+def test_write_behind_journal_keeps_entries_submitted_during_compaction(write_behind, tmp_path):
+    mod, client = write_behind
+    uid = client.post("/api/users", json=USER).json()["id"]
+    buf = mod.app.state.selection_buffer
+    write_snapshot = buf._write_journal_snapshot
+
+    def slow_snapshot(tmp, items):
+        # 模拟 fsync 期间又来了一条选择
+        buf.submit(uid, "Persona_4_Activity_114", "A")
+        write_snapshot(tmp, items)
+
+    buf._write_journal_snapshot = slow_snapshot
+    client.put("/api/selections", json={"user_id": uid, "image_id": "Persona_4_Activity_103", "selection": "A"})
+    client.get(f"/api/users/{uid}/selections")  # read-your-writes 会先 flush
+    buf._write_journal_snapshot = write_snapshot
+
+    assert list(buf.pending) == [(uid, "Persona_4_Activity_114")]
+    journal = [json.loads(line) for line in (tmp_path / "journal.ndjson").read_text().splitlines()]
+    assert journal == [{"user_id": uid, "image_id": "Persona_4_Activity_114", "selection": "A"}]
+
+
+@pytest.fixture
+def stimuli(monkeypatch, tmp_path):
+    root = tmp_path / "stimuli"
+    root.mkdir()
+    name = "Persona_4_Activity_103_Description.txt"
+    (root / name).write_text("plain text " * 50, encoding="utf-8")
+    (root / f"{name}.br").write_bytes(b"br-bytes")
+    (root / f"{name}.gz").write_bytes(b"gz-bytes")
+    mod = load_backend(monkeypatch, tmp_path, STIMULI_DIR=str(root))
+    with TestClient(mod.app) as client:
+        yield mod, client, f"/api/stimuli/files/{name}"
+
+
+def test_pick_encoding_honours_q_values(stimuli):
+    mod, _, _ = stimuli
+    both = ["br", "gzip"]
+    assert mod.pick_encoding("gzip, deflate, br", both) == "br"
+    assert mod.pick_encoding("br;q=0, gzip", both) == "gzip"
+    assert mod.pick_encoding("br;q=0.5, gzip;q=0.8", both) == "gzip"
+    assert mod.pick_encoding("gzip;q=0", both) is None
+    assert mod.pick_encoding("*;q=0", both) is None
+    assert mod.pick_encoding("*", both) == "br"
+    assert mod.pick_encoding("xbrotli, mygzip", both) is None  # 不是子串匹配
+    assert mod.pick_encoding(None, both) is None
+
+
+def fetch(client, url, **headers):
+    # 只看状态和头；预压缩文件是假数据，不让 httpx 去解压
+    with client.stream("GET", url, headers=headers) as r:
+        return r.status_code, r.headers
+
+
+def test_stimulus_encodings_have_distinct_etags(stimuli):
+    _, client, url = stimuli
+    _, identity = fetch(client, url, **{"Accept-Encoding": "identity"})
+    _, br = fetch(client, url, **{"Accept-Encoding": "br"})
+    _, gz = fetch(client, url, **{"Accept-Encoding": "br;q=0, gzip"})
+    assert "content-encoding" not in identity
+    assert br["content-encoding"] == "br"
+    assert gz["content-encoding"] == "gzip"
+    assert len({identity["etag"], br["etag"], gz["etag"]}) == 3
+
+    # identity 的 ETag 不能让 br 请求拿到 304
+    status, headers = fetch(client, url, **{"Accept-Encoding": "br", "If-None-Match": identity["etag"]})
+    assert status == 200 and headers["content-encoding"] == "br"
+    status, _ = fetch(client, url, **{"Accept-Encoding": "br", "If-None-Match": br["etag"]})
+    assert status == 304
+
+
+# 两个后端跑同一组行为测试；postgres 要求 DATABASE_URL 指向一个可写的测试库。
+# 库里可能已有数据，所以下面的断言只看本测试新建的用户和计数增量。
+@pytest.fixture(params=["sqlite", "postgres"])
+def api(request, monkeypatch, tmp_path):
+    if request.param == "postgres" and not os.getenv("DATABASE_URL"):
+        pytest.skip("DATABASE_URL not set")
+    mod = load_backend(monkeypatch, tmp_path, storage=request.param)
+    with TestClient(mod.app) as client:
+        yield mod, client
+
+
+def export(client, **params):
+    r = client.get("/api/export/selections", params=params)
+    assert r.status_code == 200
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+def counts(client):
+    r = client.get("/api/aggregates/selections")
+    assert r.status_code == 200
+    return {c["image_id"]: (c["count_a"], c["count_b"], c["total"]) for c in r.json()}
+
+
+def test_users_round_trip(api):
+    _, client = api
+    created = client.post("/api/users", json=USER).json()
+    assert {k: created[k] for k in USER} == USER
+
+    changed = dict(USER, occupation="nurse", tech_comfort=3)
+    r = client.put(f"/api/users/{created['id']}", json=changed)
+    assert r.status_code == 200
+    fetched = client.get(f"/api/users/{created['id']}").json()
+    assert {k: fetched[k] for k in USER} == changed
+    assert created["id"] in [u["id"] for u in client.get("/api/users").json()]
+    assert client.get("/api/users/999999999").status_code == 404
+
+
+def test_selections_upsert_and_aggregate_deltas(api):
+    _, client = api
+    uid = client.post("/api/users", json=USER).json()["id"]
+    image_id = "Persona_4_Activity_103"
+    before = counts(client).get(image_id, (0, 0, 0))
+
+    r = client.put("/api/selections", json={"user_id": uid, "image_id": image_id, "selection": "A"})
+    assert r.status_code == 200
+    a, b, total = counts(client)[image_id]
+    assert (a - before[0], b - before[1], total - before[2]) == (1, 0, 1)
+
+    # 改票：A -1、B +1，总数不变
+    client.put("/api/selections", json={"user_id": uid, "image_id": image_id, "selection": "B"})
+    a, b, total = counts(client)[image_id]
+    assert (a - before[0], b - before[1], total - before[2]) == (0, 1, 1)
+
+    rows = client.get(f"/api/users/{uid}/selections").json()
+    assert [(s["image_id"], s["selection"]) for s in rows] == [(image_id, "B")]
+
+
+def test_export_resume_after_bare_user_id_skips_that_user(api):
+    _, client = api
+    uids = [client.post("/api/users", json=USER).json()["id"] for _ in range(2)]
+    for uid in uids:
+        for image_id in ("Persona_4_Activity_103", "Persona_4_Activity_114"):
+            client.put("/api/selections", json={"user_id": uid, "image_id": image_id, "selection": "A"})
+
+    def keys(**params):
+        return [(row["user_id"], row["image_id"]) for row in export(client, **params)]
+
+    assert len(keys(after_user_id=uids[0] - 1)) == 4
+    assert keys(after_user_id=uids[0]) == [(uids[1], "Persona_4_Activity_103"), (uids[1], "Persona_4_Activity_114")]
+    assert keys(after_user_id=uids[0], after_image_id="Persona_4_Activity_103") == [
+        (uids[0], "Persona_4_Activity_114"),
+        (uids[1], "Persona_4_Activity_103"),
+        (uids[1], "Persona_4_Activity_114"),
+    ]
+    r = client.get("/api/export/selections", params={"after_image_id": "Persona_4_Activity_103"})
+    assert r.status_code == 422
+
+
+def test_export_includes_user_columns_and_csv(api):
+    mod, client = api
+    uid = client.post("/api/users", json=USER).json()["id"]
+    client.put("/api/selections", json={"user_id": uid, "image_id": "Persona_4_Activity_103", "selection": "B"})
+
+    (row,) = export(client, include_users="true", after_user_id=uid - 1)
+    assert list(row) == mod.SELECTION_EXPORT_COLUMNS + mod.USER_EXPORT_COLUMNS
+    assert {k: row[k] for k in USER} == USER
+    assert (row["user_id"], row["image_id"], row["selection"]) == (uid, "Persona_4_Activity_103", "B")
+    assert row["updated_at"]
+
+    r = client.get("/api/export/selections", params={"format": "csv", "after_user_id": uid - 1})
+    lines = r.text.splitlines()
+    assert lines[0] == ",".join(mod.SELECTION_EXPORT_COLUMNS)
+    assert lines[1].startswith(f"{uid},Persona_4_Activity_103,B,")
+
+
+def test_oversized_notify_payload_becomes_resync(api):
+    mod, _ = api
+    small = mod.selection_event(1, "Persona_4_Activity_103", "A", None)
+    assert mod.notify_payload(small) == small
+    huge = mod.selection_event(1, "x" * 8000, "A", None)
+    assert mod.notify_payload(huge) == mod.RESYNC_EVENT
+
+
+def test_allocation_fills_k_when_personas_are_uneven(monkeypatch, tmp_path):
+    mod = load_backend(monkeypatch, tmp_path)
+    # persona 1 只有 1 张、persona 2 有 9 张：k=6 时上限 ceil(6/2)=3，光靠上限只能选 4 张
+    images = ["Persona_1_Activity_1"] + [f"Persona_2_Activity_{i}" for i in range(9)]
+    allocator = mod.StimulusAllocator(6)
+    allocator.generation = mod.stimulus_index.generation
+    allocator.sync(images)
+
+    seen = Counter()
+    for _ in range(5):
+        chosen = allocator._pick()
+        assert len(chosen) == 6 and len(set(chosen)) == 6
+        assert "Persona_1_Activity_1" in chosen
+        seen.update(chosen)
+    # 补上的图片也按曝光最少来选：5 次共 30 个位置，persona 2 的 9 张各 2~4 次
+    assert all(2 <= seen[i] <= 4 for i in images[1:]), seen
+    assert allocator.counts == seen
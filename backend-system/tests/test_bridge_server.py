@@ -0,0 +1,122 @@
+import asyncio
+import json
+from argparse import Namespace
+from contextlib import asynccontextmanager
+
+import pytest
+
+pytest.importorskip("websockets")
+
+from websockets.asyncio.client import connect  # noqa: E402
+from websockets.asyncio.server import serve  # noqa: E402
+
+import bridge_server  # noqa: E402
+
+# 与 bridge_server.main() 的默认值一致，测试里只改需要的
+DEFAULTS = {
+    "model_queue": 1024,
+    "ui_queue": 64,
+    "busy_timeout": 2.0,
+    "hello_timeout": 10.0,
+    "response_timeout": 120.0,
+    "session_ttl": 900.0,
+    "ping_interval": None,
+    "ping_timeout": None,
+    "max_message_bytes": 1 << 20,
+}
+
+
+@asynccontextmanager
+async def running_bridge(**overrides):
+    """在 127.0.0.1 的随机端口上起一个 bridge（与 run() 相同的后台任务），yield (bridge, base_url)。"""
+    bridge = bridge_server.Bridge(Namespace(**{**DEFAULTS, **overrides}))
+    background = [asyncio.create_task(bridge.model_sender()), asyncio.create_task(bridge.reaper())]
+    async with serve(bridge.handler, "127.0.0.1", 0, process_request=bridge.process_request) as server:
+        port = server.sockets[0].getsockname()[1]
+        try:
+            yield bridge, f"ws://127.0.0.1:{port}"
+        finally:
+            for t in background:
+                t.cancel()
+
+
+async def recv_json(conn, timeout=2.0):
+    return json.loads(await asyncio.wait_for(conn.recv(), timeout))
+
+
+async def wait_until(cond, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not cond():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+def test_hello_routes_both_ways_and_ignores_non_object_model_messages():
+    async def scenario():
+        async with running_bridge() as (bridge, url):
+            async with connect(f"{url}/model") as model, connect(f"{url}/ui") as ui:
+                await ui.send(json.dumps({"type": "hello", "user_id": "u1"}))
+                assert await recv_json(model) == {"type": "hello", "user_id": "u1", "session_id": "u1"}
+
+                # 不是 JSON object 的消息记为 unroutable，model 连接不能因此断掉
+                for raw in ("[1, 2]", '"text"', "42", "null"):
+                    await model.send(raw)
+                await model.send(json.dumps({"type": "response", "session_id": "u1", "text": "hi"}))
+                assert await recv_json(ui) == {"type": "response", "text": "hi"}
+                assert bridge.counters["unroutable"] == 4
+                assert bridge.model is not None
+
+    asyncio.run(scenario())
+
+
+def test_resume_delivers_replies_buffered_while_detached():
+    async def scenario():
+        async with running_bridge() as (bridge, url):
+            async with connect(f"{url}/model") as model:
+                async with connect(f"{url}/ui") as ui:
+                    await ui.send(json.dumps({"type": "hello", "user_id": "u1"}))
+                    await ui.send(json.dumps({"type": "context", "text": "cooking"}))
+                    await recv_json(model)
+                    assert (await recv_json(model))["type"] == "context"
+                await wait_until(lambda: bridge.sessions["u1"].ui is None)
+
+                await model.send(json.dumps({"type": "response", "session_id": "u1", "text": "late"}))
+                await wait_until(lambda: bridge.sessions["u1"].outbox.qsize() == 1)
+
+                async with connect(f"{url}/ui") as ui:
+                    await ui.send(json.dumps({"type": "hello", "user_id": "u1", "resume": True}))
+                    assert await recv_json(ui) == {"type": "response", "text": "late"}
+                assert bridge.counters["resumes"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_full_model_queue_answers_bridge_busy():
+    async def scenario():
+        # 没有 model 连接：model_sender 手里压一条，队列再放一条，第三条等 busy_timeout 后被拒
+        async with running_bridge(model_queue=1, busy_timeout=0.2) as (bridge, url):
+            async with connect(f"{url}/ui") as ui:
+                await ui.send(json.dumps({"type": "hello", "user_id": "u1"}))
+                for i in range(2):
+                    await ui.send(json.dumps({"type": "context", "text": str(i)}))
+                reply = await recv_json(ui)
+                assert reply["type"] == "error" and reply["code"] == "BRIDGE_BUSY"
+                assert bridge.counters["busy_rejections"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_silent_model_produces_model_timeout():
+    async def scenario():
+        async with running_bridge(response_timeout=0.2) as (bridge, url):
+            async with connect(f"{url}/model") as model, connect(f"{url}/ui") as ui:
+                await ui.send(json.dumps({"type": "hello", "user_id": "u1"}))
+                await ui.send(json.dumps({"type": "context", "text": "cooking"}))
+                await recv_json(model)
+                await recv_json(model)
+                # reaper 每秒扫一次
+                reply = await recv_json(ui, timeout=3.0)
+                assert reply["type"] == "error" and reply["code"] == "MODEL_TIMEOUT"
+                assert bridge.counters["timeouts"] == 1
+
+    asyncio.run(scenario())
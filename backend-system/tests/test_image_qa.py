@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("PIL")
+
+import image_qa  # noqa: E402
+
+PHASE_DATA = Path(__file__).resolve().parents[2] / "frontend-viewer" / "src" / "assets" / "PhaseData"
+
+# 与 image_qa.main() 的默认阈值一致
+DEFAULT_OPTS = {
+    "min_prominence": 8.0,
+    "max_irregularity": 0.15,
+    "min_orb": 0.001,
+    "max_orb": 0.12,
+    "min_orb_panels": 2,
+    "min_std": 6.0,
+    "washed_mean": 235.0,
+    "washed_sat": 20.0,
+}
+
+needs_phase_data = pytest.mark.skipif(not PHASE_DATA.is_dir(), reason="PhaseData stimuli not checked out")
+
+
+def qa(name: str) -> dict:
+    _, entry, err = image_qa.qa_one((str(PHASE_DATA / name), DEFAULT_OPTS))
+    assert err is None, err
+    return entry
+
+
+@needs_phase_data
+def test_known_good_stimulus_passes():
+    # orb 偏青（PIL 色相 ~133）、饱和度 ~100，旧阈值 (135, 178) / 90 一个都找不到
+    entry = qa("Persona_63_Activity_153.jpg")
+    assert entry["status"] != "fail", entry["issues"]
+    assert all(p["orbs"] >= 1 for p in entry["panels"].values())
+
+
+@needs_phase_data
+def test_pale_orb_is_detected():
+    # 淡青色 orb：饱和度只有 45 左右
+    entry = qa("Persona_17_Activity_175.jpg")
+    assert entry["status"] != "fail", entry["issues"]
+
+
+@needs_phase_data
+def test_curated_set_mostly_passes():
+    files = sorted(PHASE_DATA.glob("Persona_*_Activity_*.jpg"))
+    failed = [f.name for f in files if qa(f.name)["status"] == "fail"]
+    assert len(failed) <= len(files) // 20, failed
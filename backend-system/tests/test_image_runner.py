@@ -0,0 +1,50 @@
+import hashlib
+import json
+from argparse import Namespace
+
+from image_runner import read_approvals
+
+
+def write_report(path, items):
+    path.write_text(json.dumps({"items": items}), encoding="utf-8")
+
+
+def test_qa_approval_only_counts_for_the_preview_it_checked(tmp_path):
+    report = tmp_path / "qa_report.json"
+    write_report(report, {
+        "Persona_4_Activity_103.jpg": {"status": "pass", "sha1": "aaa"},
+        "Persona_4_Activity_114.jpg": {"status": "pass", "sha1": "old"},  # 预览之后又重画过
+        "Persona_4_Activity_118.jpg": {"status": "fail", "sha1": "ccc"},
+        "Persona_4_Activity_120.jpg": {"status": "pass"},  # 旧版报告没有 sha1
+    })
+    tiers = {
+        "Persona_4_Activity_103": {"preview": {"sha1": "aaa"}},
+        "Persona_4_Activity_114": {"preview": {"sha1": "new"}},
+        "Persona_4_Activity_118": {"preview": {"sha1": "ccc"}},
+        "Persona_4_Activity_120": {"preview": {"sha1": "ddd"}},
+    }
+    args = Namespace(approved=None, qa_report=str(report), accept_warn=False)
+    approved, rejected = read_approvals(args, tiers)
+    assert approved == {"Persona_4_Activity_103"}
+    assert rejected == {"Persona_4_Activity_118"}
+
+
+def test_manual_list_overrides_qa(tmp_path):
+    report = tmp_path / "qa_report.json"
+    write_report(report, {"Persona_4_Activity_118.jpg": {"status": "fail", "sha1": "ccc"}})
+    listed = tmp_path / "approved.txt"
+    listed.write_text("# reviewed\nPersona_4_Activity_118.jpg\n", encoding="utf-8")
+    args = Namespace(approved=str(listed), qa_report=str(report), accept_warn=False)
+    approved, rejected = read_approvals(args, {"Persona_4_Activity_118": {"preview": {"sha1": "ccc"}}})
+    assert approved == {"Persona_4_Activity_118"}
+    assert rejected == set()
+
+
+def test_legacy_tiers_entry_is_hashed_from_disk(tmp_path):
+    preview = tmp_path / "Persona_4_Activity_103.jpg"
+    preview.write_bytes(b"jpeg bytes")
+    report = tmp_path / "qa_report.json"
+    write_report(report, {preview.name: {"status": "pass", "sha1": hashlib.sha1(b"jpeg bytes").hexdigest()}})
+    args = Namespace(approved=None, qa_report=str(report), accept_warn=False)
+    approved, _ = read_approvals(args, {"Persona_4_Activity_103": {"preview": {"file": str(preview)}}})
+    assert approved == {"Persona_4_Activity_103"}
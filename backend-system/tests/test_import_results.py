@@ -0,0 +1,38 @@
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("fastapi")
+
+BACKEND = Path(__file__).resolve().parents[1] / "backend"
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    monkeypatch.syspath_prepend(str(BACKEND))
+    import import_results
+
+    return import_results.ResultBatch()
+
+
+def write_result(path: Path, phase1) -> Path:
+    path.write_text(
+        json.dumps({"userId": "7", "generatedAt": "2025-01-01T00:00:00Z", "pre": {}, "phaseI": phase1}),
+        encoding="utf-8",
+    )
+    return path
+
+
+def test_image_name_with_extension_becomes_stimulus_key(batch, tmp_path):
+    f = write_result(tmp_path / "r.json", [
+        {"persona": 4, "activity": 103, "imageName": "Persona_4_Activity_103.jpg", "choice": "A"},
+        {"persona": 4, "activity": 114, "imageName": "Persona_4_Activity_114", "choice": "B"},
+        {"imageName": "cat.jpg", "choice": "A"},
+        {"imageName": "Persona_4_Activity_118.jpg", "choice": "C"},
+    ])
+    batch.add_file(f)
+    assert set(batch.selections) == {(7, "Persona_4_Activity_103"), (7, "Persona_4_Activity_114")}
+    assert batch.stats["rejected_rows"] == 2
+    assert [r["imageName"] for r in batch.bad_rows] == ["cat.jpg", "Persona_4_Activity_118.jpg"]
@@ -0,0 +1,59 @@
+import json
+from pathlib import Path
+
+from output_schemas import SCHEMAS, SECTION4_SCHEMA, SECTION5_SCHEMA, validate
+
+TEMPLATES = Path(__file__).resolve().parents[1] / "templates"
+
+
+def template_example(name: str) -> dict:
+    """模板里 OUTPUT SCHEMA (JSON): 和 NOTES: 之间的示例输出。"""
+    text = (TEMPLATES / name).read_text(encoding="utf-8")
+    block = text.split("OUTPUT SCHEMA (JSON):", 1)[1].split("\nNOTES:", 1)[0]
+    return json.loads(block)
+
+
+def test_section4_template_example_matches_schema():
+    example = template_example("Section4_PersonaStyle.txt")
+    assert validate(example, SECTION4_SCHEMA) == []
+    assert set(example) == set(SECTION4_SCHEMA["required"])
+
+
+def test_section4_rejects_missing_and_extra_fields():
+    example = template_example("Section4_PersonaStyle.txt")
+    del example["negative_cues"]
+    example["mood_board"] = []
+    assert validate(example, SECTION4_SCHEMA) == [
+        "$: missing required key 'negative_cues'",
+        "$: unexpected key 'mood_board'",
+    ]
+
+
+def test_section5_template_example_matches_schema():
+    example = template_example("Section5_ActivityOfPanel.txt")
+    assert validate(example, SECTION5_SCHEMA) == []
+
+
+def test_section5_rejects_missing_panel_field():
+    example = template_example("Section5_ActivityOfPanel.txt")
+    del example["panels"][0]["narration"]
+    assert validate(example, SECTION5_SCHEMA) == ["$.panels[0]: missing required key 'narration'"]
+
+
+def collect_objects(schema: dict):
+    if schema.get("type") == "object":
+        yield schema
+        for sub in schema.get("properties", {}).values():
+            yield from collect_objects(sub)
+    if "items" in schema:
+        yield from collect_objects(schema["items"])
+
+
+def test_strict_schemas_follow_structured_output_rules():
+    # strict 模式下 API 要求每个 object 都列出全部 required 且 additionalProperties: false
+    for name, (schema, strict) in SCHEMAS.items():
+        if not strict:
+            continue
+        for obj in collect_objects(schema):
+            assert set(obj["required"]) == set(obj["properties"]), name
+            assert obj["additionalProperties"] is False, name
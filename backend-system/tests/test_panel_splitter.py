@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("PIL")
+
+from PIL import Image  # noqa: E402
+
+from panel_splitter import detect_panels  # noqa: E402
+
+PHASE_DATA = Path(__file__).resolve().parents[2] / "frontend-viewer" / "src" / "assets" / "PhaseData"
+
+needs_phase_data = pytest.mark.skipif(not PHASE_DATA.is_dir(), reason="PhaseData stimuli not checked out")
+
+
+def panels(name: str):
+    gray = np.asarray(Image.open(PHASE_DATA / name).convert("L"), dtype=np.float32)
+    boxes, fallback = detect_panels(gray, 8.0)
+    assert not fallback
+    return gray, boxes
+
+
+@needs_phase_data
+@pytest.mark.parametrize("name", ["Persona_17_Activity_110.jpg", "Persona_63_Activity_153.jpg"])
+def test_gutter_covers_the_whole_white_band(name):
+    # 这两张的 gutter 大约 18-24 px 宽；峰值只是 gutter 边缘最亮的那一列
+    gray, boxes = panels(name)
+    p1, p2, p3 = boxes["p1"], boxes["p2"], boxes["p3"]
+    gutter_x = (p1[0] + p1[2], p2[0])
+    gutter_y = (p1[1] + p1[3], p3[1])
+    assert 15 <= gutter_x[1] - gutter_x[0] <= 30
+    assert 15 <= gutter_y[1] - gutter_y[0] <= 30
+    # tile 左边不应再留着整条又亮又均匀的 gutter 列
+    edge = gray[p2[1] : p2[1] + p2[3], p2[0] : p2[0] + 3]
+    assert not ((edge.mean(axis=0) > 200) & (edge.std(axis=0) < 12)).any()
+
+
+@needs_phase_data
+def test_tiles_in_a_row_have_the_same_width():
+    _, boxes = panels("Persona_17_Activity_110.jpg")
+    assert boxes["p1"] == [18, 16, 486, 485]
+    assert abs(boxes["p1"][2] - boxes["p2"][2]) <= 2
+    assert abs(boxes["p3"][2] - boxes["p4"][2]) <= 2
@@ -0,0 +1,23 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from pyhci import SCRIPTS
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+@pytest.mark.parametrize("name", sorted(SCRIPTS))
+def test_script_help_exits_before_doing_work(name, tmp_path):
+    # bench-startup 会对每个子命令跑 --help：必须只打印用法，不能调模型或写文件
+    proc = subprocess.run(
+        [sys.executable, str(ROOT / "pyhci.py"), name, "--help"],
+        cwd=tmp_path, capture_output=True, text=True, timeout=60,
+    )
+    if "ModuleNotFoundError" in proc.stderr:
+        pytest.skip(proc.stderr.strip().splitlines()[-1])
+    assert proc.returncode == 0, proc.stderr
+    assert "usage:" in proc.stdout
+    assert list(tmp_path.iterdir()) == []
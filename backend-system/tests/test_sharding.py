@@ -0,0 +1,48 @@
+import json
+
+import sharding
+
+
+def write_manifest(path, shard, items, **extra):
+    path.write_text(json.dumps({"shard": list(shard), "items": items, **extra}), encoding="utf-8")
+    return path
+
+
+def test_merge_counts_only_done_image_items(tmp_path):
+    a = write_manifest(tmp_path / "a.json", (0, 2), [
+        {"key": "Persona_1_Activity_1", "status": "generated"},
+        {"key": "Persona_1_Activity_2", "status": "failed"},
+    ])
+    b = write_manifest(tmp_path / "b.json", (1, 2), [
+        {"key": "Persona_1_Activity_3", "status": "existing"},
+        {"key": "Persona_1_Activity_4", "status": "missing_prompt"},
+    ])
+    out, duplicates, _ = sharding.merge([a, b])
+    assert duplicates == {}
+    assert out["count"] == 2
+    assert out["failed"] == [
+        {"key": "Persona_1_Activity_2", "status": "failed"},
+        {"key": "Persona_1_Activity_4", "status": "missing_prompt"},
+    ]
+
+
+def test_merge_keeps_prompt_failures_unless_another_shard_succeeded(tmp_path):
+    a = write_manifest(tmp_path / "a.json", (0, 2), [], failed=[
+        {"key": "Persona_1_Activity_1", "section": 4, "reason": "timeout"},
+        {"key": "Persona_1_Activity_2", "section": 5},
+    ])
+    b = write_manifest(tmp_path / "b.json", (1, 2), [{"key": "Persona_1_Activity_2", "file": "p/Persona_1_Activity_2.txt"}])
+    out, _, _ = sharding.merge([a, b])
+    assert out["count"] == 1
+    assert out["failed"] == [{"key": "Persona_1_Activity_1", "section": 4, "reason": "timeout"}]
+
+
+def test_merge_carries_skip_list_items_that_no_shard_rendered(tmp_path):
+    a = write_manifest(tmp_path / "a.json", (0, 2), [{"key": "Persona_1_Activity_1", "status": "generated"}],
+                       skipped=["Persona_1_Activity_2"])
+    # 3 在另一次运行里渲染过，不再算跳过
+    b = write_manifest(tmp_path / "b.json", (1, 2), [{"key": "Persona_1_Activity_3", "status": "existing"}],
+                       skipped=["Persona_1_Activity_3", "Persona_1_Activity_4"])
+    out, _, _ = sharding.merge([a, b])
+    assert out["count"] == 2 and out["failed"] == []
+    assert out["skipped"] == ["Persona_1_Activity_2", "Persona_1_Activity_4"]